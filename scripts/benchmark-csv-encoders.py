@@ -0,0 +1,88 @@
+"""Data7 CSV encoders benchmark.
+
+Compare the pandas and Arrow CSV encoders per column type.
+
+You can run this script with the following command:
+
+uv run python scripts/benchmark-csv-encoders.py
+
+A temporary SQLite database is seeded with one table per column type.
+
+"""
+
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from rich.console import Console
+from rich.live import Live
+from rich.table import Table
+from sqlalchemy import create_engine
+
+from data7.config import settings
+from data7.models import Dataset
+from data7.streamers import sql2csv
+
+ROWS = 500_000
+CHUNK_SIZE = 10_000
+
+# Column type: SQL expression used to generate values (from a counter `n`)
+COLUMN_TYPES = {
+    "integer": "n",
+    "float": "n * 1.37",
+    "string": "'row-' || n || '-' || hex(randomblob(4))",
+    "timestamp": "datetime(1700000000 + n, 'unixepoch')",
+    "nullable": "CASE WHEN n % 3 = 0 THEN NULL ELSE n END",
+}
+
+console = Console()
+
+
+def seed(db_path: Path):
+    """Seed the database with one table per column type."""
+    connection = sqlite3.connect(db_path)
+    for name, expression in COLUMN_TYPES.items():
+        # ruff: noqa: S608
+        connection.executescript(f"""
+            CREATE TABLE {name} AS
+            WITH RECURSIVE counter(n) AS (
+                SELECT 1 UNION ALL SELECT n + 1 FROM counter WHERE n < {ROWS}
+            )
+            SELECT {expression} AS c1, {expression} AS c2, {expression} AS c3
+            FROM counter;
+            """)
+    connection.close()
+
+
+def stream(engine, dataset: Dataset, encoder: str) -> float:
+    """Stream a dataset using a CSV encoder and return the duration."""
+    settings.set("CSV_ENCODER", encoder)
+    start = time.perf_counter()
+    for _ in sql2csv(engine, dataset, chunksize=CHUNK_SIZE):
+        pass
+    return time.perf_counter() - start
+
+
+table = Table(title=f"Data7 CSV encoders benchmark ({ROWS} rows x 3 columns)")
+table.add_column("Column type")
+table.add_column("🐼 pandas (s)", justify="right")
+table.add_column("🏹 arrow (s)", justify="right")
+table.add_column("Speedup", justify="right")
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    db_path = Path(tmp_dir) / "benchmark.db"
+    with console.status("Seeding database..."):
+        seed(db_path)
+    engine = create_engine(f"sqlite:///{db_path}")
+
+    with Live(table, refresh_per_second=4):
+        for name in COLUMN_TYPES:
+            dataset = Dataset(basename=name, query=f"SELECT * FROM {name}")
+            pandas = stream(engine, dataset, "pandas")
+            arrow = stream(engine, dataset, "arrow")
+            table.add_row(
+                name, f"{pandas:.3f}", f"{arrow:.3f}", f"x{pandas / arrow:.2f}"
+            )
+
+    engine.dispose()
@@ -0,0 +1,89 @@
+"""Data7 import time benchmark.
+
+Measure the cold-start (import) time of the data7 CLI and of the web application
+(as imported by each uvicorn worker), and list heavy dependencies they load.
+
+You can run this script with the following command:
+
+uv run python scripts/benchmark-import-time.py
+
+It should be run from a configured project (_e.g._ the repository root after
+`make bootstrap`) as importing the application reads settings files.
+
+"""
+
+import statistics
+import subprocess
+import sys
+import time
+
+from rich.console import Console
+from rich.table import Table
+
+RUNS = 10
+HEAVY_MODULES = (
+    "pandas",
+    "pyarrow",
+    "sqlalchemy",
+    "uvicorn",
+    "sentry_sdk",
+    "pyinstrument",
+)
+TARGETS = {
+    "CLI (data7 init)": "import data7.cli",
+    "Application (uvicorn worker)": "import data7.app",
+}
+
+console = Console()
+
+
+def cold_start(statement: str) -> float:
+    """Get the duration of a fresh interpreter running a statement."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", statement], check=True)  # noqa: S603
+    return time.perf_counter() - start
+
+
+def loaded_modules(statement: str) -> list[str]:
+    """Get heavy modules loaded by a statement."""
+    output = subprocess.run(  # noqa: S603
+        [
+            sys.executable,
+            "-c",
+            (
+                f"import sys; {statement}; "
+                f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+            ),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return output.stdout.split()
+
+
+table = Table(title=f"Data7 import time benchmark ({RUNS} runs)")
+table.add_column("Target")
+table.add_column("Median (s)", justify="right")
+table.add_column("Min (s)", justify="right")
+table.add_column("Heavy modules loaded")
+
+baseline = [cold_start("pass") for _ in range(RUNS)]
+table.add_row(
+    "Python interpreter",
+    f"{statistics.median(baseline):.3f}",
+    f"{min(baseline):.3f}",
+    "",
+)
+
+for target, statement in TARGETS.items():
+    with console.status(f"Measuring {target}..."):
+        durations = [cold_start(statement) for _ in range(RUNS)]
+    table.add_row(
+        target,
+        f"{statistics.median(durations):.3f}",
+        f"{min(durations):.3f}",
+        ", ".join(loaded_modules(statement)),
+    )
+
+console.print(table)
@@ -0,0 +1,211 @@
+"""Data7 output sink benchmark.
+
+Compare Python allocations made to hand out Parquet and Arrow CSV writers output
+using a `BytesIO` (as `sql2parquet` and `sql2csv_arrow` did before
+`data7.sink.OutputSink`) or using the output sink Arrow stream (with and without
+coalescing).
+
+You can run this script with the following command:
+
+uv run python scripts/benchmark-output-sink.py
+
+Allocations are traced using `tracemalloc`: the traced memory peak reached (above
+the memory then in use) is sampled before and after each write to the output,
+and once each response chunk is handed out (chunks are kept). Sampled
+allocations are summed and compared to the output size (ratio). Arrow memory
+pool allocations (_e.g._ Parquet pages or the output stream buffer) are not
+counted.
+
+"""
+
+import tracemalloc
+from io import BytesIO
+from typing import Callable, Generator, Iterable, List, Tuple
+
+import pyarrow as pa
+from pyarrow import csv as pcsv
+from pyarrow import parquet as pq
+from rich.console import Console
+from rich.table import Table
+
+from data7.sink import OutputSink
+
+ROWS = 200_000
+CHUNK_SIZE = 1000
+FLUSH_SIZE = 65536
+
+Stream = Callable[[Iterable[pa.RecordBatch]], Generator[bytes, None, None]]
+
+console = Console()
+# Sampled allocations (total and memory in use at the last sample)
+allocations: List[int] = [0, 0]
+
+
+def sample():
+    """Add allocations made since the last sample."""
+    current, peak = tracemalloc.get_traced_memory()
+    allocations[0] += peak - allocations[1]
+    tracemalloc.reset_peak()
+    allocations[1] = current
+
+
+class TracedBytesIO(BytesIO):
+    """A BytesIO sampling allocations around writes."""
+
+    def write(self, b) -> int:  # type: ignore[override]
+        """Write a buffer."""
+        sample()
+        size = super().write(b)
+        sample()
+        return size
+
+
+class TracedOutputSink(OutputSink):
+    """An output sink sampling allocations around writes."""
+
+    def write(self, b) -> int:
+        """Keep a written buffer."""
+        sample()
+        size = super().write(b)
+        sample()
+        return size
+
+
+def get_batches() -> Iterable[pa.RecordBatch]:
+    """Get a numbers dataset record batches."""
+    table = pa.table(
+        {
+            "id": pa.array(range(ROWS)),
+            "label": pa.array([f"label {i}" for i in range(ROWS)]),
+            "value": pa.array([i * 1.5 for i in range(ROWS)]),
+        }
+    )
+    return table.to_batches(max_chunksize=CHUNK_SIZE)
+
+
+def bytesio_parquet(batches: Iterable[pa.RecordBatch]) -> Generator[bytes, None, None]:
+    """Stream Parquet output using a BytesIO (`sql2parquet` before the sink)."""
+    output = TracedBytesIO()
+
+    def get_batch(output: BytesIO) -> bytes:
+        """Get wrote batch content."""
+        size = output.tell()
+        output.seek(0)
+        return output.read(size)
+
+    batches = iter(batches)
+    first = next(batches)
+    writer = pq.ParquetWriter(output, schema=first.schema, compression="GZIP")
+    for batch in (first, *batches):
+        writer.write_batch(batch)
+        yield get_batch(output)
+        output.seek(0)
+    writer.close()
+    yield get_batch(output)
+    output.close()
+
+
+def bytesio_csv(batches: Iterable[pa.RecordBatch]) -> Generator[bytes, None, None]:
+    """Stream Arrow CSV output using a BytesIO (`sql2csv_arrow` before the sink)."""
+    output = TracedBytesIO()
+    writer = None
+    for batch in batches:
+        if writer is None:
+            writer = pcsv.CSVWriter(output, batch.schema)
+        writer.write_batch(batch)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    if writer is not None:
+        writer.close()
+    output.close()
+
+
+def sink_parquet(flush_size: int) -> Stream:
+    """Get a Parquet stream using the output sink (as `sql2parquet`)."""
+
+    def stream(batches: Iterable[pa.RecordBatch]) -> Generator[bytes, None, None]:
+        output = TracedOutputSink(flush_size)
+        batches = iter(batches)
+        first = next(batches)
+        writer = pq.ParquetWriter(
+            output.open_stream(), schema=first.schema, compression="GZIP"
+        )
+        for batch in (first, *batches):
+            writer.write_batch(batch)
+            yield from output.drain()
+        writer.close()
+        yield from output.drain(final=True)
+        output.close()
+
+    return stream
+
+
+def sink_csv(flush_size: int) -> Stream:
+    """Get an Arrow CSV stream using the output sink (as `sql2csv_arrow`)."""
+
+    def stream(batches: Iterable[pa.RecordBatch]) -> Generator[bytes, None, None]:
+        output = TracedOutputSink(flush_size)
+        writer = None
+        for batch in batches:
+            if writer is None:
+                writer = pcsv.CSVWriter(output.open_stream(), batch.schema)
+            writer.write_batch(batch)
+            yield from output.drain()
+        if writer is not None:
+            writer.close()
+        yield from output.drain(final=True)
+        output.close()
+
+    return stream
+
+
+def measure(stream: Stream) -> Tuple[int, int, int]:
+    """Get response chunks, output size and Python bytes allocated.
+
+    Chunks are kept until the end, so that a chunk freed does not hide allocations
+    made before the next sample.
+    """
+    batches = get_batches()
+    chunks: List[bytes] = []
+    tracemalloc.start()
+    allocations[:] = [0, tracemalloc.get_traced_memory()[0]]
+    try:
+        for chunk in stream(batches):
+            sample()
+            chunks.append(chunk)
+    finally:
+        tracemalloc.stop()
+    return len(chunks), sum(len(chunk) for chunk in chunks), allocations[0]
+
+
+table = Table(title=f"Output sinks allocations ({ROWS} rows, {CHUNK_SIZE} rows chunks)")
+table.add_column("Format")
+table.add_column("Output")
+table.add_column("Chunks", justify="right")
+table.add_column("Output (MiB)", justify="right")
+table.add_column("Allocated (MiB)", justify="right")
+table.add_column("Ratio", justify="right")
+
+for name, streams in (
+    ("Parquet", (bytesio_parquet, sink_parquet)),
+    ("Arrow CSV", (bytesio_csv, sink_csv)),
+):
+    bytesio, sink = streams
+    for label, stream in (
+        ("BytesIO", bytesio),
+        ("OutputSink", sink(0)),
+        (f"OutputSink ({FLUSH_SIZE // 1024} KiB)", sink(FLUSH_SIZE)),
+    ):
+        with console.status(f"Measuring {name} using {label}..."):
+            chunks, size, allocated = measure(stream)
+        table.add_row(
+            name,
+            label,
+            str(chunks),
+            f"{size / 2**20:.1f}",
+            f"{allocated / 2**20:.1f}",
+            f"{allocated / size:.2f}",
+        )
+
+console.print(table)
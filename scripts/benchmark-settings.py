@@ -0,0 +1,86 @@
+"""Data7 settings access benchmark.
+
+Compare the cost of settings reads done while serving a dataset request, using
+Dynaconf lookups or the compiled config snapshot (see `data7.config.get_config`).
+
+You can run this script with the following command:
+
+uv run python scripts/benchmark-settings.py
+
+It should be run from a configured project (_e.g._ the repository root after
+`make bootstrap`) as settings files are read.
+
+"""
+
+import timeit
+
+from rich.console import Console
+from rich.table import Table
+
+from data7.config import get_config, settings
+
+RUNS = 1000
+# Record batches per request (Arrow CSV options are read per batch)
+BATCHES = 20
+
+console = Console()
+
+
+def dynaconf_request() -> list:
+    """Read a request settings from Dynaconf."""
+    values: list = [
+        settings.CHUNK_SIZE,
+        settings.get("RENDER_CACHE_TTL", 0),
+        settings.get("STATEMENT_TIMEOUT"),
+        settings.get("MAX_ROWS"),
+        settings.get("MAX_BYTES"),
+        settings.get("RESULT_CACHE_TTL", 0),
+        settings.get("MATERIALIZE_TTL", 0),
+        settings.DEFAULT_DTYPE_BACKEND,
+        settings.get("CSV_ENCODER", "pandas"),
+        settings.get("OUTPUT_FLUSH_SIZE", 0),
+        settings.get("SLOW_REQUEST_THRESHOLD"),
+    ]
+    for _ in range(BATCHES):
+        values += [
+            settings.get("CSV_FLOAT_PRECISION"),
+            settings.get("CSV_TIMESTAMP_FORMAT"),
+            settings.get("CSV_NULL_VALUE"),
+        ]
+    return values
+
+
+def config_request() -> list:
+    """Read a request settings from the config snapshot."""
+    values: list = [
+        get_config().chunk_size,
+        get_config().render_cache_ttl,
+        get_config().statement_timeout,
+        get_config().max_rows,
+        get_config().max_bytes,
+        get_config().result_cache_ttl,
+        get_config().materialize_ttl,
+        get_config().default_dtype_backend,
+        get_config().csv_encoder,
+        get_config().output_flush_size,
+        get_config().slow_request_threshold,
+    ]
+    for _ in range(BATCHES):
+        values += [
+            get_config().csv_float_precision,
+            get_config().csv_timestamp_format,
+            get_config().csv_null_value,
+        ]
+    return values
+
+
+table = Table(title=f"Data7 settings reads per request ({BATCHES} batches)")
+table.add_column("Source")
+table.add_column("Per request (µs)", justify="right")
+
+for source, request in (("Dynaconf", dynaconf_request), ("Config", config_request)):
+    with console.status(f"Measuring {source}..."):
+        duration = min(timeit.repeat(request, number=RUNS, repeat=3)) / RUNS
+    table.add_row(source, f"{duration * 1e6:.1f}")
+
+console.print(table)
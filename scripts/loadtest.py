@@ -0,0 +1,499 @@
+"""Data7 load test.
+
+Drive the data7 application with concurrent dataset downloads and report, for
+each concurrency level: throughput, latency and time to first byte (TTFB)
+percentiles, database pool wait times (the `connect` stage of the
+`Server-Timing` header) and error rates.
+
+By default, the application is called in-process (as an ASGI application) and
+the worker threadpool usage, database pool usage and process CPU usage (a CPU
+usage close to 100% means the GIL is the bottleneck) are also sampled. Use the
+`--uvicorn` option to run the load test against local uvicorn workers instead.
+
+Unless a `--database-url` is given, a SQLite database is generated with a
+`Measure` table of `--rows` rows.
+
+You can run this script with the following command:
+
+uv run python scripts/loadtest.py --concurrency 1 --concurrency 8 --concurrency 32
+
+It should be run from a configured project (_e.g._ the repository root after
+`make bootstrap`). Use the `--output` option to save results as JSON and the
+`--baseline` option to compare results with a previous run (the script exits
+with an error if throughput or latency regressed beyond the `--tolerance`).
+"""
+
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Annotated, Dict, List, Optional
+
+import anyio
+import anyio.to_thread
+import httpx
+import typer
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+DATASET = "measures"
+COUNTRIES = ["Brazil", "France", "Germany", "India", "Japan", "USA"]
+LABELS = ["alpha", "beta", "gamma", "delta"]
+# HTTP requests timeout (in seconds)
+REQUEST_TIMEOUT = 300.0
+
+
+@dataclass
+class Sample:
+    """A request sample."""
+
+    status: int = 0
+    size: int = 0
+    ttfb: float = 0.0
+    latency: float = 0.0
+    # Server-Timing `connect` stage (pool wait and connection)
+    pool_wait: Optional[float] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class LevelResult:
+    """A concurrency level result."""
+
+    concurrency: int
+    requests: int
+    errors: int
+    duration: float
+    throughput: float
+    bandwidth: float
+    latency: Dict[str, float]
+    ttfb: Dict[str, float]
+    pool_wait: Dict[str, float]
+    # Sampled in-process only
+    threadpool_peak: Optional[int] = None
+    db_pool_peak: Optional[int] = None
+    cpu_usage: Optional[float] = None
+    error_messages: List[str] = field(default_factory=list)
+
+    @property
+    def error_rate(self) -> float:
+        """Get the ratio of failed requests."""
+        return self.errors / self.requests if self.requests else 0.0
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Get p50, p95 and p99 percentiles of values."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        f"p{q}": ordered[min(len(ordered) - 1, round(q / 100 * (len(ordered) - 1)))]
+        for q in (50, 95, 99)
+    }
+
+
+def parse_server_timing(value: str) -> Dict[str, float]:
+    """Parse a Server-Timing header value (durations in seconds)."""
+    stages = {}
+    for metric in filter(None, value.split(",")):
+        name, _, duration = metric.strip().partition(";dur=")
+        if duration:
+            stages[name] = float(duration) / 1000
+    return stages
+
+
+def generate_database(path: Path, rows: int):
+    """Generate a SQLite database with a `Measure` table."""
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE Measure ("
+        "id INTEGER PRIMARY KEY, label TEXT, country TEXT, value REAL, created TEXT"
+        ")"
+    )
+    connection.executemany(
+        "INSERT INTO Measure VALUES (?, ?, ?, ?, ?)",
+        (
+            (
+                i,
+                random.choice(LABELS),  # noqa: S311
+                random.choice(COUNTRIES),  # noqa: S311
+                random.random() * 1000,  # noqa: S311
+                f"2024-01-{i % 28 + 1:02d}T12:00:00",
+            )
+            for i in range(rows)
+        ),
+    )
+    connection.commit()
+    connection.close()
+
+
+def configure(database_url: str, query: str) -> Dict[str, str]:
+    """Get data7 settings environment variables for the load test."""
+    return {
+        "DATA7_DATABASE_URL": database_url,
+        "DATA7_DATASETS": "@json "
+        + json.dumps([{"basename": DATASET, "query": query}]),
+        "DATA7_PROFILING": "false",
+    }
+
+
+async def asgi_request(app, path: str, query_string: str) -> Sample:
+    """Stream a dataset from the ASGI application."""
+    sample = Sample()
+    done = anyio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            sample.status = message["status"]
+            for name, value in message["headers"]:
+                if name == b"server-timing":
+                    stages = parse_server_timing(value.decode())
+                    sample.pool_wait = stages.get("connect")
+        elif message["type"] == "http.response.body":
+            body = message.get("body", b"")
+            if body and not sample.size:
+                sample.ttfb = time.perf_counter() - start
+            sample.size += len(body)
+            if not message.get("more_body", False):
+                done.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string.encode(),
+        "headers": [(b"host", b"loadtest"), (b"accept-encoding", b"gzip")],
+        "server": ("loadtest", 80),
+        "client": ("127.0.0.1", 0),
+    }
+    start = time.perf_counter()
+    try:
+        await app(scope, receive, send)
+    except Exception as exc:
+        sample.error = repr(exc)
+    finally:
+        done.set()
+    sample.latency = time.perf_counter() - start
+    return sample
+
+
+async def http_request(client: httpx.AsyncClient, url: str) -> Sample:
+    """Stream a dataset from an HTTP server."""
+    sample = Sample()
+    start = time.perf_counter()
+    try:
+        async with client.stream("GET", url) as response:
+            sample.status = response.status_code
+            timing = response.headers.get("server-timing", "")
+            sample.pool_wait = parse_server_timing(timing).get("connect")
+            async for chunk in response.aiter_raw():
+                if chunk and not sample.size:
+                    sample.ttfb = time.perf_counter() - start
+                sample.size += len(chunk)
+    except httpx.HTTPError as exc:
+        sample.error = repr(exc)
+    sample.latency = time.perf_counter() - start
+    return sample
+
+
+async def run_level(request, concurrency: int, requests: int, sampler=None):
+    """Run requests with a given concurrency and aggregate samples."""
+    samples: List[Sample] = []
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            samples.append(await request())
+
+    peaks = {"threadpool": 0, "db_pool": 0}
+    sampling = True
+
+    async def sample_usage():
+        while sampling:
+            for name, value in sampler().items():
+                peaks[name] = max(peaks[name], value)
+            await asyncio.sleep(0.005)
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    async with anyio.create_task_group() as tg:
+        if sampler is not None:
+            tg.start_soon(sample_usage)
+        async with anyio.create_task_group() as workers:
+            for _ in range(concurrency):
+                workers.start_soon(worker)
+        sampling = False
+    duration = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    failed = [s for s in samples if s.error or s.status != 200]  # noqa: PLR2004
+    succeeded = [s for s in samples if s not in failed]
+    return LevelResult(
+        concurrency=concurrency,
+        requests=len(samples),
+        errors=len(failed),
+        duration=duration,
+        throughput=len(succeeded) / duration,
+        bandwidth=sum(s.size for s in succeeded) / duration,
+        latency=percentiles([s.latency for s in succeeded]),
+        ttfb=percentiles([s.ttfb for s in succeeded]),
+        pool_wait=percentiles(
+            [s.pool_wait for s in succeeded if s.pool_wait is not None]
+        ),
+        threadpool_peak=peaks["threadpool"] if sampler else None,
+        db_pool_peak=peaks["db_pool"] if sampler else None,
+        cpu_usage=cpu / duration if sampler else None,
+        error_messages=sorted({s.error or f"HTTP {s.status}" for s in failed}),
+    )
+
+
+async def run_in_process(
+    env: Dict[str, str], path: str, query_string: str, levels: List[int], requests: int
+) -> List[LevelResult]:
+    """Load test the application in-process."""
+    os.environ.update(env)
+    from data7.app import app, router  # noqa: PLC0415
+
+    pool = router.get_read_engine(None).pool
+    limiter = anyio.to_thread.current_default_thread_limiter()
+
+    def sampler():
+        return {"threadpool": limiter.borrowed_tokens, "db_pool": pool.checkedout()}
+
+    results = []
+    async with app.router.lifespan_context(app):
+        for concurrency in levels:
+            with console.status(f"Running {concurrency} concurrent requests..."):
+                results.append(
+                    await run_level(
+                        lambda: asgi_request(app, path, query_string),
+                        concurrency,
+                        requests,
+                        sampler,
+                    )
+                )
+    return results
+
+
+def get_free_port() -> int:
+    """Get a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_uvicorn(  # noqa: PLR0913, PLR0917
+    env: Dict[str, str],
+    path: str,
+    query_string: str,
+    levels: List[int],
+    requests: int,
+    workers: int,
+) -> List[LevelResult]:
+    """Load test the application served by local uvicorn workers."""
+    port = get_free_port()
+    server = subprocess.Popen(  # noqa: S603
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "data7.app:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        env={**os.environ, **env},
+    )
+    url = f"http://127.0.0.1:{port}{path}?{query_string}"
+    try:
+        async with httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT, limits=httpx.Limits(max_connections=max(levels))
+        ) as client:
+            with console.status("Waiting for uvicorn..."):
+                while True:
+                    try:
+                        await client.get(f"http://127.0.0.1:{port}/")
+                        break
+                    except httpx.TransportError:
+                        if server.poll() is not None:
+                            raise RuntimeError(
+                                "Uvicorn server failed to start"
+                            ) from None
+                        await asyncio.sleep(0.2)
+
+            results = []
+            for concurrency in levels:
+                with console.status(f"Running {concurrency} concurrent requests..."):
+                    results.append(
+                        await run_level(
+                            lambda: http_request(client, url), concurrency, requests
+                        )
+                    )
+            return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def ms(values: Dict[str, float], key: str) -> str:
+    """Format a duration percentile in milliseconds."""
+    return f"{values[key] * 1000:.1f}" if key in values else "-"
+
+
+def print_results(results: List[LevelResult], title: str):
+    """Print load test results."""
+    table = Table(title=f"{title} (durations in ms)")
+    for column in (
+        "Conc.",
+        "Req/s",
+        "MB/s",
+        "Lat. p50",
+        "Lat. p95",
+        "TTFB p50",
+        "TTFB p95",
+        "Pool p95",
+        "Threads",
+        "Conns",
+        "CPU",
+        "Errors",
+    ):
+        table.add_column(column, justify="right")
+
+    for result in results:
+        table.add_row(
+            str(result.concurrency),
+            f"{result.throughput:.1f}",
+            f"{result.bandwidth / 1e6:.1f}",
+            ms(result.latency, "p50"),
+            ms(result.latency, "p95"),
+            ms(result.ttfb, "p50"),
+            ms(result.ttfb, "p95"),
+            ms(result.pool_wait, "p95"),
+            "-" if result.threadpool_peak is None else str(result.threadpool_peak),
+            "-" if result.db_pool_peak is None else str(result.db_pool_peak),
+            "-" if result.cpu_usage is None else f"{result.cpu_usage:.0%}",
+            f"{result.error_rate:.1%}",
+        )
+    console.print(table)
+
+    for result in results:
+        for message in result.error_messages:
+            console.print(f"❌ [{result.concurrency}] {message}")
+
+
+def compare(results: List[LevelResult], baseline: List[dict], tolerance: float) -> bool:
+    """Compare results with a baseline, returns False if performance regressed."""
+    previous = {level["concurrency"]: level for level in baseline}
+    ok = True
+    for result in results:
+        if (level := previous.get(result.concurrency)) is None:
+            continue
+        checks = [
+            ("throughput", result.throughput, level["throughput"], -1),
+            ("latency p95", result.latency.get("p95"), level["latency"].get("p95"), 1),
+        ]
+        for name, current, reference, direction in checks:
+            if not current or not reference:
+                continue
+            change = (current - reference) / reference
+            regressed = change * direction > tolerance
+            ok = ok and not regressed
+            console.print(
+                f"{'❌' if regressed else '✅'} [{result.concurrency}] {name}: "
+                f"{change:+.1%} vs baseline"
+            )
+    return ok
+
+
+def main(  # noqa: PLR0913, PLR0917
+    concurrency: Annotated[
+        Optional[List[int]],
+        typer.Option("--concurrency", "-c", help="Concurrency level(s)."),
+    ] = None,
+    requests: Annotated[
+        int, typer.Option("--requests", "-n", help="Requests per concurrency level.")
+    ] = 50,
+    extension: Annotated[str, typer.Option(help="Output format.")] = "csv",
+    query_string: Annotated[
+        str, typer.Option(help="Request query string, e.g. select=id.")
+    ] = "",
+    rows: Annotated[int, typer.Option(help="Generated database rows.")] = 100_000,
+    database_url: Annotated[
+        Optional[str], typer.Option(help="Use this database instead.")
+    ] = None,
+    query: Annotated[
+        str, typer.Option(help="Dataset SQL query.")
+    ] = "SELECT * FROM Measure",
+    uvicorn: Annotated[
+        bool, typer.Option(help="Load test local uvicorn workers.")
+    ] = False,
+    workers: Annotated[int, typer.Option(help="Uvicorn workers.")] = 1,
+    output: Annotated[Optional[Path], typer.Option(help="Save results (JSON).")] = None,
+    baseline: Annotated[
+        Optional[Path], typer.Option(help="Compare with saved results (JSON).")
+    ] = None,
+    tolerance: Annotated[float, typer.Option(help="Tolerated regression ratio.")] = 0.1,
+):
+    """Load test data7 with concurrent dataset downloads."""
+    levels = concurrency or [1, 4, 16]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if database_url is None:
+            db_path = Path(tmp) / "loadtest.db"
+            with console.status(f"Generating a {rows} rows database..."):
+                generate_database(db_path, rows)
+            database_url = f"sqlite:///{db_path}"
+
+        env = configure(database_url, query)
+        path = f"/d/{DATASET}.{extension}"
+        if uvicorn:
+            title = f"{path} load test ({workers} uvicorn worker(s))"
+            results = asyncio.run(
+                run_uvicorn(env, path, query_string, levels, requests, workers)
+            )
+        else:
+            title = f"{path} load test (in-process)"
+            results = asyncio.run(
+                run_in_process(env, path, query_string, levels, requests)
+            )
+
+    print_results(results, title)
+
+    if output is not None:
+        output.write_text(json.dumps([asdict(r) for r in results], indent=2))
+        console.print(f"💾 Results saved to {output}")
+
+    if baseline is not None and not compare(
+        results, json.loads(baseline.read_text()), tolerance
+    ):
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
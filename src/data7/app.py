@@ -1,49 +1,87 @@
 """Data7 application module."""
 
+import asyncio
 import contextlib
+import functools
 import importlib.metadata
 import logging
-from pathlib import PurePath
-from typing import Callable, Generator, List, Optional, Tuple
+import random
+import time
+import tracemalloc
+from dataclasses import asdict
+from pathlib import Path, PurePath
+from typing import (
+    TYPE_CHECKING,
+    AsyncGenerator,
+    Callable,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
-import sentry_sdk
-from pyinstrument import Profiler
-from sentry_sdk.integrations.starlette import StarletteIntegration
-from sqlalchemy import Engine, create_engine
+import anyio
+import anyio.to_thread
 from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
 from starlette.exceptions import HTTPException
 from starlette.middleware import Middleware
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.gzip import GZipMiddleware
 from starlette.requests import Request
-from starlette.responses import HTMLResponse, StreamingResponse
+from starlette.responses import (
+    HTMLResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
 from starlette.routing import Route
-from starlette.status import HTTP_501_NOT_IMPLEMENTED
-
-from .config import settings
-from .models import Dataset, Extension, MimeType
-from .streamers import sql2csv, sql2parquet
+from starlette.status import (
+    HTTP_400_BAD_REQUEST,
+    HTTP_413_CONTENT_TOO_LARGE,
+    HTTP_501_NOT_IMPLEMENTED,
+    HTTP_504_GATEWAY_TIMEOUT,
+)
+from starlette.types import Receive, Scope, Send
+
+from .bundle import BUNDLE_ARGUMENT, BundleError, get_bundle_members, stream_bundle
+from .cancellation import Cancellation, current_cancellation
+from .catalog import catalog
+from .config import get_config, load_config, settings
+from .databases import DatabaseRouter, get_pool_monitor_interval
+from .formats import Format, formats
+from .limits import LimitExceeded, StatementTimeout
+from .memory import MemoryUsage, current_memory
+from .models import Dataset, FilterError
+from .render import get_render_path, render_cached
+from .throttling import Throttle, get_throttler
+from .timing import Timings, current_timings, measure
 from .utils import populate_datasets
 
+if TYPE_CHECKING:
+    from pyinstrument import Profiler
+
 logger = logging.getLogger(__name__)
 
+# Non-standard status code (from nginx) logged for requests cancelled by clients
+HTTP_499_CLIENT_CLOSED_REQUEST = 499
+
 
 def get_dataset_from_url(
     url_path: PurePath, datasets: List[Dataset]
-) -> Tuple[Dataset, Extension]:
-    """Get dataset and extension from query URL path."""
+) -> Tuple[Dataset, Format]:
+    """Get dataset and format from query URL path."""
     basename, ext = url_path.name.split(".")
-    try:
-        extension = Extension[ext.upper()]
-    except KeyError as exc:
-        raise ValueError(f"Data7 extension '{ext}' is not supported") from exc
+    fmt = formats.get(ext)
 
     dataset = next((d for d in datasets if d.basename == basename), None)
 
     if dataset is None:
         raise ValueError("Requested dataset is not registered")
 
-    return dataset, extension
+    return dataset, fmt
 
 
 def get_routes_from_datasets(datasets):
@@ -54,51 +92,280 @@ def get_routes_from_datasets(datasets):
             stream_dataset,
         )
         for dataset in datasets
-        for extension in Extension
+        for extension in formats.extensions
     ]
 
 
-async def stream_dataset(request: Request) -> StreamingResponse:
+def next_chunk(chunks: Iterator, sentinel: object, cancellation: Cancellation):
+    """Get the next chunk (to run in a threadpool) with the request cancellation."""
+    token = current_cancellation.set(cancellation)
+    try:
+        return next(chunks, sentinel)
+    finally:
+        current_cancellation.reset(token)
+
+
+async def watch_disconnect(receive: Receive, cancellation: Cancellation):
+    """Cancel request database work when the client disconnects."""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+    logger.info("Client disconnected, cancelling database work")
+    await run_in_threadpool(cancellation.cancel)
+
+
+async def prefetch(
+    chunks: Generator,
+    cancellation: Cancellation,
+    receive: Receive,
+    throttle: Optional[Throttle] = None,
+) -> Optional[AsyncGenerator]:
+    """Iterate over chunks in a threadpool, the first chunk being prefetched.
+
+    Prefetching the first chunk before the response starts allows to report
+    connection and first query chunk timings in response headers.
+
+    Database work is cancelled as soon as the client disconnects: None is returned
+    if it disconnects before the first chunk has been fetched.
+
+    If a throttle is given, the next chunk is fetched once the current chunk
+    size has been drawn from the client bucket (see `data7.throttling`).
+    """
+    sentinel = object()
+    watcher = asyncio.create_task(watch_disconnect(receive, cancellation))
+
+    async def close():
+        watcher.cancel()
+        with anyio.CancelScope(shield=True):
+            await run_in_threadpool(chunks.close)
+
+    try:
+        first = await run_in_threadpool(next_chunk, chunks, sentinel, cancellation)
+    except Exception:
+        await close()
+        if cancellation.cancelled:
+            logger.info("Request cancelled before the first chunk")
+            return None
+        raise
+
+    async def iterate():
+        try:
+            chunk = first
+            while chunk is not sentinel:
+                yield chunk
+                limiter = None
+                if throttle is not None:
+                    await throttle.consume(len(chunk))
+                    limiter = throttle.limiter
+                chunk = await anyio.to_thread.run_sync(
+                    functools.partial(next_chunk, chunks, sentinel, cancellation),
+                    limiter=limiter,
+                )
+        except LimitExceeded as exc:
+            # The response is aborted so that clients detect it is incomplete
+            logger.warning("Stream aborted: %s", exc)
+            raise
+        except Exception:
+            if not cancellation.cancelled:
+                raise
+            logger.info("Request cancelled while streaming")
+        finally:
+            await close()
+
+    return iterate()
+
+
+class DatasetResponse(StreamingResponse):
+    """A streaming response that always closes its body iterator.
+
+    The body iterator is closed as soon as the response ends (even if the client
+    disconnected) so that database connections are released without waiting for
+    the iterator to be garbage collected.
+
+    If set, the `on_complete` callback is called with the response body size once
+    the whole body has been sent.
+    """
+
+    def __init__(
+        self,
+        content: AsyncGenerator,
+        media_type: str,
+        on_complete: Optional[Callable[[int], None]] = None,
+    ):
+        """Create the response."""
+        super().__init__(content, media_type=media_type)
+        self.on_complete = on_complete
+
+    async def stream_response(self, send: Send) -> None:
+        """Stream the response and measure the body size."""
+        size = 0
+
+        async def send_and_measure(message):
+            nonlocal size
+            if message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        await super().stream_response(send_and_measure)
+        if self.on_complete is not None:
+            self.on_complete(size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Stream the response and close the body iterator."""
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()  # type: ignore[attr-defined]
+
+
+async def stream_dataset(request: Request) -> Response:
     """Stream given dataset."""
     try:
-        dataset, extension = get_dataset_from_url(
+        dataset, fmt = get_dataset_from_url(
             PurePath(request.url.path), app.state.datasets
         )
     except ValueError as exc:
         raise HTTPException(
             status_code=HTTP_501_NOT_IMPLEMENTED, detail=str(exc)
         ) from exc
-    media_type = MimeType[extension.name]
-
-    streamer: Optional[Callable[[Engine, Dataset, int], Generator]] = None
-    if extension == Extension.CSV:
-        streamer = sql2csv
-    elif extension == Extension.PARQUET:
-        streamer = sql2parquet
-    if streamer is None:
+
+    # Query string arguments are dataset parameters values
+    try:
+        dataset = dataset.bind(request.query_params)
+    except ValueError as exc:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+
+    try:
+        streamer = fmt.streamer
+    except (ImportError, AttributeError) as exc:
         raise HTTPException(
             status_code=HTTP_501_NOT_IMPLEMENTED,
-            detail=f"Streamer for extension '{extension}' does not exist",
+            detail=f"Streamer for extension '{fmt}' does not exist",
+        ) from exc
+
+    config = get_config()
+    render = functools.partial(
+        streamer,
+        router.get_read_engine(dataset.database),
+        dataset,
+        chunksize=config.chunk_size,
+    )
+    if config.render_cache_ttl:
+        chunks = render_cached(
+            get_render_path(dataset, fmt.extension),
+            render,
+            config.render_cache_ttl,
+            config.render_cache_lock_timeout,
+            config.render_cache_max_bytes,
         )
+    else:
+        chunks = render()
+    return await stream_chunks(
+        request,
+        chunks,
+        fmt.media_type,
+        on_complete=functools.partial(catalog.record_size, dataset, fmt.extension),
+    )
+
+
+async def stream_bundle_archive(request: Request) -> Response:
+    """Stream a bundle of datasets queried in a single snapshot."""
+    try:
+        members = get_bundle_members(
+            request.query_params.get(BUNDLE_ARGUMENT, ""), app.state.datasets
+        )
+    except BundleError as exc:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+
+    chunks = stream_bundle(
+        router.get_read_engine(members[0][0].database),
+        members,
+        chunksize=get_config().chunk_size,
+    )
+    return await stream_chunks(request, chunks, "application/zip")
+
+
+async def stream_chunks(
+    request: Request,
+    chunks: Generator,
+    media_type: str,
+    on_complete: Optional[Callable[[int], None]] = None,
+) -> Response:
+    """Stream chunks, the first chunk being prefetched (see `prefetch`).
+
+    Errors raised before the response starts are turned into HTTP errors. Chunks
+    are throttled per client if the `THROTTLE_RATE` setting is set. The
+    `on_complete` callback is called with the response size once all chunks have
+    been sent (unless the client disconnected).
+    """
+    cancellation = Cancellation()
+    throttler = get_throttler()
+    throttle = throttler.throttle(request) if throttler is not None else None
+    try:
+        body = await prefetch(chunks, cancellation, request.receive, throttle)
+    except FilterError as exc:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    except StatementTimeout as exc:
+        raise HTTPException(
+            status_code=HTTP_504_GATEWAY_TIMEOUT, detail=str(exc)
+        ) from exc
+    except LimitExceeded as exc:
+        raise HTTPException(
+            status_code=HTTP_413_CONTENT_TOO_LARGE, detail=str(exc)
+        ) from exc
+    if body is None:
+        return Response(status_code=HTTP_499_CLIENT_CLOSED_REQUEST)
+
+    def complete(size: int):
+        # Streams cancelled by clients end early
+        if on_complete is not None and not cancellation.cancelled:
+            on_complete(size)
+
+    return DatasetResponse(body, media_type=media_type, on_complete=complete)
+
 
-    return StreamingResponse(
-        streamer(engine, dataset, chunksize=settings.CHUNK_SIZE),
-        media_type=media_type,
+async def get_catalog(request: Request) -> JSONResponse:
+    """Get the datasets catalog."""
+    return JSONResponse(
+        {"datasets": [catalog.describe(dataset) for dataset in app.state.datasets]}
     )
 
 
+async def get_pools(request: Request) -> JSONResponse:
+    """Get databases connection pools status and statistics."""
+    return JSONResponse({"databases": router.describe()})
+
+
+async def get_result_cache_stats(request: Request) -> JSONResponse:
+    """Get query results cache statistics (null if the cache is disabled)."""
+    from .cache import get_result_cache  # noqa: PLC0415
+
+    cache = get_result_cache()
+    return JSONResponse(
+        {"result_cache": asdict(cache.stats) if cache is not None else None}
+    )
+
+
+# Settings used on the request path are compiled (and checked) once at startup
+logger.debug("Config: %s", load_config())
+
 # Database
 logger.debug(f"{settings.DATABASE_URL=}")
-engine = create_engine(
-    settings.DATABASE_URL,
-    pool_pre_ping=settings.db_pool_check,
-    pool_recycle=settings.db_pool_recycle,
-    pool_size=settings.db_pool_size,
-    max_overflow=settings.db_pool_max_overflow,
-)
+router = DatabaseRouter.from_settings()
+engine = router.get_engine()
 
 # Routes
 routes = get_routes_from_datasets(settings.datasets)
+if settings.get("CATALOG_URL"):
+    routes += [Route(settings.CATALOG_URL, get_catalog)]
+if settings.get("BUNDLE_URL"):
+    routes += [Route(settings.BUNDLE_URL, stream_bundle_archive)]
+if settings.get("DB_POOL_STATS_URL"):
+    routes += [Route(settings.DB_POOL_STATS_URL, get_pools)]
+if settings.get("RESULT_CACHE_STATS_URL"):
+    routes += [Route(settings.RESULT_CACHE_STATS_URL, get_result_cache_stats)]
 logger.debug("Registered routes:\n%s", "\n".join([route.path for route in routes]))
 
 
@@ -116,9 +383,11 @@ class ProfilingMiddleware(BaseHTTPMiddleware):
         if not request.query_params.get("profile", False):
             return await call_next(request)
 
+        from pyinstrument import Profiler  # noqa: PLC0415
+
+        config = get_config()
         profiler = Profiler(
-            interval=settings.PROFILER_INTERVAL,
-            async_mode=settings.PROFILER_ASYNC_MODE,
+            interval=config.profiler_interval, async_mode=config.profiler_async_mode
         )
         profiler.start()
         response = await call_next(request)
@@ -131,13 +400,281 @@ class ProfilingMiddleware(BaseHTTPMiddleware):
         return HTMLResponse(profiler.output_html())
 
 
+class TimingMiddleware:
+    """A request stages timing middleware.
+
+    Stages (connect, first-chunk, fetch, encode, send) timed before the response
+    starts are sent in the `Server-Timing` header. All stages timings are sent as
+    `Server-Timing` trailers (if supported by the server) and logged. If the
+    wrapped app sends its own trailers, timings are added to them.
+
+    If the `slow_request_threshold` setting is set, sampled requests are profiled
+    and pyinstrument sessions of requests slower than the threshold are saved to
+    the `slow_request_profiles_dir` directory. Responses are left untouched.
+    """
+
+    def __init__(self, app):
+        """Wrap the ASGI app."""
+        self.app = app
+
+    def start_profiler(self) -> Optional["Profiler"]:
+        """Start a slow request profiler (if the request is sampled)."""
+        config = get_config()
+        if config.slow_request_threshold is None:
+            return None
+        if random.random() >= config.slow_request_sample_rate:  # noqa: S311
+            return None
+
+        from pyinstrument import Profiler  # noqa: PLC0415
+
+        profiler = Profiler(
+            interval=config.profiler_interval, async_mode=config.profiler_async_mode
+        )
+        try:
+            profiler.start()
+        except RuntimeError:
+            # Another profiler is already running in this context
+            return None
+        return profiler
+
+    def save_profile(self, profiler: "Profiler", path: str, duration: float):
+        """Save a slow request profiling session."""
+        session = profiler.stop()
+        config = get_config()
+        threshold = config.slow_request_threshold
+        if threshold is None or duration < threshold:
+            return
+        profiles_dir = Path(config.slow_request_profiles_dir)
+        profiles_dir.mkdir(parents=True, exist_ok=True)
+        name = "-".join(
+            (
+                time.strftime("%Y%m%dT%H%M%S"),
+                path.strip("/").replace("/", "_"),
+                f"{duration * 1000:.0f}ms",
+            )
+        )
+        session.save(profiles_dir / f"{name}.pyisession")
+        logger.warning("Slow request %s profiled (%s.pyisession)", path, name)
+
+    async def __call__(self, scope, receive, send):
+        """Time request stages."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = Timings()
+        token = current_timings.set(timings)
+        trailers = "http.response.trailers" in scope.get("extensions", {})
+        app_trailers = False
+        status = None
+
+        async def send_with_timings(message):
+            nonlocal status, app_trailers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                app_trailers = message.get("trailers", False)
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.to_header())
+                if trailers:
+                    headers.append("Trailer", "Server-Timing")
+                    message["trailers"] = True
+                await send(message)
+                return
+
+            if message["type"] == "http.response.trailers":
+                if not message.get("more_trailers", False):
+                    message["headers"] = [
+                        *message["headers"],
+                        (b"server-timing", timings.to_header(total=True).encode()),
+                    ]
+                await send(message)
+                return
+
+            with measure("send"):
+                await send(message)
+            if trailers and not app_trailers and not message.get("more_body", False):
+                await send(
+                    {
+                        "type": "http.response.trailers",
+                        "headers": [
+                            (b"server-timing", timings.to_header(total=True).encode())
+                        ],
+                        "more_trailers": False,
+                    }
+                )
+
+        profiler = self.start_profiler()
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            current_timings.reset(token)
+            duration = timings.total
+            if profiler is not None:
+                self.save_profile(profiler, scope["path"], duration)
+            logger.info(
+                "%s %s %s timings: %s",
+                scope["method"],
+                scope["path"],
+                status,
+                timings.to_header(total=True),
+                extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "timings": {**timings.stages, "total": duration},
+                },
+            )
+
+
+class MemoryMiddleware:
+    """A request stages memory tracking middleware.
+
+    The memory tracking middleware is active if the `memory_tracking` setting is
+    set to True. Stages (fetch, convert, encode) peak memory usage and Arrow
+    allocated memory tracked before the response starts are sent in the
+    `Server-Memory` header. All stages memory usage is sent as `Server-Memory`
+    trailers (if supported by the server) and logged.
+    """
+
+    def __init__(self, app):
+        """Wrap the ASGI app."""
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        """Track request stages memory usage."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        memory = MemoryUsage()
+        token = current_memory.set(memory)
+        trailers = "http.response.trailers" in scope.get("extensions", {})
+
+        async def send_with_memory(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Memory", memory.to_header())
+                if trailers:
+                    headers.append("Trailer", "Server-Memory")
+                    message["trailers"] = True
+            await send(message)
+            if (
+                trailers
+                and message["type"] == "http.response.body"
+                and not message.get("more_body", False)
+            ):
+                await send(
+                    {
+                        "type": "http.response.trailers",
+                        "headers": [(b"server-memory", memory.to_header().encode())],
+                        "more_trailers": False,
+                    }
+                )
+
+        try:
+            await self.app(scope, receive, send_with_memory)
+        finally:
+            current_memory.reset(token)
+            logger.info(
+                "%s %s memory: %s",
+                scope["method"],
+                scope["path"],
+                memory,
+                extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "memory": memory.to_dict(),
+                },
+            )
+
+
 # App
+async def check_databases_health(interval: float):
+    """Periodically check databases replicas health."""
+    while True:
+        await run_in_threadpool(router.check_health)
+        await asyncio.sleep(interval)
+
+
+async def monitor_pools(interval: float):
+    """Periodically validate and refill databases connection pools."""
+    while True:
+        await run_in_threadpool(router.monitor)
+        await asyncio.sleep(interval)
+
+
+async def refresh_samples(interval: float):
+    """Periodically refresh datasets head samples."""
+    from .preview import capture_samples  # noqa: PLC0415
+
+    while True:
+        await asyncio.sleep(interval)
+        await run_in_threadpool(capture_samples, app.state.datasets, engine, router)
+
+
+async def refresh_catalog(interval: float, computed: bool = False):
+    """Compute datasets metadata (if not computed), then periodically refresh them."""
+    if not computed:
+        await run_in_threadpool(catalog.refresh_all, app.state.datasets, engine, router)
+    while interval:
+        await asyncio.sleep(interval)
+        await run_in_threadpool(catalog.refresh_all, app.state.datasets, engine, router)
+
+
+def start_background_tasks(preloaded: bool) -> List[asyncio.Task]:
+    """Start enabled background tasks (health checks, monitoring and refreshes)."""
+    tasks = []
+    if router.has_replicas and settings.db_health_check_interval:
+        tasks.append(
+            asyncio.create_task(
+                check_databases_health(settings.db_health_check_interval)
+            )
+        )
+    if interval := get_pool_monitor_interval():
+        tasks.append(asyncio.create_task(monitor_pools(interval)))
+    if get_config().preview_rows and settings.get("PREVIEW_REFRESH_INTERVAL", 0):
+        tasks.append(
+            asyncio.create_task(refresh_samples(settings.PREVIEW_REFRESH_INTERVAL))
+        )
+    if settings.get("CATALOG_URL"):
+        tasks.append(
+            asyncio.create_task(
+                refresh_catalog(
+                    settings.get("CATALOG_REFRESH_INTERVAL", 0), computed=preloaded
+                )
+            )
+        )
+    return tasks
+
+
 @contextlib.asynccontextmanager
 async def lifespan(app):
-    """Application lifespan."""
-    app.state.datasets = populate_datasets(engine)
+    """Application lifespan.
+
+    Datasets are validated, unless they have been preloaded (see
+    `data7.server`). If the `db_pool_warmup` setting is set, databases connection
+    pools are filled before the application accepts requests. If the
+    `db_pool_monitor_interval` setting is set, pools are then monitored in the
+    background.
+    """
+    preloaded = getattr(app.state, "preloaded", False)
+    if not preloaded:
+        app.state.datasets = populate_datasets(engine, router)
+    if settings.get("DB_POOL_WARMUP", False):
+        await run_in_threadpool(router.warm_up)
+
+    memory_tracking = settings.get("MEMORY_TRACKING", False)
+    if memory_tracking and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    tasks = start_background_tasks(preloaded)
 
     if settings.SENTRY_DSN is not None:
+        import sentry_sdk  # noqa: PLC0415
+        from sentry_sdk.integrations.starlette import (  # noqa: PLC0415
+            StarletteIntegration,
+        )
+
         sentry_sdk.init(
             dsn=str(settings.SENTRY_DSN),
             enable_tracing=settings.SENTRY_ENABLE_TRACING,
@@ -151,14 +688,23 @@ async def lifespan(app):
         )
 
     yield
-    engine.dispose()
-
-
-middleware = [Middleware(GZipMiddleware, minimum_size=1000)]
+    if memory_tracking:
+        tracemalloc.stop()
+    for task in tasks:
+        task.cancel()
+    router.dispose()
+
+
+middleware = []
+if settings.get("SERVER_TIMING", True):
+    middleware += [Middleware(TimingMiddleware)]
+if settings.get("MEMORY_TRACKING", False):
+    middleware += [Middleware(MemoryMiddleware)]
+middleware += [Middleware(GZipMiddleware, minimum_size=1000)]
 if settings.profiling:
     middleware += [Middleware(ProfilingMiddleware)]
 
-logger.info("Active extensions: %s", ", ".join(e for e in Extension))
+logger.info("Active extensions: %s", ", ".join(formats.extensions))
 
 app = Starlette(
     routes=routes,
@@ -0,0 +1,195 @@
+"""Data7 benchmark module.
+
+Profile configured datasets against the configured database to tune streaming
+settings (chunk size, schema sniffer size and dtype backend).
+"""
+
+import inspect
+import logging
+import time
+import tracemalloc
+from dataclasses import dataclass, field, replace
+from itertools import product
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pyarrow as pa
+from pyinstrument import Profiler
+from pyinstrument.session import Session
+from sqlalchemy import Engine
+from sqlalchemy.sql import text
+
+from .config import get_config
+from .formats import Format, formats
+from .models import Dataset
+from .streamers import fetch_batches
+
+logger = logging.getLogger(__name__)
+
+# Default benchmark grid
+BENCH_CHUNK_SIZES: List[int] = [1000, 5000, 10000]
+BENCH_DTYPE_BACKENDS: List[str] = ["numpy_nullable", "pyarrow"]
+
+
+def is_tunable(fmt: Format) -> bool:
+    """Check if a format streamer supports dtype backend / schema sniffer tuning."""
+    parameters = inspect.signature(fmt.streamer).parameters
+    return {"dtype_backend", "schema_sniffer_size"}.issubset(parameters)
+
+
+@dataclass
+class BenchCase:
+    """A benchmark case: a dataset streamed with a given combination."""
+
+    dataset: Dataset
+    extension: str
+    chunk_size: int
+    dtype_backend: Optional[str] = None
+    schema_sniffer_size: Optional[int] = None
+    # Whether dataset columns hints are applied (None if it has no hints)
+    column_hints: Optional[bool] = None
+
+    @property
+    def label(self) -> str:
+        """Get a human readable (and file name safe) label for this case."""
+        hints = None
+        if self.column_hints is not None:
+            hints = "hints" if self.column_hints else "no-hints"
+        return "-".join(
+            str(p)
+            for p in (
+                self.dataset.basename,
+                self.extension,
+                self.chunk_size,
+                self.dtype_backend,
+                self.schema_sniffer_size,
+                hints,
+            )
+            if p is not None
+        )
+
+
+@dataclass
+class BenchResult:
+    """A benchmark case result."""
+
+    case: BenchCase
+    rows: int
+    ttfb: float
+    duration: float
+    size: int
+    peak_memory: int
+    session: Optional[Session] = field(default=None, repr=False)
+
+    @property
+    def rows_per_second(self) -> float:
+        """Get streamed rows per second."""
+        return self.rows / self.duration if self.duration else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        """Get streamed megabytes per second."""
+        return self.size / 1e6 / self.duration if self.duration else 0.0
+
+
+def count_rows(engine: Engine, dataset: Dataset) -> int:
+    """Count dataset query rows (or derived dataset result rows)."""
+    if dataset.is_derived:
+        return sum(batch.num_rows for batch in fetch_batches(engine, dataset))
+    query = f"SELECT COUNT(*) FROM ({dataset.query}) AS data7_bench"  # noqa: S608
+    with engine.connect() as conn:
+        return conn.execute(text(query), dataset.params).scalar_one()
+
+
+def get_cases(
+    datasets: Iterable[Dataset],
+    extensions: Iterable[str],
+    chunk_sizes: Iterable[int],
+    dtype_backends: Iterable[str],
+    schema_sniffer_sizes: Iterable[int],
+) -> List[BenchCase]:
+    """Get the grid of benchmark cases to run.
+
+    The dtype backend and schema sniffer size only vary for streamers that support
+    them. Datasets with columns hints are streamed with and without hints.
+    """
+    cases = []
+    for dataset, extension, chunk_size in product(datasets, extensions, chunk_sizes):
+        combinations: List[Tuple[Optional[str], Optional[int]]] = [(None, None)]
+        if is_tunable(formats.get(extension)):
+            combinations = list(product(dtype_backends, schema_sniffer_sizes))
+        hints: List[Optional[bool]] = [None]
+        if dataset.has_column_hints:
+            hints = [True, False]
+        cases += [
+            BenchCase(dataset, extension, chunk_size, *combination, column_hints)
+            for combination, column_hints in product(combinations, hints)
+        ]
+    return cases
+
+
+def run_case(
+    engine: Engine, case: BenchCase, rows: int, profile: bool = False
+) -> BenchResult:
+    """Stream a benchmark case and collect its metrics.
+
+    Peak memory is the sum of the Python heap peak (tracked by `tracemalloc`) and
+    the peak of memory allocated by Arrow while streaming.
+    """
+    dataset = case.dataset
+    if case.column_hints is False:
+        dataset = replace(dataset, columns=[], large_strings=None)
+    fmt = formats.get(case.extension)
+    streamer = fmt.streamer
+    kwargs = {}
+    if is_tunable(fmt):
+        kwargs = {
+            "dtype_backend": case.dtype_backend,
+            "schema_sniffer_size": case.schema_sniffer_size,
+        }
+
+    profiler = None
+    if profile:
+        profiler = Profiler(
+            interval=get_config().profiler_interval, async_mode="disabled"
+        )
+        profiler.start()
+
+    size = 0
+    ttfb = 0.0
+    arrow_base = pa.total_allocated_bytes()
+    arrow_peak = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    for chunk in streamer(engine, dataset, chunksize=case.chunk_size, **kwargs):
+        if not ttfb:
+            ttfb = time.perf_counter() - start
+        size += len(chunk.encode() if isinstance(chunk, str) else chunk)
+        arrow_peak = max(arrow_peak, pa.total_allocated_bytes() - arrow_base)
+    duration = time.perf_counter() - start
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    session = None
+    if profiler is not None:
+        session = profiler.stop()
+
+    return BenchResult(
+        case=case,
+        rows=rows,
+        ttfb=ttfb,
+        duration=duration,
+        size=size,
+        peak_memory=python_peak + arrow_peak,
+        session=session,
+    )
+
+
+def recommend(results: Iterable[BenchResult]) -> Dict[str, Dict[str, BenchResult]]:
+    """Get the fastest benchmark result per dataset and extension."""
+    best: Dict[str, Dict[str, BenchResult]] = {}
+    for result in results:
+        per_dataset = best.setdefault(result.case.dataset.basename, {})
+        current = per_dataset.get(result.case.extension)
+        if current is None or result.duration < current.duration:
+            per_dataset[result.case.extension] = result
+    return best
@@ -0,0 +1,149 @@
+"""Data7 bundle module.
+
+Several datasets can be downloaded together as a zip archive of per-dataset
+files (a bundle). Bundled datasets queries run in a single snapshot transaction
+on one connection, so that files are consistent with each other, and archive
+members are streamed as they are produced. Bundled datasets are always queried
+from the database: results cache and materializations are bypassed.
+"""
+
+import contextlib
+import logging
+import zipfile
+from dataclasses import replace
+from typing import Dict, Generator, List, Sequence, Tuple
+
+from sqlalchemy import Connection, Engine
+
+from .databases import pool_checkout
+from .formats import Format, formats
+from .models import Dataset
+from .sink import OutputSink, get_flush_size
+from .timing import measure
+
+logger = logging.getLogger(__name__)
+
+# Query string argument listing bundled files, _e.g._ `invoices.csv,customers.csv`
+BUNDLE_ARGUMENT: str = "datasets"
+
+# Snapshot transactions isolation levels (other dialects use their default level)
+SNAPSHOT_ISOLATION_LEVELS: Dict[str, str] = {
+    "postgresql": "REPEATABLE READ",
+    "mysql": "REPEATABLE READ",
+}
+
+
+class BundleError(ValueError):
+    """Raised when requested bundle files are invalid."""
+
+
+def uncached(dataset: Dataset) -> Dataset:
+    """Get a copy of a dataset (and of its sources) that is not cached.
+
+    Its results cache and materialization are disabled so that it is queried
+    from the bundle snapshot.
+    """
+    return replace(
+        dataset,
+        cache_ttl=0,
+        materialize_ttl=0,
+        sources={
+            basename: uncached(source) for basename, source in dataset.sources.items()
+        },
+    )
+
+
+def get_bundle_members(
+    value: str, datasets: List[Dataset]
+) -> List[Tuple[Dataset, Format]]:
+    """Get bundled datasets and formats from requested files names.
+
+    Bundled datasets use their parameters defaults, are not cached and should
+    be queried from the same database.
+    """
+    names = [name for name in value.split(",") if name]
+    if not names:
+        raise BundleError("No dataset to bundle")
+    if len(set(names)) != len(names):
+        raise BundleError("Bundled files should be unique")
+
+    members = []
+    for name in names:
+        basename, _, extension = name.partition(".")
+        dataset = next((d for d in datasets if d.basename == basename), None)
+        if dataset is None:
+            raise BundleError(f"Dataset '{basename}' is not registered")
+        try:
+            fmt = formats.get(extension)
+            dataset = uncached(dataset.bind({}))
+        except ValueError as exc:
+            raise BundleError(f"Cannot bundle '{name}': {exc}") from exc
+        members.append((dataset, fmt))
+
+    if len({dataset.database for dataset, _ in members}) > 1:
+        raise BundleError("Bundled datasets should use the same database")
+    return members
+
+
+@contextlib.contextmanager
+def snapshot(engine: Engine) -> Generator[Connection, None, None]:
+    """Get a connection running a snapshot transaction.
+
+    Statements run on the connection see the same database snapshot (repeatable
+    read isolation level, or a read transaction for SQLite). The connection is
+    invalidated if released while a statement is running.
+    """
+    with measure("connect"), pool_checkout(engine):
+        conn = engine.connect()
+    with conn:
+        try:
+            level = SNAPSHOT_ISOLATION_LEVELS.get(conn.dialect.name)
+            if level is not None:
+                conn.execution_options(isolation_level=level)
+            with conn.begin():
+                if conn.dialect.name == "sqlite":
+                    # pysqlite does not begin transactions for read statements
+                    conn.exec_driver_sql("BEGIN")
+                yield conn
+        except BaseException:
+            conn.invalidate()
+            raise
+
+
+def stream_bundle(
+    engine: Engine, members: Sequence[Tuple[Dataset, Format]], chunksize: int = 5000
+) -> Generator[bytes, None, None]:
+    """Stream datasets as a zip archive, queried in a single snapshot.
+
+    Archive members (named after datasets basenames and formats extensions) are
+    written using data descriptors, hence members chunks are streamed as soon as
+    they are rendered by format streamers (coalesced up to the output flush
+    size).
+    """
+    output = OutputSink(get_flush_size())
+    with snapshot(engine) as conn:
+        with zipfile.ZipFile(
+            output, mode="w", compression=zipfile.ZIP_DEFLATED
+        ) as archive:
+            for dataset, fmt in members:
+                logger.debug("Bundling %s.%s", dataset.basename, fmt)
+                with (
+                    archive.open(
+                        f"{dataset.basename}.{fmt.extension}",
+                        mode="w",
+                        force_zip64=True,
+                    ) as member,
+                    contextlib.closing(
+                        fmt.streamer(conn, dataset, chunksize=chunksize)
+                    ) as chunks,
+                ):
+                    for chunk in chunks:
+                        with measure("encode"):
+                            member.write(
+                                chunk.encode() if isinstance(chunk, str) else chunk
+                            )
+                        # Compressed data may be buffered
+                        if content := output.pop():
+                            yield content
+        # The central directory is written once the archive is closed
+        yield output.pop(final=True)
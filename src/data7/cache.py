@@ -0,0 +1,151 @@
+"""Data7 cache module.
+
+Datasets query results can be cached in-memory as Arrow tables so that a dataset
+requested in multiple formats runs its SQL query once.
+"""
+
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional, Tuple
+
+import pyarrow as pa
+
+from .config import get_config, settings
+from .models import Dataset
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    """A cached query result."""
+
+    table: pa.Table
+    expires: float
+
+
+@dataclass
+class CacheStats:
+    """Cache statistics."""
+
+    hits: int = 0
+    misses: int = 0
+    entries: int = 0
+    bytes: int = 0
+    max_bytes: int = 0
+
+
+class ResultCache:
+    """An in-memory LRU cache of query results stored as Arrow tables.
+
+    The total size of cached tables never exceeds `max_bytes`: least recently used
+    entries are evicted to make room for new ones.
+    """
+
+    def __init__(self, max_bytes: int):
+        """Create an empty cache."""
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def _pop(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.table.nbytes
+
+    def peek(self, key: Hashable) -> Optional[pa.Table]:
+        """Get a cached table (if not expired) without updating stats nor LRU."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires <= time.monotonic():
+                return None
+            return entry.table
+
+    def get(self, key: Hashable) -> Optional[pa.Table]:
+        """Get a cached table (if not expired)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= time.monotonic():
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                logger.debug("Result cache miss for %s", key)
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            logger.debug("Result cache hit for %s", key)
+            return entry.table
+
+    def set(self, key: Hashable, table: pa.Table, ttl: float) -> bool:
+        """Cache a table for `ttl` seconds, returns False if it does not fit."""
+        if table.nbytes > self.max_bytes:
+            logger.debug("Result for %s is too large to be cached", key)
+            return False
+
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            while self._bytes + table.nbytes > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.table.nbytes
+                logger.debug("Result cache evicted %s", evicted_key)
+            self._entries[key] = CacheEntry(table, time.monotonic() + ttl)
+            self._bytes += table.nbytes
+            logger.info(
+                "Result cache stored %s (%d bytes used / %d)",
+                key,
+                self._bytes,
+                self.max_bytes,
+            )
+        return True
+
+    def clear(self):
+        """Remove all cached entries."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    @property
+    def stats(self) -> CacheStats:
+        """Get cache statistics."""
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+            )
+
+
+@functools.cache
+def get_result_cache() -> Optional[ResultCache]:
+    """Get the result cache (if enabled using the `RESULT_CACHE_MAX_BYTES`)."""
+    max_bytes = settings.get("RESULT_CACHE_MAX_BYTES", 0)
+    if not max_bytes:
+        return None
+    return ResultCache(max_bytes)
+
+
+def get_cache_ttl(dataset: Dataset) -> float:
+    """Get dataset results cache TTL (0 means results are not cached)."""
+    if dataset.cache_ttl is not None:
+        return dataset.cache_ttl
+    return get_config().result_cache_ttl
+
+
+def get_cache_key(dataset: Dataset, *args: Any) -> Tuple[Hashable, ...]:
+    """Get a dataset query result key.
+
+    A query result is identified by the dataset, its bound parameters values and
+    extra arguments altering it (_e.g._ the dtype backend). The key also names
+    dataset materializations (see `data7.materialize`).
+    """
+    return (dataset.basename, tuple(sorted(dataset.params.items())), *args)
@@ -0,0 +1,108 @@
+"""Data7 cancellation module.
+
+Database work of a request can be cancelled (_e.g._ when the client disconnects)
+using a per-request `Cancellation` bound to a context variable: statements
+running on connections it tracks are cancelled server-side, where the database
+driver supports it.
+"""
+
+import contextlib
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Dict, Generator, List, Optional, Tuple
+
+from sqlalchemy import Connection
+
+logger = logging.getLogger(__name__)
+
+# DBAPI connection methods cancelling the running statement from another
+# thread, per SQLAlchemy driver name (the first available method is used)
+CANCEL_METHODS: Dict[str, Tuple[str, ...]] = {
+    "pysqlite": ("interrupt",),
+    "psycopg": ("cancel_safe", "cancel"),
+    "psycopg2": ("cancel",),
+}
+
+current_cancellation: ContextVar[Optional["Cancellation"]] = ContextVar(
+    "current_cancellation", default=None
+)
+
+
+def cancel_statement(conn: Connection) -> bool:
+    """Cancel the statement running on a connection (if supported).
+
+    Returns True if a cancellation request has been sent to the database.
+    """
+    if conn.closed or conn.invalidated:
+        return False
+
+    driver = conn.dialect.driver
+    methods = CANCEL_METHODS.get(driver, ())
+    try:
+        dbapi_connection = conn.connection.dbapi_connection
+        cancel = next(
+            getattr(dbapi_connection, m)
+            for m in methods
+            if hasattr(dbapi_connection, m)
+        )
+    except StopIteration:
+        logger.debug("Statements cannot be cancelled for the '%s' driver", driver)
+        return False
+    except Exception:
+        # The connection has been closed in the meantime
+        return False
+
+    try:
+        cancel()
+    except Exception as exc:
+        logger.warning("Statement cancellation failed: %s", exc)
+        return False
+    return True
+
+
+class Cancellation:
+    """Request database work cancellation."""
+
+    def __init__(self):
+        """Create an active cancellation (no connection tracked)."""
+        self.cancelled = False
+        self._connections: List[Connection] = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def track(self, conn: Connection) -> Generator[Connection, None, None]:
+        """Track a connection while in use so that its statements can be cancelled."""
+        with self._lock:
+            if self.cancelled:
+                raise RuntimeError("Request database work has been cancelled")
+            self._connections.append(conn)
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                self._connections.remove(conn)
+
+    def cancel(self):
+        """Cancel statements running on tracked connections.
+
+        Connections are left to their users that should close them (interrupted
+        statements raise a database error).
+        """
+        with self._lock:
+            self.cancelled = True
+            connections = list(self._connections)
+        for conn in connections:
+            if cancel_statement(conn):
+                logger.info("Statement cancelled on %s", conn.engine.url.database)
+
+
+@contextlib.contextmanager
+def track(conn: Connection) -> Generator[Connection, None, None]:
+    """Track a connection with the current cancellation (if any)."""
+    cancellation = current_cancellation.get()
+    if cancellation is None:
+        yield conn
+        return
+    with cancellation.track(conn):
+        yield conn
@@ -0,0 +1,192 @@
+"""Data7 catalog module.
+
+Datasets metadata (columns, approximate rows count, last rendered outputs
+sizes) are computed in the background and kept in-memory, so that serving the
+catalog never runs database queries.
+"""
+
+import datetime
+import logging
+import threading
+import time
+from dataclasses import replace
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from sqlalchemy import Connection, Engine, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from .config import get_config, settings
+from .formats import formats
+from .limits import LimitExceeded, statement_timeout
+from .models import Dataset, DatasetMetadata
+
+if TYPE_CHECKING:
+    from .databases import DatabaseRouter
+
+logger = logging.getLogger(__name__)
+
+
+def get_default_params(dataset: Dataset) -> Optional[Dict[str, Any]]:
+    """Get dataset parameters defaults (None if a parameter is required)."""
+    params = {p.name: p.default for p in dataset.parameters}
+    if None in params.values():
+        return None
+    return params
+
+
+def is_default_request(dataset: Dataset) -> bool:
+    """Check if a bound dataset request renders the whole default output."""
+    return (
+        dataset.params == get_default_params(dataset)
+        and not dataset.is_restricted
+        and dataset.head is None
+    )
+
+
+def estimate_rows(conn: Connection, dataset: Dataset, params: Dict[str, Any]) -> int:
+    """Estimate dataset query result rows count.
+
+    PostgreSQL planner estimates are used (the query is not executed), other
+    databases count query result rows.
+    """
+    if conn.dialect.name == "postgresql":
+        plan = conn.execute(
+            text(f"EXPLAIN (FORMAT JSON) {dataset.query}"), params
+        ).scalar_one()
+        return int(plan[0]["Plan"]["Plan Rows"])
+    query = f"SELECT COUNT(*) FROM ({dataset.query}) AS data7_catalog"  # noqa: S608
+    return conn.execute(text(query), params).scalar_one()
+
+
+class Catalog:
+    """An in-memory datasets metadata catalog."""
+
+    def __init__(self):
+        """Create an empty catalog."""
+        self._metadata: Dict[str, DatasetMetadata] = {}
+        self._lock = threading.Lock()
+
+    def get(self, basename: str) -> DatasetMetadata:
+        """Get a copy of dataset metadata (empty if not computed yet)."""
+        with self._lock:
+            metadata = self._metadata.get(basename, DatasetMetadata(basename))
+            return replace(metadata, sizes=dict(metadata.sizes))
+
+    def record_size(self, dataset: Dataset, extension: str, size: int):
+        """Record a dataset rendered output size (for default requests only)."""
+        if not is_default_request(dataset):
+            return
+        with self._lock:
+            metadata = self._metadata.setdefault(
+                dataset.basename, DatasetMetadata(dataset.basename)
+            )
+            metadata.sizes[extension] = size
+
+    def refresh(self, engine: Engine, dataset: Dataset):
+        """Compute dataset columns and approximate rows count.
+
+        Metadata of datasets with required parameters are not computed. Previous
+        metadata are kept if the computation fails.
+        """
+        from .streamers import fetch_batches, sniff_schema  # noqa: PLC0415
+
+        params = get_default_params(dataset)
+        if params is None:
+            return
+        dataset = replace(dataset, params=params)
+        config = get_config()
+        try:
+            schema = sniff_schema(
+                engine,
+                dataset,
+                config.default_dtype_backend,
+                config.schema_sniffer_size,
+            )
+            if dataset.is_derived:
+                # Derived datasets rows are counted from their result
+                rows = sum(b.num_rows for b in fetch_batches(engine, dataset))
+            else:
+                with engine.connect() as conn, statement_timeout(conn, dataset):
+                    rows = estimate_rows(conn, dataset, params)
+        except (SQLAlchemyError, LimitExceeded):
+            logger.warning(
+                "Failed to refresh '%s' dataset metadata",
+                dataset.basename,
+                exc_info=True,
+            )
+            return
+
+        with self._lock:
+            metadata = self._metadata.setdefault(
+                dataset.basename, DatasetMetadata(dataset.basename)
+            )
+            metadata.columns = {field.name: str(field.type) for field in schema}
+            metadata.rows = rows
+            metadata.refreshed = time.time()
+        logger.debug("Refreshed '%s' dataset metadata", dataset.basename)
+
+    def refresh_all(
+        self,
+        datasets: List[Dataset],
+        engine: Engine,
+        router: Optional["DatabaseRouter"] = None,
+    ):
+        """Compute datasets metadata.
+
+        If a database router is given, metadata are computed using an engine of
+        the dataset database, else using the given engine.
+        """
+        for dataset in datasets:
+            if router is not None:
+                engine = router.get_read_engine(dataset.database)
+            self.refresh(engine, dataset)
+
+    def describe(self, dataset: Dataset) -> Dict[str, Any]:
+        """Get a dataset catalog entry (JSON serializable)."""
+        metadata = self.get(dataset.basename)
+        root_url = settings.datasets_root_url
+        refreshed = None
+        if metadata.refreshed is not None:
+            refreshed = datetime.datetime.fromtimestamp(
+                metadata.refreshed, tz=datetime.timezone.utc
+            ).isoformat()
+        return {
+            "basename": dataset.basename,
+            "formats": [
+                {
+                    "extension": extension,
+                    "media_type": formats.get(extension).media_type,
+                    "url": f"{root_url}/{dataset.basename}.{extension}",
+                    "size": metadata.sizes.get(extension),
+                }
+                for extension in formats.extensions
+            ],
+            "parameters": [
+                {
+                    "name": p.name,
+                    "type": p.type,
+                    # Dates defaults are ISO 8601 formatted
+                    "default": (
+                        p.default.isoformat()
+                        if isinstance(p.default, datetime.date)
+                        else p.default
+                    ),
+                }
+                for p in dataset.parameters
+            ],
+            "columns": (
+                None
+                if metadata.columns is None
+                else [{"name": n, "type": t} for n, t in metadata.columns.items()]
+            ),
+            "rows": metadata.rows,
+            "refreshed": refreshed,
+        }
+
+    def clear(self):
+        """Remove all datasets metadata."""
+        with self._lock:
+            self._metadata.clear()
+
+
+catalog = Catalog()
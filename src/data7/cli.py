@@ -1,29 +1,32 @@
 """Data7 Command Line Interface."""
 
 import copy
+import os
 import shutil
+import socket
 import sys
 from enum import IntEnum, StrEnum
 from pathlib import Path
 from sqlite3 import OperationalError as SqliteOperationalError
-from typing import Optional
+from typing import TYPE_CHECKING, Annotated, List, Optional
 
-import sqlalchemy
 import typer
-import uvicorn
 import yaml
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.syntax import Syntax
-from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
-from sqlalchemy.exc import OperationalError
-from sqlalchemy.sql import text
+from rich.table import Table
 
 import data7
-from data7.models import Dataset, Extension
-from data7.streamers import sql2csv, sql2parquet
-from data7.utils import populate_datasets
+from data7.formats import formats
+
+# Heavy dependencies (pandas, pyarrow, sqlalchemy, uvicorn) are imported by
+# commands that need them so that the CLI starts fast.
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+    from data7.databases import DatabaseRouter
+    from data7.models import Dataset
 
 cli = typer.Typer(name="data7", no_args_is_help=True, pretty_exceptions_short=True)
 console = Console(stderr=True)
@@ -36,6 +39,7 @@ class ExitCodes(IntEnum):
     INCOMPLETE_CONFIGURATION = 1
     INVALID_CONFIGURATION = 2
     INVALID_ARGUMENT = 3
+    LIMIT_EXCEEDED = 4
 
 
 class LogLevels(StrEnum):
@@ -139,32 +143,66 @@ def check_settings_files_format():
         console.print(content)
 
 
-def check_database_connection(engine: Engine):
-    """Check database URL connection."""
+def check_settings_values():
+    """Check request path settings values (see `data7.config.get_config`)."""
+    console.rule("[yellow]check[/yellow] // [bold cyan]settings values")
+
+    try:
+        config = data7.config.load_config()
+    except ValueError as err:
+        console.print(f"❌ {err}")
+        raise typer.Exit(ExitCodes.INVALID_CONFIGURATION) from err
+    console.print("✅ settings values")
+    console.print(config)
+
+
+def check_database_connection(router: "DatabaseRouter"):
+    """Check databases (and replicas) URL connection."""
+    from sqlalchemy.sql import text  # noqa: PLC0415
+
     console.rule("[yellow]check[/yellow] // [bold cyan]database connection")
 
-    with console.status("Connecting to database...", spinner="dots"):
-        with engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
-    console.print("✅ database connection looks ok from here")
+    for name, database in router.databases.items():
+        engines: List["Engine"] = [database.primary, *database.replicas]
+        for engine in engines:
+            url = engine.url.render_as_string(hide_password=True)
+            with console.status(f"Connecting to {url}...", spinner="dots"):
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+            console.print(f"✅ {name} database connection looks ok from here ({url})")
     console.print("⚠️[yellow i] Note that there may be false positive for sqlite")
 
 
-def check_datasets_queries(engine: Engine):
+def check_datasets_queries(router: "DatabaseRouter"):
     """Check datasets defined queries."""
+    import sqlalchemy  # noqa: PLC0415
+    from sqlalchemy.exc import OperationalError  # noqa: PLC0415
+    from sqlalchemy.sql import text  # noqa: PLC0415
+
     console.rule("[yellow]check[/yellow] // [bold cyan]datasets queries")
 
-    with engine.connect() as conn:
-        for dataset in data7.config.settings.datasets:
-            console.print(f"👉 [b cyan]{dataset.basename}")
-            console.print(f"   [i]{dataset.query}")
+    for dataset in data7.config.settings.datasets:
+        console.print(f"👉 [b cyan]{dataset.basename}")
+        if "derive" in dataset:
+            # Derived datasets have no query (sources are checked when populated)
+            console.print(f"   [i]derived from {dataset.derive.source}\n")
+            continue
+        console.print(f"   [i]{dataset.query}")
+        try:
+            engine = router.get_engine(dataset.get("database"))
+        except ValueError as err:
+            console.print(f"❌ {err}")
+            raise typer.Exit(ExitCodes.INVALID_CONFIGURATION) from err
+        # Parameterized queries are checked using parameters defaults
+        params = {p["name"]: p.get("default") for p in dataset.get("parameters", [])}
+        with engine.connect() as conn:
             try:
-                conn.execute(text(dataset.query)).scalar()
+                conn.execute(text(dataset.query), params).scalar()
             except (OperationalError, SqliteOperationalError) as err:
                 console.print("❌ Invalid database query")
                 console.print_exception(max_frames=1, suppress=[sqlalchemy])
                 raise typer.Exit(ExitCodes.INVALID_CONFIGURATION) from err
-            console.print("   ✅ valid\n")
+        console.print("   ✅ valid\n")
 
 
 @cli.command()
@@ -175,25 +213,46 @@ def check():
 
     1. all settings files SHOULD exist
 
-    2. settings files format SHOULD be valid YAML
+    2. settings files format SHOULD be valid YAML (and settings values valid)
 
     3. configured database connection SHOUD be valid (driver installed and valid url)
 
     4. datasets SQL queries SHOULD be valid SQL
     """
-    engine = create_engine(data7.config.settings.DATABASE_URL)
+    from data7.databases import DatabaseRouter  # noqa: PLC0415
+
+    router = DatabaseRouter.from_settings()
 
     check_settings_files_exist()
     check_settings_files_format()
-    check_database_connection(engine)
-    check_datasets_queries(engine)
+    check_settings_values()
+    check_database_connection(router)
+    check_datasets_queries(router)
 
     console.print("\n💫 All checks are successful. w00t 🎉")
 
 
 @cli.command()
-def stream(extension: Extension, name: str):
+def stream(
+    extension: str,
+    name: str,
+    param: Annotated[
+        Optional[List[str]],
+        typer.Option("--param", "-p", help="Dataset parameter value, e.g. year=2024."),
+    ] = None,
+):
     """Stream a dataset given its name and a selected extension."""
+    from data7.databases import DatabaseRouter  # noqa: PLC0415
+    from data7.limits import LimitExceeded  # noqa: PLC0415
+    from data7.utils import populate_datasets  # noqa: PLC0415
+
+    try:
+        fmt = formats.get(extension)
+    except ValueError as err:
+        console.print(f"❌ {err}.")
+        console.print(f"Allowed values are: {formats.extensions}")
+        raise typer.Exit(ExitCodes.INVALID_ARGUMENT) from err
+
     datasets = data7.config.settings.datasets
     names = [d.basename for d in datasets]
     if name not in names:
@@ -201,23 +260,166 @@ def stream(extension: Extension, name: str):
         console.print(f"Allowed values are: {names}")
         raise typer.Exit(ExitCodes.INVALID_ARGUMENT)
 
-    # Create database engine
-    engine = create_engine(data7.config.settings.DATABASE_URL)
+    # Create databases engines
+    router = DatabaseRouter.from_settings()
 
     # Get dataset
-    datasets = populate_datasets(engine)
-    dataset: Dataset = next((d for d in datasets if d.basename == name))
-    query_md = Markdown(f"🗃️ SQL Query\n```sql\n{dataset.query}\n```\n\n")
-    console.print(query_md)
+    datasets = populate_datasets(router.get_engine(), router)
+    dataset: "Dataset" = next((d for d in datasets if d.basename == name))
+    values = {}
+    for item in param or []:
+        key, _, value = item.partition("=")
+        values[key] = value
+    try:
+        dataset = dataset.bind(values)
+    except ValueError as err:
+        console.print(f"❌ {err}.")
+        raise typer.Exit(ExitCodes.INVALID_ARGUMENT) from err
+    engine = router.get_read_engine(dataset.database)
+    if not dataset.is_derived:
+        query_md = Markdown(f"🗃️ SQL Query\n```sql\n{dataset.query}\n```\n\n")
+        console.print(query_md)
 
     # Start streaming
-    streamer = sql2csv
-    stream = sys.stdout
-    if extension == Extension.PARQUET:
-        streamer = sql2parquet
-        stream = sys.stdout.buffer
-    for chunk in streamer(engine, dataset, chunksize=data7.config.settings.CHUNK_SIZE):
-        stream.write(chunk)
+    try:
+        for chunk in fmt.streamer(
+            engine, dataset, chunksize=data7.config.get_config().chunk_size
+        ):
+            sys.stdout.buffer.write(chunk.encode() if isinstance(chunk, str) else chunk)
+    except LimitExceeded as err:
+        console.print(f"❌ {err}, output is incomplete.")
+        raise typer.Exit(ExitCodes.LIMIT_EXCEEDED) from err
+
+
+@cli.command()
+def bench(  # noqa: PLR0912, PLR0913, PLR0917
+    dataset: Annotated[
+        Optional[List[str]],
+        typer.Option("--dataset", "-d", help="Dataset to profile (default: all)."),
+    ] = None,
+    extension: Annotated[
+        Optional[List[str]],
+        typer.Option("--extension", "-e", help="Output format (default: all)."),
+    ] = None,
+    chunk_size: Annotated[
+        Optional[List[int]],
+        typer.Option(help="Chunk size (default: 1000, 5000, 10000)."),
+    ] = None,
+    dtype_backend: Annotated[
+        Optional[List[str]],
+        typer.Option(help="Dtype backend (default: numpy_nullable, pyarrow)."),
+    ] = None,
+    schema_sniffer_size: Annotated[
+        Optional[List[int]],
+        typer.Option(
+            help="Schema sniffer size (default: SCHEMA_SNIFFER_SIZE setting)."
+        ),
+    ] = None,
+    profile_dir: Annotated[
+        Optional[Path],
+        typer.Option(help="Save pyinstrument sessions of the slowest runs here."),
+    ] = None,
+    profile_slowest: Annotated[
+        int, typer.Option(help="Number of slowest runs to profile.")
+    ] = 3,
+):
+    """Profile configured datasets streaming against the configured database."""
+    from data7.bench import (  # noqa: PLC0415
+        BENCH_CHUNK_SIZES,
+        BENCH_DTYPE_BACKENDS,
+        count_rows,
+        get_cases,
+        recommend,
+        run_case,
+    )
+    from data7.databases import DatabaseRouter  # noqa: PLC0415
+    from data7.utils import populate_datasets  # noqa: PLC0415
+
+    if unknown := set(extension or []) - set(formats.extensions):
+        console.print(f"❌ Extension(s) {sorted(unknown)} not supported.")
+        console.print(f"Allowed values are: {formats.extensions}")
+        raise typer.Exit(ExitCodes.INVALID_ARGUMENT)
+
+    router = DatabaseRouter.from_settings()
+    datasets = populate_datasets(router.get_engine(), router)
+    if dataset:
+        names = [d.basename for d in datasets]
+        if unknown := set(dataset) - set(names):
+            console.print(f"❌ Dataset(s) {sorted(unknown)} not found.")
+            console.print(f"Allowed values are: {names}")
+            raise typer.Exit(ExitCodes.INVALID_ARGUMENT)
+        datasets = [d for d in datasets if d.basename in dataset]
+
+    # Parameterized datasets are profiled using parameters defaults
+    if required := [d.basename for d in datasets if d.required_parameters]:
+        console.print(f"⚠️ Dataset(s) {required} have required parameters, skipping.")
+    datasets = [d.bind({}) for d in datasets if not d.required_parameters]
+
+    engines = {d.basename: router.get_read_engine(d.database) for d in datasets}
+    rows = {d.basename: count_rows(engines[d.basename], d) for d in datasets}
+    cases = get_cases(
+        datasets,
+        extension or formats.extensions,
+        chunk_size or BENCH_CHUNK_SIZES,
+        dtype_backend or BENCH_DTYPE_BACKENDS,
+        schema_sniffer_size or [data7.config.get_config().schema_sniffer_size],
+    )
+
+    table = Table(title="Data7 benchmark")
+    for column in ("dataset", "ext", "chunk", "backend", "sniffer", "hints", "rows"):
+        table.add_column(column)
+    for column in ("TTFB (s)", "total (s)", "rows/s", "MB/s", "peak mem (MB)", "size"):
+        table.add_column(column, justify="right")
+
+    results = []
+    with console.status("Running benchmark...", spinner="dots") as status:
+        for case in cases:
+            status.update(f"Running benchmark: {case.label}")
+            basename = case.dataset.basename
+            result = run_case(engines[basename], case, rows[basename])
+            results.append(result)
+            table.add_row(
+                case.dataset.basename,
+                case.extension,
+                str(case.chunk_size),
+                case.dtype_backend or "-",
+                str(case.schema_sniffer_size or "-"),
+                {None: "-", True: "on", False: "off"}[case.column_hints],
+                str(result.rows),
+                f"{result.ttfb:.3f}",
+                f"{result.duration:.3f}",
+                f"{result.rows_per_second:.0f}",
+                f"{result.mb_per_second:.2f}",
+                f"{result.peak_memory / 1e6:.1f}",
+                str(result.size),
+            )
+    console.print(table)
+
+    console.rule("[yellow]bench[/yellow] // [bold cyan]recommended settings")
+    for basename, best in recommend(results).items():
+        console.print(f"👉 [b cyan]{basename}")
+        for ext, result in best.items():
+            recommended = [f"chunk_size: {result.case.chunk_size}"]
+            if result.case.dtype_backend is not None:
+                recommended += [
+                    f"default_dtype_backend: {result.case.dtype_backend}",
+                    f"schema_sniffer_size: {result.case.schema_sniffer_size}",
+                ]
+            console.print(f"   {ext}: {', '.join(recommended)}")
+
+    if profile_dir is None:
+        return
+
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    slowest = sorted(results, key=lambda r: r.duration, reverse=True)
+    for result in slowest[:profile_slowest]:
+        engine = engines[result.case.dataset.basename]
+        profiled = run_case(engine, result.case, result.rows, profile=True)
+        if profiled.session is None:
+            continue
+        session_path = profile_dir / f"{result.case.label}.pyisession"
+        profiled.session.save(session_path)
+        console.print(f"💾 {session_path}")
 
 
 @cli.command()
@@ -229,8 +431,29 @@ def run(  # noqa: PLR0913
     root_path: str = "",
     proxy_headers: bool = False,
     log_level: LogLevels = LogLevels.INFO,
+    preload: bool = False,
+    reuse_port: bool = False,
 ):
-    """Run data7 web server."""
+    """Run data7 web server.
+
+    In preload mode, datasets are validated once before forking workers that
+    optionally bind their own socket (`--reuse-port`).
+    """
+    import uvicorn  # noqa: PLC0415
+
+    if preload and reload:
+        console.print("❌ Preload mode cannot be used with --reload.")
+        raise typer.Exit(ExitCodes.INVALID_ARGUMENT)
+    if reuse_port and not preload:
+        console.print("❌ --reuse-port can only be used in preload mode.")
+        raise typer.Exit(ExitCodes.INVALID_ARGUMENT)
+    if preload and not hasattr(os, "fork"):
+        console.print("❌ Preload mode is not supported on this platform.")
+        raise typer.Exit(ExitCodes.INVALID_ARGUMENT)
+    if reuse_port and not hasattr(socket, "SO_REUSEPORT"):
+        console.print("❌ --reuse-port is not supported on this platform.")
+        raise typer.Exit(ExitCodes.INVALID_ARGUMENT)
+
     default_host = "localhost"
     default_port = 8000
     host = data7.config.settings.get("HOST", default_host) if host is None else host
@@ -242,6 +465,24 @@ def run(  # noqa: PLR0913
         "level": log_level.value.upper(),
         "propagate": False,
     }
+    log_config["loggers"]["data7.server"] = log_config["loggers"]["data7.app"]
+
+    if preload:
+        from data7 import server  # noqa: PLC0415
+
+        config = uvicorn.Config(
+            "data7.app:app",
+            host=host,
+            port=port,
+            root_path=root_path,
+            proxy_headers=proxy_headers,
+            log_level=log_level,
+            log_config=log_config,
+        )
+        config.load()
+        server.preload()
+        server.serve(config, workers or 1, reuse_port=reuse_port)
+        return
 
     uvicorn.run(
         "data7.app:app",
@@ -256,6 +497,35 @@ def run(  # noqa: PLR0913
     )
 
 
+@cli.command()
+def flight(
+    host: Optional[str] = None,
+    port: Optional[int] = None,
+):
+    """Run data7 Arrow Flight server."""
+    from data7.databases import DatabaseRouter  # noqa: PLC0415
+    from data7.flight import FlightServer  # noqa: PLC0415
+    from data7.utils import populate_datasets  # noqa: PLC0415
+
+    settings = data7.config.settings
+    host = settings.get("HOST", "localhost") if host is None else host
+    port = settings.get("FLIGHT_PORT", 8815) if port is None else port
+
+    router = DatabaseRouter.from_settings()
+    datasets = populate_datasets(router.get_engine(), router)
+    server = FlightServer(
+        f"grpc://{host}:{port}",
+        datasets,
+        router,
+        chunksize=data7.config.get_config().chunk_size,
+    )
+    console.print(f"✈️ Serving datasets on grpc://{host}:{server.port}")
+    try:
+        server.serve()
+    finally:
+        router.dispose()
+
+
 # Get a provisionned Click instance to automatically generate CLI commands documentation
 # using the mkdocs-click module
 cli_click = typer.main.get_command(cli)
@@ -1,9 +1,13 @@
 """Data7 configuration module."""
 
+import functools
+from dataclasses import fields
 from typing import List
 
 from dynaconf import Dynaconf
 
+from .models import Config
+
 SETTINGS_FILES: List[str] = ["settings.yaml", ".secrets.yaml", "data7.yaml"]
 
 settings = Dynaconf(
@@ -13,3 +17,26 @@ settings = Dynaconf(
     environments=True,
     load_dotenv=True,
 )
+
+
+@functools.cache
+def get_config() -> Config:
+    """Get the config snapshot used on the request path.
+
+    Settings are compiled once: values are checked (a `ValueError` is raised for
+    invalid values) and typed, so that reading them is a plain attribute access.
+    Settings changed afterwards are ignored until the config is loaded again
+    (see `load_config`).
+    """
+    return Config(
+        **{
+            definition.name: settings.get(definition.name.upper(), definition.default)
+            for definition in fields(Config)
+        }
+    )
+
+
+def load_config() -> Config:
+    """(Re)compile the config snapshot from settings."""
+    get_config.cache_clear()
+    return get_config()
@@ -0,0 +1,339 @@
+"""Data7 databases module.
+
+Datasets may reference named databases. Each database has a primary and
+optional read-replicas that dataset queries are balanced across.
+
+Engines connection pools statistics (connections, reconnections and requests
+checkouts wait times) are recorded per engine. Pools can be monitored in the
+background (see `DatabaseEngines.monitor`) instead of pinging connections on
+each checkout.
+"""
+
+import contextlib
+import logging
+import threading
+import time
+import weakref
+from dataclasses import asdict, replace
+from typing import Any, Dict, Generator, List, Optional
+
+from sqlalchemy import Connection, Engine, QueuePool, create_engine, event, make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql import text
+
+from .config import settings
+from .models import Database, PoolStats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE: str = "default"
+
+_pool_stats: "weakref.WeakKeyDictionary[Engine, PoolStats]" = (
+    weakref.WeakKeyDictionary()
+)
+_pool_stats_lock = threading.Lock()
+
+
+def get_pool_stats(engine: Engine) -> PoolStats:
+    """Get a copy of an engine connection pool statistics."""
+    with _pool_stats_lock:
+        return replace(_pool_stats.setdefault(engine, PoolStats()))
+
+
+def count_pool_event(engine: Engine, counter: str):
+    """Increment an engine connection pool statistics counter."""
+    with _pool_stats_lock:
+        stats = _pool_stats.setdefault(engine, PoolStats())
+        setattr(stats, counter, getattr(stats, counter) + 1)
+
+
+@contextlib.contextmanager
+def pool_checkout(engine: Engine) -> Generator[None, None, None]:
+    """Record a connection checkout wait time in the engine pool statistics.
+
+    The wait time includes the connection setup for new connections.
+    """
+    start = time.perf_counter()
+    yield
+    wait = time.perf_counter() - start
+    with _pool_stats_lock:
+        stats = _pool_stats.setdefault(engine, PoolStats())
+        stats.checkouts += 1
+        stats.wait_time += wait
+        stats.max_wait = max(stats.max_wait, wait)
+
+
+def get_pool_monitor_interval() -> float:
+    """Get the pools monitor interval in seconds (0 means pools are not monitored)."""
+    return settings.get("DB_POOL_MONITOR_INTERVAL", 0)
+
+
+def get_pool_monitor_max_checks() -> int:
+    """Get the maximum number of idle connections validated per pool and check."""
+    return settings.get("DB_POOL_MONITOR_MAX_CHECKS", 10)
+
+
+def create_database_engine(database: Database, url: str) -> Engine:
+    """Create a database engine with database pool settings.
+
+    For the psycopg driver, queries executed `prepare_threshold` times on a pooled
+    connection are prepared server-side, so that they are parsed and planned once
+    per connection.
+
+    Connections are not pinged on checkout when pools are monitored.
+    """
+
+    def get(key: str):
+        value = getattr(database, key)
+        return settings.get(f"DB_{key.upper()}") if value is None else value
+
+    connect_args = {}
+    if make_url(url).get_driver_name() == "psycopg":
+        connect_args["prepare_threshold"] = get("prepare_threshold")
+
+    engine = create_engine(
+        url,
+        pool_pre_ping=get("pool_check") and not get_pool_monitor_interval(),
+        pool_recycle=get("pool_recycle"),
+        pool_size=get("pool_size"),
+        max_overflow=get("pool_max_overflow"),
+        connect_args=connect_args,
+    )
+
+    @event.listens_for(engine, "connect")
+    def count_connect(dbapi_connection, connection_record):
+        # Record info persists when the record connection is re-established
+        if connection_record.record_info.get("connected"):
+            count_pool_event(engine, "reconnects")
+        else:
+            connection_record.record_info["connected"] = True
+            count_pool_event(engine, "connects")
+
+    return engine
+
+
+class DatabaseEngines:
+    """Engines for a database: the primary and its read-replicas.
+
+    Read engines are selected in round-robin among healthy replicas. When no
+    replica is healthy (or defined), we fail over to the primary.
+    """
+
+    def __init__(self, database: Database):
+        """Create database engines."""
+        self.database = database
+        self.primary = create_database_engine(database, database.url)
+        self.replicas = [create_database_engine(database, u) for u in database.replicas]
+        self._healthy: List[Engine] = list(self.replicas)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @property
+    def healthy(self) -> List[Engine]:
+        """Get healthy replica engines."""
+        return list(self._healthy)
+
+    def get_read_engine(self) -> Engine:
+        """Get the next healthy replica engine or the primary."""
+        with self._lock:
+            if not self._healthy:
+                return self.primary
+            self._next %= len(self._healthy)
+            engine = self._healthy[self._next]
+            self._next += 1
+            return engine
+
+    def check_health(self):
+        """Check replicas health and update healthy replicas."""
+        healthy = []
+        for replica in self.replicas:
+            try:
+                with replica.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+            except DBAPIError:
+                logger.warning(
+                    "Database '%s' replica '%s' is unhealthy",
+                    self.database.name,
+                    replica.url.render_as_string(hide_password=True),
+                )
+                continue
+            healthy.append(replica)
+        with self._lock:
+            self._healthy = healthy
+
+    def warm_up(self):
+        """Fill the primary and healthy replicas connection pools.
+
+        Pools are filled up to their size, given connections checked out by
+        requests (a single connection is opened for pools without size).
+        """
+        for engine in (self.primary, *self.healthy):
+            size = 1
+            if isinstance(engine.pool, QueuePool):
+                size = engine.pool.size() - engine.pool.checkedout()
+            conns: List[Connection] = []
+            try:
+                for _ in range(size):
+                    conns.append(engine.connect())
+            except DBAPIError:
+                logger.warning(
+                    "Database '%s' engine '%s' pool warm-up failed",
+                    self.database.name,
+                    engine.url.render_as_string(hide_password=True),
+                )
+            finally:
+                for conn in conns:
+                    conn.close()
+            logger.debug(
+                "Database '%s' engine '%s' pool warmed up (%d connections)",
+                self.database.name,
+                engine.url.render_as_string(hide_password=True),
+                len(conns),
+            )
+
+    def validate(self) -> int:
+        """Validate the primary and healthy replicas idle pooled connections.
+
+        Idle connections are checked out one at a time and pinged, then checked
+        in before the next one is taken, so that requests do not wait for the
+        pool meanwhile. At most `DB_POOL_MONITOR_MAX_CHECKS` connections are
+        validated per pool: as pools queues are FIFO, the next validation starts
+        with the following connections. Failing connections are invalidated,
+        connections past their recycle time are re-established.
+
+        Returns the number of invalidated connections.
+        """
+        invalidated = 0
+        for engine in (self.primary, *self.healthy):
+            if not isinstance(engine.pool, QueuePool):
+                continue
+            checks = min(engine.pool.checkedin(), get_pool_monitor_max_checks())
+            try:
+                for _ in range(checks):
+                    # Do not open a new connection if requests took idle ones
+                    if not engine.pool.checkedin():
+                        break
+                    with engine.connect() as conn:
+                        try:
+                            conn.execute(text("SELECT 1"))
+                        except DBAPIError:
+                            conn.invalidate()
+                            count_pool_event(engine, "invalidated")
+                            invalidated += 1
+            except DBAPIError:
+                logger.warning(
+                    "Database '%s' engine '%s' pool validation failed",
+                    self.database.name,
+                    engine.url.render_as_string(hide_password=True),
+                )
+        return invalidated
+
+    @property
+    def is_filled(self) -> bool:
+        """Check if the primary and healthy replicas pools are filled."""
+        return all(
+            engine.pool.checkedin() + engine.pool.checkedout() >= engine.pool.size()
+            for engine in (self.primary, *self.healthy)
+            if isinstance(engine.pool, QueuePool)
+        )
+
+    def monitor(self):
+        """Validate idle pooled connections, then refill pools if needed.
+
+        Pools are refilled (re-establishing invalidated connections) if
+        connections have been invalidated or pools are not filled, so that
+        requests do not pay connections setup.
+        """
+        if self.validate() or not self.is_filled:
+            self.warm_up()
+
+    def describe(self) -> Dict[str, Any]:
+        """Get the database engines connection pools status and statistics."""
+        engines = []
+        for engine in (self.primary, *self.replicas):
+            pool = engine.pool
+            entry: Dict[str, Any] = {
+                "url": engine.url.render_as_string(hide_password=True),
+                "primary": engine is self.primary,
+                "healthy": engine is self.primary or engine in self._healthy,
+            }
+            if isinstance(pool, QueuePool):
+                entry.update(
+                    size=pool.size(),
+                    idle=pool.checkedin(),
+                    checked_out=pool.checkedout(),
+                    overflow=max(0, pool.overflow()),
+                )
+            entry.update(asdict(get_pool_stats(engine)))
+            engines.append(entry)
+        return {"name": self.database.name, "engines": engines}
+
+    def dispose(self):
+        """Dispose all engines."""
+        for engine in (self.primary, *self.replicas):
+            engine.dispose()
+
+
+class DatabaseRouter:
+    """Route datasets queries to their database engines."""
+
+    def __init__(self, databases: List[Database]):
+        """Create engines for all databases."""
+        self.databases: Dict[str, DatabaseEngines] = {
+            database.name: DatabaseEngines(database) for database in databases
+        }
+
+    @classmethod
+    def from_settings(cls) -> "DatabaseRouter":
+        """Get a router for the default and named databases from settings."""
+        databases = [Database(name=DEFAULT_DATABASE, url=settings.DATABASE_URL)]
+        databases += [
+            Database(name=name, **definition)
+            for name, definition in settings.get("DATABASES", {}).items()
+        ]
+        return cls(databases)
+
+    def get(self, name: Optional[str] = None) -> DatabaseEngines:
+        """Get database engines given its name (default database if not set)."""
+        name = name or DEFAULT_DATABASE
+        try:
+            return self.databases[name]
+        except KeyError as exc:
+            raise ValueError(f"Database '{name}' is not defined") from exc
+
+    def get_engine(self, name: Optional[str] = None) -> Engine:
+        """Get the primary engine of a database."""
+        return self.get(name).primary
+
+    def get_read_engine(self, name: Optional[str] = None) -> Engine:
+        """Get an engine to run read queries against for a database."""
+        return self.get(name).get_read_engine()
+
+    def check_health(self):
+        """Check all databases replicas health."""
+        for database in self.databases.values():
+            database.check_health()
+
+    @property
+    def has_replicas(self) -> bool:
+        """Check if at least one database has replicas."""
+        return any(d.replicas for d in self.databases.values())
+
+    def warm_up(self):
+        """Fill all databases connection pools."""
+        for database in self.databases.values():
+            database.warm_up()
+
+    def monitor(self):
+        """Validate and refill all databases connection pools."""
+        for database in self.databases.values():
+            database.monitor()
+
+    def describe(self) -> List[Dict[str, Any]]:
+        """Get all databases connection pools status and statistics."""
+        return [database.describe() for database in self.databases.values()]
+
+    def dispose(self):
+        """Dispose all databases engines."""
+        for database in self.databases.values():
+            database.dispose()
@@ -0,0 +1,72 @@
+"""Data7 derive module.
+
+Derived datasets (see `Derivation`) are computed from their source datasets query
+results using Arrow compute functions (joins, filters and hash aggregations), so
+that related datasets (_e.g._ a table and its aggregates) share their source
+query: source results are served from the result cache when it is active.
+"""
+
+from dataclasses import replace
+from typing import Iterable, Mapping
+
+import pyarrow as pa
+
+from .materialize import get_columns, get_filter_expression
+from .models import Dataset
+
+
+def check_columns(dataset: Dataset, table: pa.Table, columns: Iterable[str]):
+    """Check that derivation columns exist in a table."""
+    for column in columns:
+        if column not in table.column_names:
+            raise ValueError(
+                f"Dataset '{dataset.basename}' derivation column '{column}' does not "
+                "exist"
+            )
+
+
+def derive_table(dataset: Dataset, tables: Mapping[str, pa.Table]) -> pa.Table:
+    """Compute a derived dataset result given its sources results.
+
+    Joined rows order is not preserved. Grouped columns come first in aggregated
+    results.
+    """
+    derivation = dataset.derive
+    if derivation is None:
+        raise ValueError(f"Dataset '{dataset.basename}' is not derived")
+    table = tables[derivation.source]
+
+    if (join := derivation.join) is not None:
+        right = tables[join.dataset]
+        check_columns(dataset, table, join.keys)
+        check_columns(dataset, right, join.right_keys or join.keys)
+        table = table.join(
+            right, keys=join.keys, right_keys=join.right_keys, join_type=join.type
+        )
+
+    if derivation.filters:
+        check_columns(dataset, table, (f.column for f in derivation.filters))
+        expression = get_filter_expression(
+            replace(dataset, filters=derivation.filters), table.schema
+        )
+        table = table.filter(expression)
+
+    if derivation.group_by or derivation.aggregates:
+        check_columns(dataset, table, derivation.group_by)
+        check_columns(dataset, table, (a.column for a in derivation.aggregates))
+        aggregated = table.group_by(derivation.group_by).aggregate(
+            [(a.column, a.function) for a in derivation.aggregates]
+        )
+        table = aggregated.select(
+            derivation.group_by
+            + [f"{a.column}_{a.function}" for a in derivation.aggregates]
+        ).rename_columns(
+            derivation.group_by + [str(a.name) for a in derivation.aggregates]
+        )
+
+    if derivation.select:
+        check_columns(dataset, table, derivation.select)
+        table = table.select(
+            get_columns(replace(dataset, select=derivation.select), table.schema)
+        )
+    return table
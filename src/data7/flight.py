@@ -0,0 +1,187 @@
+"""Data7 Arrow Flight module.
+
+Datasets are served as Arrow record batches over gRPC (see the `data7 flight`
+command) using the same streamers, databases engines and limits as the HTTP
+application.
+
+Flights are described using a dataset basename path, or a JSON command with
+the dataset basename and its request arguments (parameters values, columns
+selection, rows filters or head, see `Dataset.bind`), _e.g._
+`{"basename": "invoices", "arguments": {"country": "France"}}`.
+
+Partitioned datasets (see `Dataset.partition`) flights have one endpoint per
+partition so that clients retrieve partitions in parallel.
+"""
+
+import json
+import logging
+from typing import Dict, Generator, Iterator, List, Tuple
+
+import pyarrow as pa
+from pyarrow import flight
+from sqlalchemy import Engine
+
+from .config import get_config
+from .databases import DatabaseRouter
+from .limits import LimitExceeded, StatementTimeout, limit_bytes
+from .models import Dataset, FilterError
+from .streamers import fetch_batches, get_schema
+
+logger = logging.getLogger(__name__)
+
+
+def get_descriptor(basename: str, **arguments: str) -> flight.FlightDescriptor:
+    """Get a flight descriptor for a dataset request."""
+    if not arguments:
+        return flight.FlightDescriptor.for_path(basename)
+    return flight.FlightDescriptor.for_command(
+        json.dumps({"basename": basename, "arguments": arguments})
+    )
+
+
+def parse_request(data: bytes) -> Tuple[str, Dict[str, str], int]:
+    """Get a dataset basename, request arguments and partition from JSON data."""
+    try:
+        request = json.loads(data)
+        return (
+            str(request["basename"]),
+            dict(request.get("arguments", {})),
+            int(request.get("partition", 0)),
+        )
+    except (ValueError, TypeError, KeyError) as exc:
+        raise flight.FlightServerError(f"Invalid flight request: {exc}") from exc
+
+
+def stream_batches(
+    engine: Engine, dataset: Dataset, schema: pa.Schema, chunksize: int
+) -> Generator[pa.RecordBatch, None, None]:
+    """Stream dataset query result batches cast to the flight schema.
+
+    The dataset bytes limit is enforced over batches sizes.
+    """
+    batches = (
+        batch.select(schema.names).cast(schema)
+        for batch in fetch_batches(engine, dataset, chunksize)
+    )
+    try:
+        yield from limit_bytes(batches, dataset, sizeof=lambda b: b.nbytes)
+    except StatementTimeout as exc:
+        raise flight.FlightTimedOutError(str(exc)) from exc
+    except LimitExceeded as exc:
+        raise flight.FlightServerError(str(exc)) from exc
+
+
+class FlightServer(flight.FlightServerBase):
+    """An Arrow Flight server streaming datasets query results."""
+
+    def __init__(
+        self,
+        location: str,
+        datasets: List[Dataset],
+        router: DatabaseRouter,
+        chunksize: int = 5000,
+        **kwargs,
+    ):
+        """Create the server (see `pyarrow.flight.FlightServerBase`)."""
+        super().__init__(location, **kwargs)
+        self.datasets = {dataset.basename: dataset for dataset in datasets}
+        self.router = router
+        self.chunksize = chunksize
+
+    def get_dataset(self, basename: str, arguments: Dict[str, str]) -> Dataset:
+        """Get a registered dataset bound to request arguments."""
+        dataset = self.datasets.get(basename)
+        if dataset is None:
+            raise flight.FlightServerError(f"Dataset '{basename}' is not registered")
+        try:
+            return dataset.bind(arguments)
+        except ValueError as exc:
+            raise flight.FlightServerError(str(exc)) from exc
+
+    def get_request(
+        self, descriptor: flight.FlightDescriptor
+    ) -> Tuple[str, Dict[str, str]]:
+        """Get the dataset basename and request arguments of a flight descriptor."""
+        if descriptor.descriptor_type == flight.DescriptorType.PATH:
+            return "/".join(p.decode() for p in descriptor.path), {}
+        basename, arguments, _ = parse_request(descriptor.command)
+        return basename, arguments
+
+    def get_dataset_schema(self, dataset: Dataset) -> pa.Schema:
+        """Get a dataset request result schema."""
+        engine = self.router.get_read_engine(dataset.database)
+        config = get_config()
+        try:
+            return get_schema(
+                engine,
+                dataset,
+                self.chunksize,
+                config.default_dtype_backend,
+                config.schema_sniffer_size,
+            )
+        except FilterError as exc:
+            raise flight.FlightServerError(str(exc)) from exc
+
+    def get_dataset_flight_info(
+        self, descriptor: flight.FlightDescriptor
+    ) -> flight.FlightInfo:
+        """Get a dataset request flight info (with an endpoint per partition)."""
+        basename, arguments = self.get_request(descriptor)
+        dataset = self.get_dataset(basename, arguments)
+        # Previews are not partitioned
+        partitions = dataset.partitions if dataset.head is None else 1
+        endpoints = [
+            flight.FlightEndpoint(
+                json.dumps(
+                    {"basename": basename, "arguments": arguments, "partition": index}
+                ),
+                [],
+            )
+            for index in range(partitions)
+        ]
+        return flight.FlightInfo(
+            self.get_dataset_schema(dataset), descriptor, endpoints
+        )
+
+    def list_flights(
+        self, context: flight.ServerCallContext, criteria: bytes
+    ) -> Iterator[flight.FlightInfo]:
+        """List datasets flights (using parameters defaults).
+
+        Datasets with required parameters are not listed.
+        """
+        for basename, dataset in self.datasets.items():
+            if dataset.required_parameters:
+                continue
+            yield self.get_dataset_flight_info(get_descriptor(basename))
+
+    def get_flight_info(
+        self, context: flight.ServerCallContext, descriptor: flight.FlightDescriptor
+    ) -> flight.FlightInfo:
+        """Get a dataset request flight info."""
+        return self.get_dataset_flight_info(descriptor)
+
+    def get_schema(
+        self, context: flight.ServerCallContext, descriptor: flight.FlightDescriptor
+    ) -> flight.SchemaResult:
+        """Get a dataset request result schema."""
+        dataset = self.get_dataset(*self.get_request(descriptor))
+        return flight.SchemaResult(self.get_dataset_schema(dataset))
+
+    def do_get(
+        self, context: flight.ServerCallContext, ticket: flight.Ticket
+    ) -> flight.FlightDataStream:
+        """Stream a dataset request (partition) record batches."""
+        basename, arguments, partition = parse_request(ticket.ticket)
+        dataset = self.get_dataset(basename, arguments)
+        schema = self.get_dataset_schema(dataset)
+        if dataset.head is None and dataset.partitions > 1:
+            try:
+                dataset = dataset.partition(partition)
+            except ValueError as exc:
+                raise flight.FlightServerError(str(exc)) from exc
+        logger.info("Streaming '%s' flight", dataset.basename)
+        engine = self.router.get_read_engine(dataset.database)
+        return flight.GeneratorStream(
+            schema, stream_batches(engine, dataset, schema, self.chunksize)
+        )
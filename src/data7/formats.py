@@ -0,0 +1,118 @@
+"""Data7 formats module.
+
+Output formats are registered in a registry. Each format streamer is referenced
+by its import path and only imported when first used, so that heavy
+dependencies (_e.g._ pandas or pyarrow) are not loaded at startup.
+
+Third-party packages can register formats using the `data7.formats` entry point
+group, with entry points targeting `Format` instances:
+
+```toml
+[project.entry-points."data7.formats"]
+xlsx = "my_package.formats:xlsx"
+```
+"""
+
+import importlib
+import importlib.metadata
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Generator, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+FORMATS_ENTRY_POINTS_GROUP: str = "data7.formats"
+
+
+@dataclass
+class Format:
+    """Output format model."""
+
+    # The dataset URL extension, _e.g._ `csv`
+    extension: str
+    media_type: str
+    # Streamer import path, _e.g._ `data7.streamers:sql2csv`
+    streamer_path: str
+    _streamer: Optional[Callable[..., Generator]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __str__(self) -> str:
+        """Format extension."""
+        return self.extension
+
+    @property
+    def streamer(self) -> Callable[..., Generator]:
+        """Get (and import on first use) the format streamer."""
+        if self._streamer is None:
+            module_name, _, name = self.streamer_path.partition(":")
+            logger.debug("Loading %s format streamer", self.extension)
+            self._streamer = getattr(importlib.import_module(module_name), name)
+        return self._streamer
+
+
+BUILTIN_FORMATS: List[Format] = [
+    Format("csv", "text/csv", "data7.streamers:sql2csv"),
+    Format("parquet", "application/vnd.apache.parquet", "data7.streamers:sql2parquet"),
+]
+
+
+class FormatRegistry:
+    """Output formats registry.
+
+    Built-in formats are always registered, while formats declared using entry
+    points are registered when the registry is first accessed.
+    """
+
+    def __init__(self, formats: Optional[List[Format]] = None):
+        """Create a registry with given formats."""
+        self._formats: Dict[str, Format] = {}
+        self._entry_points_loaded = False
+        for fmt in formats or []:
+            self.register(fmt)
+
+    def register(self, fmt: Format):
+        """Register a format (override the format with the same extension)."""
+        self._formats[fmt.extension] = fmt
+
+    def load_entry_points(self):
+        """Register formats declared using entry points."""
+        self._entry_points_loaded = True
+        for entry_point in importlib.metadata.entry_points(
+            group=FORMATS_ENTRY_POINTS_GROUP
+        ):
+            fmt = entry_point.load()
+            if not isinstance(fmt, Format):
+                logger.warning(
+                    "Entry point '%s' is not a data7 Format, ignoring it",
+                    entry_point.value,
+                )
+                continue
+            logger.debug("Registering %s format from %s", fmt, entry_point.value)
+            self.register(fmt)
+
+    @property
+    def formats(self) -> Dict[str, Format]:
+        """Get registered formats."""
+        if not self._entry_points_loaded:
+            self.load_entry_points()
+        return self._formats
+
+    def get(self, extension: str) -> Format:
+        """Get a format given its extension."""
+        try:
+            return self.formats[extension.lower()]
+        except KeyError as exc:
+            raise ValueError(f"Data7 extension '{extension}' is not supported") from exc
+
+    def __iter__(self) -> Iterator[Format]:
+        """Iterate over registered formats."""
+        return iter(self.formats.values())
+
+    @property
+    def extensions(self) -> List[str]:
+        """Get registered formats extensions."""
+        return list(self.formats)
+
+
+formats = FormatRegistry(BUILTIN_FORMATS)
@@ -0,0 +1,187 @@
+"""Data7 limits module.
+
+Datasets statements duration and output size (rows and bytes) can be limited.
+Limits are set per dataset, the `STATEMENT_TIMEOUT`, `MAX_ROWS` and `MAX_BYTES`
+settings being used as defaults.
+
+When a limit is hit, streamers raise a `LimitExceeded` error: the stream ends
+before output formats trailers are written (_e.g._ the Parquet footer), hence
+consumers can detect that the output is incomplete.
+"""
+
+import contextlib
+import functools
+import logging
+import threading
+from typing import (
+    Callable,
+    Generator,
+    Iterable,
+    Iterator,
+    Optional,
+    Sized,
+    TypeVar,
+    Union,
+)
+
+from sqlalchemy import Connection, text
+from sqlalchemy.exc import DBAPIError
+
+from .cancellation import cancel_statement
+from .config import get_config
+from .models import Dataset
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T", bound=Sized)
+
+# PostgreSQL query_canceled error code
+PG_QUERY_CANCELED = "57014"
+
+
+class LimitExceeded(Exception):
+    """Raised when a dataset output exceeds its limits."""
+
+
+class StatementTimeout(LimitExceeded):
+    """Raised when a dataset statement exceeds its timeout."""
+
+
+def get_statement_timeout(dataset: Dataset) -> Optional[float]:
+    """Get dataset statement timeout in seconds (None means no timeout)."""
+    if dataset.statement_timeout is not None:
+        return dataset.statement_timeout or None
+    return get_config().statement_timeout or None
+
+
+def get_max_rows(dataset: Dataset) -> Optional[int]:
+    """Get dataset output rows limit (None means no limit)."""
+    if dataset.max_rows is not None:
+        return dataset.max_rows or None
+    return get_config().max_rows or None
+
+
+def get_max_bytes(dataset: Dataset) -> Optional[int]:
+    """Get dataset output bytes limit (None means no limit)."""
+    if dataset.max_bytes is not None:
+        return dataset.max_bytes or None
+    return get_config().max_bytes or None
+
+
+def is_query_canceled(exc: DBAPIError) -> bool:
+    """Check if a database error has been raised by a canceled statement."""
+    orig = exc.orig
+    code = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    return code == PG_QUERY_CANCELED
+
+
+@contextlib.contextmanager
+def statement_timeout(
+    conn: Connection, dataset: Dataset
+) -> Generator[Connection, None, None]:
+    """Enforce dataset statement timeout for statements run on a connection.
+
+    The timeout is set for the current transaction on PostgreSQL, and reset on
+    exit so that later statements of the transaction (_e.g._ other bundled
+    datasets queries) are not affected. For other databases, a watchdog cancels
+    running statements once the timeout expired (if supported by the driver, see
+    `data7.cancellation`).
+    """
+    timeout = get_statement_timeout(dataset)
+    if timeout is None:
+        yield conn
+        return
+
+    watchdog: Optional[threading.Timer] = None
+    expired = threading.Event()
+    if conn.dialect.name == "postgresql":
+        conn.execute(
+            text("SELECT set_config('statement_timeout', :timeout, true)"),
+            {"timeout": f"{int(timeout * 1000)}ms"},
+        )
+    else:
+
+        def expire():
+            expired.set()
+            cancel_statement(conn)
+
+        watchdog = threading.Timer(timeout, expire)
+        watchdog.daemon = True
+        watchdog.start()
+
+    try:
+        yield conn
+    except DBAPIError as exc:
+        if expired.is_set() or is_query_canceled(exc):
+            raise StatementTimeout(
+                f"Dataset '{dataset.basename}' statement exceeded its "
+                f"{timeout}s timeout"
+            ) from exc
+        raise
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql("SET LOCAL statement_timeout TO DEFAULT")
+
+
+def limit_rows(chunks: Iterable[T], dataset: Dataset) -> Iterator[T]:
+    """Enforce dataset rows limit over chunks (data frames or record batches)."""
+    max_rows = get_max_rows(dataset)
+    if max_rows is None:
+        yield from chunks
+        return
+
+    rows = 0
+    for chunk in chunks:
+        rows += len(chunk)
+        if rows > max_rows:
+            raise LimitExceeded(
+                f"Dataset '{dataset.basename}' exceeds its {max_rows} rows limit"
+            )
+        yield chunk
+
+
+def get_chunk_size(chunk: Union[str, bytes]) -> int:
+    """Get an output chunk size in bytes."""
+    return len(chunk.encode() if isinstance(chunk, str) else chunk)
+
+
+def limit_bytes(
+    chunks: Iterable[T],
+    dataset: Dataset,
+    sizeof: Callable[[T], int] = get_chunk_size,  # type: ignore[assignment]
+) -> Generator[T, None, None]:
+    """Enforce dataset bytes limit over output chunks.
+
+    Chunks sizes are output chunks sizes by default, a `sizeof` function can be
+    given for other chunks types (_e.g._ record batches).
+    """
+    max_bytes = get_max_bytes(dataset)
+    if max_bytes is None:
+        yield from chunks
+        return
+
+    size = 0
+    for chunk in chunks:
+        size += sizeof(chunk)
+        if size > max_bytes:
+            raise LimitExceeded(
+                f"Dataset '{dataset.basename}' exceeds its {max_bytes} bytes limit"
+            )
+        yield chunk
+
+
+def limited(streamer: Callable[..., Generator]) -> Callable[..., Generator]:
+    """Enforce dataset bytes limit for a streamer output.
+
+    Streamers are expected to take the database engine and the dataset as first
+    arguments.
+    """
+
+    @functools.wraps(streamer)
+    def wrapper(engine, dataset: Dataset, *args, **kwargs) -> Generator:
+        with contextlib.closing(streamer(engine, dataset, *args, **kwargs)) as chunks:
+            yield from limit_bytes(chunks, dataset)
+
+    return wrapper
@@ -0,0 +1,214 @@
+"""Data7 materialize module.
+
+Filtered or projected requests (see `Dataset.bind`) can be served from a local
+Parquet materialization of the dataset query results, read using
+`pyarrow.dataset`: only row groups whose statistics match filters and selected
+columns are read. Materializations are refreshed once their TTL expired, and
+removed once expired for longer than their TTL.
+"""
+
+import contextlib
+import glob
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Generator, Iterable, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import parquet as pq
+
+from .cache import get_cache_key
+from .config import get_config
+from .models import Dataset, Filter, FilterError
+
+logger = logging.getLogger(__name__)
+
+# Filters operators Arrow compute functions (except `in`)
+EXPRESSION_OPERATORS: Dict[str, str] = {
+    "eq": "equal",
+    "neq": "not_equal",
+    "lt": "less",
+    "lte": "less_equal",
+    "gt": "greater",
+    "gte": "greater_equal",
+}
+
+_locks: Dict[Path, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+def get_materialize_ttl(dataset: Dataset) -> float:
+    """Get dataset materialization TTL (0 means the dataset is not materialized)."""
+    if dataset.materialize_ttl is not None:
+        return dataset.materialize_ttl
+    return get_config().materialize_ttl
+
+
+def is_materialized(dataset: Dataset) -> bool:
+    """Check if a dataset request should be served from its materialization."""
+    return dataset.is_restricted and bool(get_materialize_ttl(dataset))
+
+
+def get_materialization_path(dataset: Dataset, *args: str) -> Path:
+    """Get dataset materialization file path.
+
+    The file name is the dataset basename followed by a digest of its query result
+    key (see `get_cache_key`).
+    """
+    key = repr(get_cache_key(dataset, *args))
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    root = Path(get_config().materialize_dir)
+    return root / f"{dataset.basename}-{digest}.parquet"
+
+
+def get_materialization_paths(dataset: Dataset) -> List[Path]:
+    """Get dataset materializations files paths (for all parameters values)."""
+    root = Path(get_config().materialize_dir)
+    pattern = f"{glob.escape(dataset.basename)}-{'[0-9a-f]' * 16}.parquet"
+    return list(root.glob(pattern))
+
+
+def is_fresh(path: Path, ttl: float) -> bool:
+    """Check if a materialization exists and is younger than its TTL."""
+    try:
+        return time.time() - path.stat().st_mtime < ttl
+    except FileNotFoundError:
+        return False
+
+
+@contextlib.contextmanager
+def lock(path: Path) -> Generator[None, None, None]:
+    """Lock a materialization so that it is refreshed once at a time."""
+    with _locks_lock:
+        path_lock = _locks.setdefault(path, threading.Lock())
+    with path_lock:
+        yield
+
+
+def remove_expired(dataset: Dataset):
+    """Remove dataset materializations expired for longer than their TTL.
+
+    Materializations of other parameters values are never refreshed if they are
+    not requested anymore. Materializations that just expired are kept as they
+    may still be scanned by running requests.
+    """
+    ttl = get_materialize_ttl(dataset)
+    for path in get_materialization_paths(dataset):
+        with lock(path):
+            if not is_fresh(path, 2 * ttl):
+                path.unlink(missing_ok=True)
+                logger.info("Removed expired materialization %s", path)
+
+
+def write_materialization(
+    path: Path, schema: pa.Schema, batches: Iterable[pa.RecordBatch]
+):
+    """Write record batches to a materialization file.
+
+    The file is written next to its destination then atomically moved, so that
+    readers never see a partial materialization.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    row_group_size = get_config().materialize_row_group_size
+    try:
+        with pq.ParquetWriter(tmp, schema=schema) as writer:
+            for batch in batches:
+                writer.write_batch(
+                    batch.select(schema.names).cast(schema),
+                    row_group_size=row_group_size,
+                )
+        tmp.replace(path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    logger.info("Materialized %s (%d bytes)", path, path.stat().st_size)
+
+
+def parse_value(value: str, type_: pa.DataType, filter_: Filter) -> pa.Scalar:
+    """Parse a filter value given the filtered column type."""
+    if pa.types.is_dictionary(type_):
+        type_ = type_.value_type
+    try:
+        return pa.scalar(value).cast(type_)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as exc:
+        raise FilterError(
+            f"Filter '{filter_.column}' value '{value}' is not a valid {type_}"
+        ) from exc
+
+
+def get_filter_expression(
+    dataset: Dataset, schema: pa.Schema
+) -> Optional[ds.Expression]:
+    """Get the Arrow expression matching all dataset filters (if any)."""
+    expression = None
+    for filter_ in dataset.filters:
+        if filter_.column not in schema.names:
+            raise FilterError(f"Filter column '{filter_.column}' does not exist")
+        type_ = schema.field(filter_.column).type
+        field = pc.field(filter_.column)
+        if filter_.operator == "in":
+            values = [parse_value(v, type_, filter_) for v in filter_.value.split(",")]
+            condition = field.isin(
+                pa.array([v.as_py() for v in values], values[0].type)
+            )
+        else:
+            operator = EXPRESSION_OPERATORS[filter_.operator]
+            condition = getattr(pc, operator)(
+                field, parse_value(filter_.value, type_, filter_)
+            )
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def get_columns(dataset: Dataset, schema: pa.Schema) -> List[str]:
+    """Get dataset selected columns (all columns if none is selected)."""
+    for column in dataset.select:
+        if column not in schema.names:
+            raise FilterError(f"Selected column '{column}' does not exist")
+    return dataset.select or schema.names
+
+
+def restrict_schema(schema: pa.Schema, dataset: Dataset) -> pa.Schema:
+    """Get a query result schema restricted to dataset selected columns.
+
+    Pandas metadata (_e.g._ indexes) are removed if columns are selected.
+    """
+    if not dataset.select:
+        return schema
+    return pa.schema([schema.field(column) for column in get_columns(dataset, schema)])
+
+
+def restrict_batches(
+    batches: Iterable[pa.RecordBatch], dataset: Dataset
+) -> Iterator[pa.RecordBatch]:
+    """Filter rows and select columns of record batches."""
+    expression = None
+    columns: List[str] = []
+    for batch in batches:
+        if not columns:
+            expression = get_filter_expression(dataset, batch.schema)
+            columns = get_columns(dataset, batch.schema)
+        if expression is not None:
+            batch = batch.filter(expression)  # noqa: PLW2901
+        yield batch.select(columns)
+
+
+def scan_materialization(
+    path: Path, dataset: Dataset, chunksize: int
+) -> Iterator[pa.RecordBatch]:
+    """Scan a materialization given dataset selected columns and filters.
+
+    Row groups that cannot match filters (given their statistics) and unselected
+    columns are not read.
+    """
+    materialization = ds.dataset(path, format="parquet")
+    return materialization.to_batches(
+        columns=restrict_schema(materialization.schema, dataset).names,
+        filter=get_filter_expression(dataset, materialization.schema),
+        batch_size=chunksize,
+    )
@@ -0,0 +1,91 @@
+"""Data7 memory module.
+
+Request stages (fetch, convert, encode) peak memory usage can be tracked using a
+per-request `MemoryUsage` recorder bound to a context variable. Python
+allocations are traced using tracemalloc (that should be started), and Arrow
+allocations using the Arrow default memory pool. Recorded usage is sent to
+clients in the `Server-Memory` header/trailers (see `data7.app`).
+
+As tracemalloc peaks are process-wide, stages peaks are only accurate when
+requests are not served concurrently (_e.g._ while reproducing an out of memory
+error).
+"""
+
+import contextlib
+import tracemalloc
+from contextvars import ContextVar
+from typing import Any, Dict, Generator, Optional
+
+current_memory: ContextVar[Optional["MemoryUsage"]] = ContextVar(
+    "current_memory", default=None
+)
+
+
+def get_arrow_allocated() -> int:
+    """Get bytes currently allocated by the Arrow default memory pool."""
+    import pyarrow as pa  # noqa: PLC0415
+
+    return pa.total_allocated_bytes()
+
+
+def format_bytes(size: float) -> str:
+    """Format a size in bytes for humans."""
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:  # noqa: PLR2004
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
+
+
+class MemoryUsage:
+    """Request stages peak memory usage recorder (in bytes)."""
+
+    def __init__(self):
+        """Start recording."""
+        # Peak Python memory allocated by each stage
+        self.stages: Dict[str, int] = {}
+        # Peak Arrow memory allocated (sampled at stages ends)
+        self.arrow_start = get_arrow_allocated()
+        self.arrow = 0
+
+    def add(self, stage: str, peak: int, arrow_allocated: int):
+        """Record a stage Python memory peak and Arrow allocated memory."""
+        self.stages[stage] = max(self.stages.get(stage, 0), peak)
+        self.arrow = max(self.arrow, arrow_allocated - self.arrow_start)
+
+    @property
+    def peak(self) -> int:
+        """Get the request peak memory (Python and Arrow) estimate."""
+        return max(self.stages.values(), default=0) + self.arrow
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get recorded memory usage (_e.g._ for structured logs)."""
+        return {**self.stages, "arrow": self.arrow, "peak": self.peak}
+
+    def to_header(self) -> str:
+        """Get the Server-Memory header value (sizes are in bytes)."""
+        return ", ".join(
+            f"{name};bytes={size}" for name, size in self.to_dict().items()
+        )
+
+    def __str__(self) -> str:
+        """Get recorded memory usage for humans."""
+        return ", ".join(
+            f"{name}={format_bytes(size)}" for name, size in self.to_dict().items()
+        )
+
+
+@contextlib.contextmanager
+def track(stage: str) -> Generator[None, None, None]:
+    """Track a stage peak memory for the current request (if any)."""
+    memory = current_memory.get()
+    if memory is None or not tracemalloc.is_tracing():
+        yield
+        return
+    start, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        memory.add(stage, peak - start, get_arrow_allocated())
@@ -1,32 +1,538 @@
 """Data7 models module."""
 
 import logging
-from dataclasses import dataclass
-from enum import StrEnum
-from typing import List, Optional
+from dataclasses import dataclass, field, fields, replace
+from datetime import date, datetime
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    get_args,
+    get_origin,
+)
 
 logger = logging.getLogger(__name__)
 
 
-class Extension(StrEnum):
-    """Supported formats extensions."""
+def parse_bool(value: str) -> bool:
+    """Parse a boolean parameter value."""
+    if value.lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.lower() in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"invalid boolean: '{value}'")
 
-    CSV = "csv"
-    PARQUET = "parquet"
 
+# Supported parameters types with their parsers
+PARAMETER_TYPES: Dict[str, Callable[[str], Any]] = {
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": parse_bool,
+    "date": date.fromisoformat,
+    "datetime": datetime.fromisoformat,
+}
 
-class MimeType(StrEnum):
-    """MimeTypes for supported formats."""
 
-    CSV = "text/csv"
-    PARQUET = "application/vnd.apache.parquet"
+@dataclass
+class Parameter:
+    """Dataset query parameter model.
+
+    A parameter without default value is required.
+    """
+
+    name: str
+    type: str = "str"
+    default: Optional[Any] = None
+
+    def __post_init__(self):
+        """Check parameter type."""
+        if self.type not in PARAMETER_TYPES:
+            raise ValueError(
+                f"Parameter '{self.name}' type '{self.type}' is not supported"
+            )
+
+    @property
+    def required(self) -> bool:
+        """Check if the parameter is required."""
+        return self.default is None
+
+    def parse(self, value: str) -> Any:
+        """Parse a parameter value given its type."""
+        try:
+            return PARAMETER_TYPES[self.type](value)
+        except ValueError as exc:
+            raise ValueError(
+                f"Parameter '{self.name}' value '{value}' is not a valid {self.type}"
+            ) from exc
+
+
+# Supported column hints target types (Arrow type aliases)
+COLUMN_TYPES: List[str] = [
+    "int8",
+    "int16",
+    "int32",
+    "int64",
+    "uint8",
+    "uint16",
+    "uint32",
+    "uint64",
+    "float16",
+    "float32",
+    "float64",
+    "string",
+    "large_string",
+]
+
+
+@dataclass
+class ColumnHint:
+    """Dataset column hint model.
+
+    Hints are applied to query result batches to reduce their memory footprint
+    and output size.
+    """
+
+    name: str
+    # Target type, _e.g._ `int16` or `float32` for narrower numeric columns
+    type: Optional[str] = None
+    # Dictionary encode values (for low-cardinality columns)
+    dictionary: bool = False
+
+    def __post_init__(self):
+        """Check column target type."""
+        if self.type is not None and self.type not in COLUMN_TYPES:
+            raise ValueError(
+                f"Column '{self.name}' type '{self.type}' is not supported"
+            )
+
+
+# Supported filters operators, _e.g._ `country=eq.France` or `year=gte.2020`
+FILTER_OPERATORS: List[str] = ["eq", "neq", "lt", "lte", "gt", "gte", "in"]
+
+# Query string argument used to select (project) columns, _e.g._ `select=id,name`
+SELECT_ARGUMENT: str = "select"
+
+# Query string argument used to request a preview (first rows), _e.g._ `head=10`
+HEAD_ARGUMENT: str = "head"
+
+
+def parse_head(value: str) -> int:
+    """Parse the requested preview rows (a positive integer)."""
+    try:
+        head = int(value)
+    except ValueError:
+        head = 0
+    if head < 1:
+        raise ValueError(f"Argument 'head' value '{value}' is not a positive int")
+    return head
+
+
+class FilterError(ValueError):
+    """Raised when requested columns or filters do not match the dataset."""
+
+
+@dataclass
+class Filter:
+    """Dataset rows filter model.
+
+    Filters values are parsed given the filtered column type when applied.
+    """
+
+    column: str
+    operator: str
+    value: str
+
+    def __post_init__(self):
+        """Check filter operator."""
+        if self.operator not in FILTER_OPERATORS:
+            raise ValueError(f"Filter operator '{self.operator}' is not supported")
+
+    @classmethod
+    def parse(cls, column: str, value: str) -> Optional["Filter"]:
+        """Parse a filter from a query string argument (`operator.value`).
+
+        Returns None if the value is not prefixed by a supported operator.
+        """
+        operator, sep, value = value.partition(".")
+        if not sep or operator not in FILTER_OPERATORS:
+            return None
+        return cls(column, operator, value)
+
+
+# Supported derived datasets aggregate functions (Arrow hash aggregations)
+AGGREGATE_FUNCTIONS: List[str] = [
+    "count",
+    "count_distinct",
+    "sum",
+    "mean",
+    "min",
+    "max",
+]
+
+# Supported derived datasets join types (Arrow join types)
+JOIN_TYPES: List[str] = [
+    "inner",
+    "left outer",
+    "right outer",
+    "full outer",
+    "left semi",
+    "left anti",
+]
+
+
+@dataclass
+class Aggregate:
+    """Derived dataset aggregate model."""
+
+    column: str
+    function: str
+    # Output column name (`<column>_<function>` if not set)
+    name: Optional[str] = None
+
+    def __post_init__(self):
+        """Check aggregate function and set the default output name."""
+        if self.function not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Aggregate function '{self.function}' is not supported")
+        if self.name is None:
+            self.name = f"{self.column}_{self.function}"
+
+
+@dataclass
+class Join:
+    """Derived dataset join model (the source dataset being the left side)."""
+
+    dataset: str
+    keys: List[str]
+    # Joined dataset keys (same as `keys` if not set)
+    right_keys: Optional[List[str]] = None
+    type: str = "inner"
+
+    def __post_init__(self):
+        """Check join type."""
+        if self.type not in JOIN_TYPES:
+            raise ValueError(f"Join type '{self.type}' is not supported")
+
+
+@dataclass
+class Derivation:
+    """Derived dataset model.
+
+    A derived dataset is computed from its source dataset query result: the
+    source is (optionally) joined with another dataset, then its rows are
+    filtered, grouped and aggregated, and its columns selected, in this order.
+    Filters are defined as requests filters (_e.g._ `country: eq.France`).
+    """
+
+    source: str
+    join: Optional[Join] = None
+    filters: List[Filter] = field(default_factory=list)
+    group_by: List[str] = field(default_factory=list)
+    aggregates: List[Aggregate] = field(default_factory=list)
+    select: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        """Load join, filters and aggregates definitions."""
+        if self.join is not None and not isinstance(self.join, Join):
+            self.join = Join(**self.join)
+        if isinstance(self.filters, Mapping):
+            filters = []
+            for column, value in self.filters.items():
+                if (filter_ := Filter.parse(column, str(value))) is None:
+                    raise ValueError(
+                        f"Filter '{column}' value '{value}' has no supported operator"
+                    )
+                filters.append(filter_)
+            self.filters = filters
+        self.aggregates = [
+            a if isinstance(a, Aggregate) else Aggregate(**a) for a in self.aggregates
+        ]
+
+    @property
+    def sources(self) -> List[str]:
+        """Get source datasets basenames (the source, then the joined dataset)."""
+        if self.join is None:
+            return [self.source]
+        return [self.source, self.join.dataset]
 
 
 @dataclass
 class Dataset:
-    """Dataset model."""
+    """Dataset model.
+
+    A dataset either runs its own query, or is derived from other datasets
+    query results (see `Derivation`).
+    """
 
     basename: str
-    query: str
+    query: str = ""
     # Indexes can be defined for a dataset query
     indexes: Optional[List[str]] = None
+    # Named database the dataset query runs against (default database if not set)
+    database: Optional[str] = None
+    # Query results cache TTL in seconds (`RESULT_CACHE_TTL` setting if not set)
+    cache_ttl: Optional[float] = None
+    # Query bound parameters definitions, _e.g._ `:year` in the query
+    parameters: List[Parameter] = field(default_factory=list)
+    # Query bound parameters values (see `bind`)
+    params: Dict[str, Any] = field(default_factory=dict)
+    # Columns hints (type downcasting and dictionary encoding)
+    columns: List[ColumnHint] = field(default_factory=list)
+    # Strings use 64-bit offsets if true, 32-bit offsets if false (smaller)
+    large_strings: Optional[bool] = None
+    # Limits (`STATEMENT_TIMEOUT`, `MAX_ROWS` and `MAX_BYTES` settings if not set,
+    # 0 means no limit)
+    statement_timeout: Optional[float] = None
+    max_rows: Optional[int] = None
+    max_bytes: Optional[int] = None
+    # Local Parquet materialization TTL in seconds, used to serve filtered or
+    # projected requests (`MATERIALIZE_TTL` setting if not set)
+    materialize_ttl: Optional[float] = None
+    # Requested columns and rows filters (see `bind`)
+    select: List[str] = field(default_factory=list)
+    filters: List[Filter] = field(default_factory=list)
+    # Requested preview rows (see `bind`)
+    head: Optional[int] = None
+    # Query results partitions (given an integer column values modulo) retrieved
+    # in parallel by Arrow Flight clients (see `partition`)
+    partition_column: Optional[str] = None
+    partitions: int = 1
+    # Derivation from other datasets query results (instead of a query)
+    derive: Optional[Derivation] = None
+    # Derivation source datasets per basename (set when datasets are populated)
+    sources: Dict[str, "Dataset"] = field(default_factory=dict)
+
+    def __post_init__(self):
+        """Load definitions, check partitioning and derivation."""
+        self.parameters = [
+            p if isinstance(p, Parameter) else Parameter(**p) for p in self.parameters
+        ]
+        self.columns = [
+            c if isinstance(c, ColumnHint) else ColumnHint(**c) for c in self.columns
+        ]
+        if self.partitions < 1:
+            raise ValueError(
+                f"Dataset '{self.basename}' partitions should be a positive int"
+            )
+        if self.partitions > 1 and self.partition_column is None:
+            raise ValueError(
+                f"Dataset '{self.basename}' partitions require a partition column"
+            )
+        if self.derive is not None and not isinstance(self.derive, Derivation):
+            self.derive = Derivation(**self.derive)
+        if bool(self.query) == self.is_derived:
+            raise ValueError(
+                f"Dataset '{self.basename}' should either define a query or derive"
+            )
+        if self.is_derived and (self.parameters or self.partitions > 1):
+            raise ValueError(
+                f"Dataset '{self.basename}' is derived, it cannot be parameterized "
+                "or partitioned"
+            )
+
+    @property
+    def has_column_hints(self) -> bool:
+        """Check if hints should be applied to query results."""
+        return bool(self.columns) or self.large_strings is not None
+
+    @property
+    def is_derived(self) -> bool:
+        """Check if the dataset is derived from other datasets."""
+        return self.derive is not None
+
+    @property
+    def is_restricted(self) -> bool:
+        """Check if only a subset of query results columns or rows is requested."""
+        return bool(self.select) or bool(self.filters)
+
+    @property
+    def required_parameters(self) -> List[str]:
+        """Get required parameters names."""
+        return [p.name for p in self.parameters if p.required]
+
+    def bind(self, values: Mapping[str, str]) -> "Dataset":
+        """Get a copy of the dataset with parameters values bound.
+
+        Values (_e.g._ request query string arguments) are parsed given parameters
+        types, unknown values are ignored and missing values use parameters
+        defaults.
+
+        Other values may select columns (`select=id,name`), filter rows given a
+        column value (`name=operator.value`, _e.g._ `country=eq.France`) or limit
+        the output to its first rows (`head=10`).
+        """
+        params = {}
+        for parameter in self.parameters:
+            if parameter.name in values:
+                params[parameter.name] = parameter.parse(values[parameter.name])
+            elif parameter.required:
+                raise ValueError(f"Parameter '{parameter.name}' is required")
+            else:
+                params[parameter.name] = parameter.default
+
+        select = []
+        filters = []
+        head = None
+        for name, value in values.items():
+            if name in params:
+                continue
+            if name == SELECT_ARGUMENT:
+                select = [column for column in value.split(",") if column]
+            elif name == HEAD_ARGUMENT:
+                head = parse_head(value)
+            elif (filter_ := Filter.parse(name, value)) is not None:
+                filters.append(filter_)
+        return replace(self, params=params, select=select, filters=filters, head=head)
+
+    def partition(self, index: int) -> "Dataset":
+        """Get a copy of the dataset querying one partition of its results.
+
+        Partitions have their own basename (so that they are cached and
+        materialized separately) and are not partitioned.
+        """
+        if not 0 <= index < self.partitions:
+            raise ValueError(
+                f"Dataset '{self.basename}' partition {index} does not exist"
+            )
+        query = (
+            f"SELECT * FROM ({self.query}) AS data7_partition "  # noqa: S608
+            f"WHERE ABS({self.partition_column} % {self.partitions}) = {index}"
+        )
+        return replace(
+            self,
+            basename=f"{self.basename}-{index}-of-{self.partitions}",
+            query=query,
+            partition_column=None,
+            partitions=1,
+        )
+
+
+@dataclass
+class DatasetMetadata:
+    """Dataset catalog metadata model.
+
+    Metadata are computed in the background using parameters defaults, except
+    outputs sizes which are recorded when default requests are rendered.
+    """
+
+    basename: str
+    # Query result columns names and Arrow types
+    columns: Optional[Dict[str, str]] = None
+    # Approximate query result rows count
+    rows: Optional[int] = None
+    # Last rendered outputs sizes (in bytes) per format extension
+    sizes: Dict[str, int] = field(default_factory=dict)
+    # Last metadata refresh time (POSIX timestamp)
+    refreshed: Optional[float] = None
+
+
+@dataclass
+class PoolStats:
+    """Database engine connection pool statistics model."""
+
+    # New connections, and connections re-established after being invalidated or
+    # recycled
+    connects: int = 0
+    reconnects: int = 0
+    # Connections invalidated by the pool monitor (failed validation)
+    invalidated: int = 0
+    # Requests connections checkouts, total and longest wait times (in seconds)
+    checkouts: int = 0
+    wait_time: float = 0.0
+    max_wait: float = 0.0
+
+
+@dataclass
+class Database:
+    """Database model.
+
+    Pool settings default to the global `db_pool_*` settings when not set.
+    """
+
+    name: str
+    url: str
+    # Read-replicas URLs, dataset queries are balanced across healthy replicas
+    replicas: List[str] = field(default_factory=list)
+    pool_check: Optional[bool] = None
+    pool_recycle: Optional[int] = None
+    pool_size: Optional[int] = None
+    pool_max_overflow: Optional[int] = None
+    # Server-side prepared statements (psycopg only, `db_prepare_threshold` setting)
+    prepare_threshold: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class Config:
+    """Compiled settings model (see `data7.config.get_config`).
+
+    Request path settings are read once, checked and typed, so that reading them
+    is a plain attribute access (Dynaconf lookups resolve environments and
+    case-insensitive keys on every access). Fields are named after their
+    settings (lowercase).
+    """
+
+    # Pandas chunks
+    chunk_size: int = 5000
+    schema_sniffer_size: int = 1000
+    default_dtype_backend: Literal["numpy_nullable", "pyarrow"] = "pyarrow"
+    output_flush_size: int = 0
+    # Default datasets results cache and materializations TTLs (seconds)
+    result_cache_ttl: float = 0
+    materialize_ttl: float = 0
+    materialize_dir: str = "materialized"
+    materialize_row_group_size: int = 100_000
+    # Rendered outputs cache
+    render_cache_ttl: float = 0
+    render_cache_dir: str = "rendered"
+    render_cache_lock_timeout: float = 300
+    render_cache_max_bytes: int = 0
+    preview_rows: int = 0
+    # Default datasets limits (0 means no limit)
+    statement_timeout: float = 0
+    max_rows: int = 0
+    max_bytes: int = 0
+    # CSV encoder and Arrow CSV encoder options
+    csv_encoder: Literal["pandas", "arrow"] = "pandas"
+    csv_native_export: bool = False
+    csv_delimiter: str = ","
+    csv_quoting_style: Literal["needed", "all_valid", "none"] = "needed"
+    csv_null_value: Optional[str] = None
+    csv_float_precision: Optional[int] = None
+    csv_timestamp_format: Optional[str] = None
+    # Profiling
+    profiler_interval: float = 0.001
+    profiler_async_mode: Literal["enabled", "disabled", "strict"] = "enabled"
+    slow_request_threshold: Optional[float] = None
+    slow_request_sample_rate: float = 1.0
+    slow_request_profiles_dir: str = "profiles"
+
+    def __post_init__(self):
+        """Check settings types and choices."""
+        for definition in fields(self):
+            name, value = definition.name.upper(), getattr(self, definition.name)
+            if get_origin(definition.type) is Literal:
+                choices = get_args(definition.type)
+                if value not in choices:
+                    raise ValueError(
+                        f"Setting '{name}' value {value!r} is not one of "
+                        f"{', '.join(choices)}"
+                    )
+                continue
+            types = get_args(definition.type) or (definition.type,)
+            expected = types[0]
+            if expected is float:
+                types += (int,)
+            if not isinstance(value, types) or (
+                isinstance(value, bool) and expected is not bool
+            ):
+                raise ValueError(
+                    f"Setting '{name}' value {value!r} is not a valid "
+                    f"{expected.__name__}"
+                )
+        for name in ("chunk_size", "schema_sniffer_size"):
+            if getattr(self, name) <= 0:
+                raise ValueError(f"Setting '{name.upper()}' should be positive")
@@ -0,0 +1,80 @@
+"""Data7 native exports module.
+
+Some databases drivers can export query results as CSV server-side (_e.g._
+PostgreSQL `COPY ... TO STDOUT`), which is much faster than fetching rows and
+encoding them in Python. Native exporters are registered per dialect and driver,
+and used by the `sql2csv` streamer when available (see `get_native_exporter`).
+"""
+
+import logging
+from typing import Any, Callable, Dict, Generator, Mapping, Optional, Tuple
+
+from sqlalchemy import Connection
+from sqlalchemy.engine import Dialect
+
+from .config import get_config
+from .limits import get_max_rows
+from .models import Dataset
+from .sink import OutputSink, get_flush_size
+from .timing import timed
+from .utils import get_statement
+
+logger = logging.getLogger(__name__)
+
+NativeExporter = Callable[[Connection, Dataset], Generator[bytes, None, None]]
+
+
+def get_driver_query(
+    dataset: Dataset, dialect: Dialect
+) -> Tuple[str, Optional[Mapping[str, Any]]]:
+    """Get the dataset query and parameters values in the driver paramstyle."""
+    statement = get_statement(dataset)
+    if isinstance(statement, str):
+        return statement, None
+    compiled = statement.compile(dialect=dialect)
+    return str(compiled), compiled.construct_params(dataset.params)
+
+
+def copy_csv_psycopg(
+    conn: Connection, dataset: Dataset
+) -> Generator[bytes, None, None]:
+    """Export a dataset as CSV using PostgreSQL `COPY` (psycopg driver).
+
+    Parameters values are bound client-side by psycopg (`COPY` does not support
+    bound parameters). Rows are streamed by the server one at a time, hence they
+    are coalesced up to the output flush size.
+    """
+    query, params = get_driver_query(dataset, conn.dialect)
+    output = OutputSink(get_flush_size())
+    cursor = conn.connection.cursor()
+    try:
+        with cursor.copy(  # type: ignore[attr-defined]
+            f"COPY ({query}) TO STDOUT WITH (FORMAT CSV, HEADER)", params
+        ) as copy:
+            for data in timed(copy, "fetch", first="first-chunk"):
+                output.write(data)
+                if content := output.pop():
+                    yield content
+    finally:
+        cursor.close()
+    if content := output.pop(final=True):
+        yield content
+
+
+# Native CSV exporters per (dialect name, driver)
+NATIVE_CSV_EXPORTERS: Dict[Tuple[str, str], NativeExporter] = {
+    ("postgresql", "psycopg"): copy_csv_psycopg,
+}
+
+
+def get_native_exporter(conn: Connection, dataset: Dataset) -> Optional[NativeExporter]:
+    """Get the connection native CSV exporter for a dataset (if any).
+
+    Native exports are disabled using the `CSV_NATIVE_EXPORT` setting. They are
+    not used for datasets with a rows limit (rows are not parsed).
+    """
+    if not get_config().csv_native_export:
+        return None
+    if get_max_rows(dataset) is not None:
+        return None
+    return NATIVE_CSV_EXPORTERS.get((conn.dialect.name, conn.dialect.driver))
@@ -0,0 +1,142 @@
+"""Data7 preview module.
+
+Datasets head samples (the first rows of their query results) are kept in-memory
+so that previews (`head` requests, see `Dataset.bind`) are served without hitting
+the database. Samples are captured when datasets are populated and periodically
+refreshed.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from .config import get_config
+from .models import Dataset
+from .utils import get_statement
+
+if TYPE_CHECKING:
+    from .databases import DatabaseRouter
+
+logger = logging.getLogger(__name__)
+
+_samples: Dict[str, "Sample"] = {}
+_samples_lock = threading.Lock()
+
+
+@dataclass
+class Sample:
+    """A dataset head sample."""
+
+    table: pa.Table
+    # Parameters values and dtype backend the query result was sampled with
+    params: Dict[str, Any]
+    dtype_backend: str
+    # The sample contains all query result rows
+    complete: bool
+    captured: float
+
+
+def get_preview_rows() -> int:
+    """Get datasets samples size (0 means samples are not captured)."""
+    return get_config().preview_rows
+
+
+def capture_sample(engine: Engine, dataset: Dataset) -> Optional[Sample]:
+    """Capture a dataset head sample using parameters defaults.
+
+    Datasets with required parameters and derived datasets are not sampled.
+    """
+    params = {p.name: p.default for p in dataset.parameters}
+    if None in params.values() or dataset.is_derived:
+        return None
+
+    rows = get_preview_rows()
+    dtype_backend = get_config().default_dtype_backend
+    with engine.connect() as conn:
+        chunk = next(
+            pd.read_sql_query(
+                get_statement(dataset),
+                conn,
+                params=params or None,
+                chunksize=rows,
+                dtype_backend=dtype_backend,
+            ),
+            None,
+        )
+    if chunk is None:
+        return None
+    return Sample(
+        table=pa.Table.from_pandas(chunk, preserve_index=False),
+        params=params,
+        dtype_backend=dtype_backend,
+        complete=len(chunk) < rows,
+        captured=time.time(),
+    )
+
+
+def capture_samples(
+    datasets: List[Dataset],
+    engine: Engine,
+    router: Optional["DatabaseRouter"] = None,
+):
+    """Capture (or refresh) datasets head samples.
+
+    If a database router is given, samples are read from an engine of the
+    dataset database, else from the given engine. A sample that cannot be
+    refreshed is kept as is.
+    """
+    for dataset in datasets:
+        if router is not None:
+            engine = router.get_read_engine(dataset.database)
+        try:
+            sample = capture_sample(engine, dataset)
+        except SQLAlchemyError:
+            logger.warning(
+                "Failed to capture '%s' dataset sample", dataset.basename, exc_info=True
+            )
+            continue
+        if sample is None:
+            continue
+        with _samples_lock:
+            _samples[dataset.basename] = sample
+        logger.debug(
+            "Captured '%s' dataset sample (%d rows)",
+            dataset.basename,
+            sample.table.num_rows,
+        )
+
+
+def get_sample(dataset: Dataset, dtype_backend: str) -> Optional[pa.Table]:
+    """Get the dataset head sample serving its `head` request (if any).
+
+    A sample serves a request if it was captured with the same parameters values
+    and dtype backend, and it has enough rows. Filtered or projected requests
+    are only served from complete samples.
+    """
+    with _samples_lock:
+        sample = _samples.get(dataset.basename)
+    if (
+        sample is None
+        or dataset.head is None
+        or sample.params != dataset.params
+        or sample.dtype_backend != dtype_backend
+    ):
+        return None
+    if sample.complete:
+        return sample.table
+    if dataset.is_restricted or sample.table.num_rows < dataset.head:
+        return None
+    return sample.table
+
+
+def clear_samples():
+    """Remove all datasets samples."""
+    with _samples_lock:
+        _samples.clear()
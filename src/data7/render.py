@@ -0,0 +1,371 @@
+"""Data7 render cache module.
+
+Datasets rendered outputs can be shared by processes (workers, or nodes sharing a
+volume) through a render cache directory (see the `RENDER_CACHE_*` settings).
+An output is rendered once (single-flight) in a background thread of the process
+that acquired its lock file, while requests in all processes stream the rendered
+file as it grows. Once complete, the file serves requests until it expires.
+Expired outputs are removed (and the render cache size capped) once an output
+has been rendered.
+
+Lock files hold their owner host, process and render token. Locks of crashed
+owners (dead process on the same host, or lock not refreshed for
+`RENDER_CACHE_LOCK_TIMEOUT` seconds) are stale and taken over.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Generator, Iterable, Optional, Union
+
+from .cancellation import current_cancellation
+from .config import get_config
+from .models import Dataset
+
+logger = logging.getLogger(__name__)
+
+# Rendered files read size and followed renders polling interval (in seconds)
+READ_SIZE = 65536
+POLL_INTERVAL = 0.05
+
+HOST = socket.gethostname()
+
+Owner = Dict[str, Union[str, int]]
+Render = Callable[[], Iterable[Union[str, bytes]]]
+
+
+class RenderError(Exception):
+    """Raised when a followed render fails after its output started streaming."""
+
+
+class RenderAborted(RenderError):
+    """Raised when a followed render ends before its output is complete."""
+
+    def __init__(self, path: Path, stale: bool = False):
+        """Create the error for a rendered output path."""
+        reason = "owner crashed" if stale else "render failed"
+        super().__init__(f"Render of '{path.name}' aborted ({reason})")
+        self.stale = stale
+
+
+def get_render_cache_ttl() -> float:
+    """Get rendered outputs TTL in seconds (0 means outputs are not cached)."""
+    return get_config().render_cache_ttl
+
+
+def get_render_path(dataset: Dataset, extension: str) -> Path:
+    """Get a dataset request rendered output path.
+
+    Request arguments (parameters values, selected columns, filters and head)
+    are part of the file name.
+    """
+    key = repr(
+        (
+            tuple(sorted(dataset.params.items())),
+            dataset.select,
+            dataset.filters,
+            dataset.head,
+        )
+    )
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    root = Path(get_config().render_cache_dir)
+    return root / f"{dataset.basename}-{digest}.{extension}"
+
+
+def is_output(path: Path) -> bool:
+    """Check if a render cache file is a rendered output (not a lock or partial)."""
+    return ".lock" not in path.suffixes and path.suffix != ".partial"
+
+
+def evict(root: Path, ttl: float, max_bytes: int = 0, keep: Optional[Path] = None):
+    """Remove expired rendered outputs and cap the render cache size.
+
+    Least recently rendered outputs are removed until fresh outputs total size is
+    at most `max_bytes` (0 means no limit). The `keep` output (_e.g._ just
+    rendered, it may still be followed) is never removed. Requests streaming a
+    removed output are not affected.
+    """
+    now = time.time()
+    outputs = []
+    for path in root.iterdir():
+        if not is_output(path) or path == keep:
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime >= ttl:
+            path.unlink(missing_ok=True)
+            logger.debug("Removed expired render %s", path)
+        else:
+            outputs.append((stat.st_mtime, stat.st_size, path))
+
+    if not max_bytes:
+        return
+    size = sum(output_size for _, output_size, _ in outputs)
+    if keep is not None:
+        with contextlib.suppress(FileNotFoundError):
+            size += keep.stat().st_size
+    for _, output_size, path in sorted(outputs):
+        if size <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        size -= output_size
+        logger.debug("Evicted render %s", path)
+
+
+def get_lock_path(path: Path) -> Path:
+    """Get a rendered output lock file path."""
+    return path.with_name(f"{path.name}.lock")
+
+
+def get_partial_path(path: Path, owner: Owner) -> Path:
+    """Get the path of a rendered output being written by a lock owner."""
+    return path.with_name(f"{path.name}.{owner['token']}.partial")
+
+
+def open_fresh(path: Path, ttl: float) -> Optional[BinaryIO]:
+    """Open a rendered output if it exists and is younger than its TTL."""
+    try:
+        file = path.open("rb")
+    except FileNotFoundError:
+        return None
+    if time.time() - os.fstat(file.fileno()).st_mtime < ttl:
+        return file
+    file.close()
+    return None
+
+
+def read_lock(lock: Path) -> Optional[Owner]:
+    """Get a lock owner (None if the lock is not held)."""
+    try:
+        return json.loads(lock.read_text())
+    except FileNotFoundError:
+        return None
+
+
+def acquire(lock: Path, owner: Owner) -> bool:
+    """Try to acquire a lock.
+
+    The lock file is written aside, then hard linked (an atomic operation that
+    fails if the lock exists, including on NFS), so that it is never read empty.
+    """
+    tmp = lock.with_name(f"{lock.name}.{owner['token']}")
+    tmp.write_text(json.dumps(owner))
+    try:
+        os.link(tmp, lock)
+    except FileExistsError:
+        return False
+    finally:
+        tmp.unlink()
+    return True
+
+
+def release(lock: Path, owner: Owner):
+    """Release a lock (if still held by its owner)."""
+    if read_lock(lock) == owner:
+        lock.unlink(missing_ok=True)
+
+
+def is_stale(lock: Path, owner: Owner, timeout: float) -> bool:
+    """Check if a lock owner crashed.
+
+    Owners on this host are checked given their process, other owners given the
+    lock age (the lock is refreshed when its owner writes a chunk).
+    """
+    if owner["host"] == HOST:
+        try:
+            os.kill(int(owner["pid"]), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        else:
+            return False
+    try:
+        return time.time() - lock.stat().st_mtime > timeout
+    except FileNotFoundError:
+        return False
+
+
+def break_lock(path: Path, owner: Owner):
+    """Remove a rendered output stale lock (if still held by the given owner).
+
+    The lock is moved aside first so that a single process removes it. A lock
+    acquired in the meantime by another owner is restored. The partial file of
+    the stale owner is removed.
+    """
+    lock = get_lock_path(path)
+    broken = lock.with_name(f"{lock.name}.{uuid.uuid4().hex}.stale")
+    try:
+        os.rename(lock, broken)
+    except FileNotFoundError:
+        return
+    try:
+        if read_lock(broken) != owner:
+            with contextlib.suppress(FileExistsError):
+                os.link(broken, lock)
+        else:
+            logger.warning("Breaking stale render lock %s (%s)", lock, owner)
+            get_partial_path(path, owner).unlink(missing_ok=True)
+    finally:
+        broken.unlink()
+
+
+def produce(  # noqa: PLR0913
+    path: Path,
+    lock: Path,
+    owner: Owner,
+    render: Render,
+    *,
+    ttl: float,
+    max_bytes: int = 0,
+):
+    """Render an output to its partial file, then move it to its path.
+
+    The lock is refreshed after each written chunk and released once the render
+    ends (the partial file is removed if the render failed). Once rendered, other
+    outputs are evicted (see `evict`).
+    """
+    partial = get_partial_path(path, owner)
+    chunks: Iterable[Union[str, bytes]] = ()
+    try:
+        chunks = render()
+        with partial.open("ab") as file:
+            for chunk in chunks:
+                file.write(chunk.encode() if isinstance(chunk, str) else chunk)
+                file.flush()
+                with contextlib.suppress(FileNotFoundError):
+                    os.utime(lock)
+        partial.replace(path)
+        logger.info("Rendered %s (%d bytes)", path, path.stat().st_size)
+    except Exception:
+        logger.exception("Failed to render %s", path)
+    else:
+        try:
+            evict(path.parent, ttl, max_bytes, keep=path)
+        except OSError:
+            logger.exception("Failed to evict renders from %s", path.parent)
+    finally:
+        if (close := getattr(chunks, "close", None)) is not None:
+            close()
+        partial.unlink(missing_ok=True)
+        release(lock, owner)
+
+
+def check_cancelled():
+    """Raise an error if the current request has been cancelled."""
+    cancellation = current_cancellation.get()
+    if cancellation is not None and cancellation.cancelled:
+        raise RuntimeError("Request has been cancelled")
+
+
+def follow(
+    path: Path,
+    lock: Path,
+    owner: Owner,
+    timeout: float,
+    file: Optional[BinaryIO] = None,
+) -> Generator[bytes, None, None]:
+    """Stream an output being rendered by a lock owner as its file grows.
+
+    The partial file is opened, unless an open `file` is given. Nothing is
+    streamed if the render already ended. `RenderAborted` is raised if the
+    render does not complete.
+    """
+    if file is None:
+        try:
+            file = get_partial_path(path, owner).open("rb")
+        except FileNotFoundError:
+            return
+
+    with file:
+        while True:
+            check_cancelled()
+            if data := file.read(READ_SIZE):
+                yield data
+                continue
+            current = read_lock(lock)
+            if current is not None and current["token"] == owner["token"]:
+                if is_stale(lock, owner, timeout):
+                    raise RenderAborted(path, stale=True)
+                time.sleep(POLL_INTERVAL)
+                continue
+            # The render ended: it completed if its file is now the output file
+            try:
+                completed = os.path.samestat(os.fstat(file.fileno()), path.stat())
+            except FileNotFoundError:
+                completed = False
+            if not completed:
+                raise RenderAborted(path)
+            while data := file.read(READ_SIZE):
+                yield data
+            return
+
+
+def render_cached(
+    path: Path, render: Render, ttl: float, timeout: float = 300, max_bytes: int = 0
+) -> Generator[Union[str, bytes], None, None]:
+    """Stream a rendered output from the render cache (see module docstring).
+
+    Once the output has been rendered, expired outputs are removed and least
+    recently rendered outputs are removed if the render cache exceeds
+    `max_bytes` (0 means no limit).
+
+    If the render fails before anything has been streamed, the output is
+    rendered by the request itself (uncached, so that errors are raised as is).
+    Otherwise a `RenderError` is raised.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lock = get_lock_path(path)
+    streamed = False
+    while True:
+        file = open_fresh(path, ttl)
+        if file is not None:
+            with file:
+                while data := file.read(READ_SIZE):
+                    yield data
+            return
+
+        owner = read_lock(lock)
+        partial = None
+        if owner is None:
+            owner = {"host": HOST, "pid": os.getpid(), "token": uuid.uuid4().hex}
+            # The partial file exists as long as the lock is held
+            partial = get_partial_path(path, owner).open("w+b")
+            if not acquire(lock, owner):
+                partial.close()
+                get_partial_path(path, owner).unlink()
+                continue
+            threading.Thread(
+                target=produce,
+                args=(path, lock, owner, render),
+                kwargs={"ttl": ttl, "max_bytes": max_bytes},
+                name=f"render-{path.name}",
+                daemon=True,
+            ).start()
+        elif is_stale(lock, owner, timeout):
+            break_lock(path, owner)
+            continue
+
+        try:
+            for data in follow(path, lock, owner, timeout, partial):
+                streamed = True
+                yield data
+        except RenderAborted as exc:
+            if streamed:
+                raise
+            if not exc.stale:
+                yield from render()
+                return
+            break_lock(path, owner)
+            continue
+        if streamed:
+            return
@@ -0,0 +1,130 @@
+"""Data7 server module.
+
+In preload mode, the `data7 run` parent process imports the application and
+validates datasets (and computes their catalog metadata) once, then forks
+workers that inherit this state, instead of spawning workers that each import
+the application and validate datasets against databases.
+
+Workers either share the socket bound by the parent process, or bind their own
+socket with the `SO_REUSEPORT` option so that the kernel balances connections
+across workers.
+"""
+
+import logging
+import os
+import signal
+import socket
+import sys
+from typing import TYPE_CHECKING, Optional, Set
+
+from .catalog import catalog
+from .config import settings
+from .utils import populate_datasets
+
+if TYPE_CHECKING:
+    import uvicorn
+
+logger = logging.getLogger(__name__)
+
+# Exit code of workers that failed to start (as uvicorn)
+STARTUP_FAILURE = 3
+
+
+def preload():
+    """Import the application and validate datasets once.
+
+    Databases connections opened while validating datasets are closed so that
+    they are not shared with forked workers.
+    """
+    from .app import app, engine, router  # noqa: PLC0415
+
+    app.state.datasets = populate_datasets(engine, router)
+    if settings.get("CATALOG_URL"):
+        catalog.refresh_all(app.state.datasets, engine, router)
+    app.state.preloaded = True
+    router.dispose()
+
+
+def bind_reuse_port_socket(host: str, port: int) -> socket.socket:
+    """Bind a socket that other workers can bind to (`SO_REUSEPORT`)."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family=family)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def run_worker(config: "uvicorn.Config", sock: Optional[socket.socket]) -> int:
+    """Run a forked worker server, returns its exit code."""
+    import uvicorn  # noqa: PLC0415
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        if sock is None:
+            sock = bind_reuse_port_socket(config.host, config.port)
+        uvicorn.Server(config).run(sockets=[sock])
+    except SystemExit as exc:
+        return exc.code if isinstance(exc.code, int) else 1
+    except Exception:
+        logger.exception("Worker %d failed", os.getpid())
+        return STARTUP_FAILURE
+    return 0
+
+
+def serve(config: "uvicorn.Config", workers: int, reuse_port: bool = False):
+    """Serve the preloaded application using forked workers.
+
+    Workers that exit unexpectedly are restarted, unless they failed to start.
+    SIGINT and SIGTERM signals are forwarded to workers.
+    """
+    sock = None if reuse_port else config.bind_socket()
+    pids: Set[int] = set()
+    stopping = False
+
+    def fork() -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = STARTUP_FAILURE
+            try:
+                code = run_worker(config, sock)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        logger.info("Started worker process [%d]", pid)
+        return pid
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    pids.update(fork() for _ in range(workers))
+
+    failed = False
+    while pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        pids.discard(pid)
+        code = os.waitstatus_to_exitcode(status)
+        if stopping:
+            continue
+        if code == STARTUP_FAILURE:
+            logger.error("Worker %d failed to start, stopping", pid)
+            failed = True
+            stop(signal.SIGTERM, None)
+            continue
+        logger.warning("Worker %d exited (%d), restarting it", pid, code)
+        pids.add(fork())
+
+    if sock is not None:
+        sock.close()
+    if failed:
+        sys.exit(STARTUP_FAILURE)
@@ -0,0 +1,106 @@
+"""Data7 sink module.
+
+Format writers (Parquet, Arrow CSV, zip archives) write their output to an
+`OutputSink` that keeps written buffers instead of copying them into a
+`BytesIO`. Kept buffers are handed out to the response once they reach the
+output flush size, so that many small writes (_e.g._ Parquet pages) end up as a
+few large socket writes.
+
+Arrow writers write to the sink through an Arrow output stream (see
+`OutputSink.open_stream`): their writes are coalesced in Arrow memory, hence each
+handed out chunk is a single Python buffer, allocated once and never copied.
+"""
+
+import io
+from typing import TYPE_CHECKING, List, Optional
+
+from .config import get_config
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+# Arrow output stream buffer size when output is not coalesced (batches output is
+# then handed out as soon as it is written)
+STREAM_BUFFER_SIZE = 65536
+
+
+def get_flush_size() -> int:
+    """Get the output flush size in bytes (0 hands out every write)."""
+    return get_config().output_flush_size
+
+
+class OutputSink(io.RawIOBase):
+    """A non-seekable binary stream handing out written buffers."""
+
+    def __init__(self, flush_size: int = 0):
+        """Create an empty sink flushing buffers once they reach `flush_size`."""
+        self.flush_size = flush_size
+        self._buffers: List[bytes] = []
+        self._size = 0
+        self._stream: Optional["pa.NativeFile"] = None
+
+    def writable(self) -> bool:
+        """The stream is writable."""
+        return True
+
+    def write(self, b) -> int:
+        """Keep a written buffer.
+
+        Immutable `bytes` buffers are kept as is. Other buffers are copied as
+        writers may reuse them (_e.g._ the Arrow CSV writer output buffer).
+        """
+        data = b if isinstance(b, bytes) else bytes(b)
+        if data:
+            self._buffers.append(data)
+            self._size += len(data)
+        return len(data)
+
+    @property
+    def pending(self) -> int:
+        """Get the size of kept buffers (in bytes)."""
+        return self._size
+
+    def pop(self, final: bool = False) -> bytes:
+        """Get and forget kept buffers if they reached the flush size.
+
+        Returns an empty content if the flush size is not reached, unless the
+        output is `final`. A single kept buffer is returned without copy.
+        """
+        if not self._buffers or (not final and self._size < self.flush_size):
+            return b""
+        if len(self._buffers) == 1:
+            content = self._buffers[0]
+        else:
+            content = b"".join(self._buffers)
+        self._buffers.clear()
+        self._size = 0
+        return content
+
+    def open_stream(self) -> "pa.NativeFile":
+        """Get an Arrow output stream writing to the sink.
+
+        Writes are buffered in Arrow memory up to the flush size (or
+        `STREAM_BUFFER_SIZE` if output is not coalesced), then written to the sink
+        as a new `bytes` buffer, kept without copy. Writes larger than the buffer
+        are written as is. Stream output is handed out using `drain`.
+        """
+        import pyarrow as pa  # noqa: PLC0415
+
+        if self._stream is None:
+            self._stream = pa.BufferedOutputStream(
+                pa.PythonFile(self, mode="w"), self.flush_size or STREAM_BUFFER_SIZE
+            )
+        return self._stream
+
+    def drain(self, final: bool = False) -> List[bytes]:
+        """Get and forget buffers written by the Arrow output stream.
+
+        The stream is flushed if the output is `final` or not coalesced (flush
+        size is 0). Buffers are handed out as they were written (without copy).
+        """
+        if self._stream is not None and (final or not self.flush_size):
+            self._stream.flush()
+        buffers = self._buffers
+        self._buffers = []
+        self._size = 0
+        return buffers
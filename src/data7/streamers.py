@@ -1,72 +1,599 @@
 """Data7 streamers module."""
 
+import contextlib
+import json
 import logging
-from io import BytesIO
-from typing import Generator
+from dataclasses import replace
+from pathlib import Path
+from typing import Generator, Iterator, List, Optional, Union
 
 import pandas as pd
 import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pcsv
 from pyarrow import parquet as pq
-from sqlalchemy import Engine
+from sqlalchemy import Connection, Engine
 
-from .config import settings
+from .cache import get_cache_key, get_cache_ttl, get_result_cache
+from .cancellation import track
+from .config import get_config
+from .databases import pool_checkout
+from .derive import derive_table
+from .limits import limit_rows, limited, statement_timeout
+from .materialize import (
+    get_materialization_path,
+    get_materialize_ttl,
+    is_fresh,
+    is_materialized,
+    lock,
+    remove_expired,
+    restrict_batches,
+    restrict_schema,
+    scan_materialization,
+    write_materialization,
+)
 from .models import Dataset
+from .native import get_native_exporter
+from .preview import get_sample
+from .sink import OutputSink, get_flush_size
+from .timing import measure, timed
+from .utils import get_statement
 
 logger = logging.getLogger(__name__)
 
+# Streamers run queries on a new connection of an engine, or on a given
+# connection (_e.g._ a bundle snapshot transaction)
+Connectable = Union[Engine, Connection]
 
-def sql2parquet(engine: Engine, dataset: Dataset, chunksize: int = 5000) -> Generator:
-    """Stream SQL rows to parquet."""
-    logger.debug("SQL query: %s", dataset.query)
-    output = BytesIO()
-
-    def get_batch(output: BytesIO) -> bytes:
-        """Get wrote batch content."""
-        size = output.tell()
-        output.seek(0)
-        return output.read(size)
-
-    with engine.connect() as conn:
-        # Get schema from a subset of data
-        schema = pa.Schema.from_pandas(
-            next(
+
+@contextlib.contextmanager
+def connect(engine: Connectable, dataset: Dataset) -> Generator[Connection, None, None]:
+    """Get a database connection (the connection time is measured).
+
+    The connection is tracked by the current request cancellation (if any) while
+    in use so that running statements can be cancelled, and the dataset statement
+    timeout is enforced. If the connection is released while a statement is
+    running (_e.g._ cancelled or aborted), it is invalidated instead of being
+    returned to the pool.
+
+    A given connection is used as is: it is left open and its owner is
+    responsible for invalidating it.
+    """
+    if isinstance(engine, Connection):
+        with track(engine), statement_timeout(engine, dataset):
+            yield engine
+        return
+
+    with measure("connect"), pool_checkout(engine):
+        conn = engine.connect()
+    with conn:
+        try:
+            with track(conn), statement_timeout(conn, dataset):
+                yield conn
+        except BaseException:
+            conn.invalidate()
+            raise
+
+
+def get_hinted_schema(schema: pa.Schema, dataset: Dataset) -> pa.Schema:
+    """Get a query result schema with dataset columns hints applied.
+
+    Pandas metadata of hinted columns are removed so that they keep their hinted
+    type when converted to pandas.
+    """
+    hints = {hint.name: hint for hint in dataset.columns}
+    fields = []
+    for field in schema:
+        type_ = field.type
+        hint = hints.get(field.name)
+        if hint is not None and hint.type is not None:
+            type_ = pa.type_for_alias(hint.type)
+        if dataset.large_strings is not None and (
+            pa.types.is_string(type_) or pa.types.is_large_string(type_)
+        ):
+            type_ = pa.large_string() if dataset.large_strings else pa.string()
+        if hint is not None and hint.dictionary and not pa.types.is_dictionary(type_):
+            type_ = pa.dictionary(pa.int32(), type_)
+        fields.append(field.with_type(type_))
+
+    metadata = schema.metadata
+    if metadata is not None and b"pandas" in metadata:
+        hinted = {f.name for f, o in zip(fields, schema, strict=True) if f != o}
+        pandas_metadata = json.loads(metadata[b"pandas"])
+        pandas_metadata["columns"] = [
+            c
+            for c in pandas_metadata["columns"]
+            if c["field_name"] not in hinted
+            or c["field_name"] in pandas_metadata["index_columns"]
+        ]
+        metadata = {**metadata, b"pandas": json.dumps(pandas_metadata).encode()}
+    return pa.schema(fields, metadata=metadata)
+
+
+def cast_column(array: pa.Array, type_: pa.DataType) -> pa.Array:
+    """Cast an array to a type (dictionary encoding values if needed)."""
+    if pa.types.is_dictionary(type_) and not pa.types.is_dictionary(array.type):
+        return array.cast(type_.value_type).dictionary_encode()
+    return array.cast(type_)
+
+
+def apply_column_hints(batch: pa.RecordBatch, dataset: Dataset) -> pa.RecordBatch:
+    """Downcast and dictionary encode batch columns given dataset hints.
+
+    Casts are safe: a value that does not fit in the target type raises an error.
+    """
+    if not dataset.has_column_hints:
+        return batch
+    schema = get_hinted_schema(batch.schema, dataset)
+    return pa.RecordBatch.from_arrays(
+        [
+            cast_column(array, field.type)
+            for array, field in zip(batch.columns, schema, strict=True)
+        ],
+        schema=schema,
+    )
+
+
+def read_sql_batches(
+    conn: Connection, dataset: Dataset, chunksize: int, dtype_backend: str
+) -> Generator[pa.RecordBatch, None, None]:
+    """Read SQL query result as record batches (fetch time is measured).
+
+    The dataset rows limit is enforced.
+    """
+    for chunk in limit_rows(
+        timed(
+            pd.read_sql_query(
+                get_statement(dataset),
+                conn,
+                params=dataset.params or None,
+                chunksize=chunksize,
+                dtype_backend=dtype_backend,
+            ),
+            "fetch",
+            first="first-chunk",
+        ),
+        dataset,
+    ):
+        with measure("convert"):
+            batch = apply_column_hints(
+                pa.RecordBatch.from_pandas(chunk, preserve_index=False), dataset
+            )
+        yield batch
+
+
+def fetch_batches(
+    engine: Connectable,
+    dataset: Dataset,
+    chunksize: int = 5000,
+    dtype_backend: Optional[str] = None,
+) -> Generator[pa.RecordBatch, None, None]:
+    """Fetch dataset query result as record batches.
+
+    If the result cache is active for this dataset, batches are served from the
+    cache (or stored in the cache once fetched from the database).
+
+    Filtered or projected requests are served from the dataset materialization
+    (if active), else query results are filtered and projected. Derived datasets
+    are computed from their sources batches.
+    """
+    if dtype_backend is None:
+        dtype_backend = get_config().default_dtype_backend
+
+    if dataset.head is not None:
+        yield from fetch_head(engine, dataset, chunksize, dtype_backend)
+        return
+
+    if dataset.is_restricted:
+        if is_materialized(dataset):
+            path = materialize(engine, dataset, chunksize, dtype_backend)
+            restricted = timed(scan_materialization(path, dataset, chunksize), "fetch")
+            yield from limit_rows(restricted, dataset)
+            return
+        # Fetched batches are closed (releasing their connection) even if the
+        # request filters or selected columns are invalid
+        with contextlib.closing(
+            fetch_batches(engine, unrestricted(dataset), chunksize, dtype_backend)
+        ) as fetched:
+            yield from limit_rows(restrict_batches(fetched, dataset), dataset)
+        return
+
+    if dataset.is_derived:
+        yield from fetch_derived(engine, dataset, chunksize, dtype_backend)
+        return
+
+    cache = get_result_cache()
+    ttl = get_cache_ttl(dataset)
+
+    if cache is None or not ttl:
+        with connect(engine, dataset) as conn:
+            yield from read_sql_batches(conn, dataset, chunksize, dtype_backend)
+        return
+
+    key = get_cache_key(dataset, dtype_backend)
+    if (table := cache.get(key)) is not None:
+        # An empty result is a single empty batch (as an empty query result)
+        cached = table.to_batches(max_chunksize=chunksize) or [
+            pa.RecordBatch.from_pylist([], schema=table.schema)
+        ]
+        yield from limit_rows(timed(cached, "fetch"), dataset)
+        return
+
+    # Keep fetched batches until they exceed the cache size
+    batches: Optional[List[pa.RecordBatch]] = []
+    size = 0
+    with connect(engine, dataset) as conn:
+        for batch in read_sql_batches(conn, dataset, chunksize, dtype_backend):
+            if batches is not None:
+                size += batch.nbytes
+                if size <= cache.max_bytes:
+                    batches.append(batch)
+                else:
+                    batches = None
+            yield batch
+
+    if batches:
+        cache.set(
+            key,
+            pa.concat_tables(
+                [pa.Table.from_batches([b]) for b in batches],
+                promote_options="permissive",
+            ),
+            ttl,
+        )
+
+
+def fetch_table(
+    engine: Connectable, dataset: Dataset, chunksize: int, dtype_backend: str
+) -> pa.Table:
+    """Fetch a dataset query result as a table."""
+    batches = list(fetch_batches(engine, dataset, chunksize, dtype_backend))
+    return pa.concat_tables(
+        [pa.Table.from_batches([b]) for b in batches], promote_options="permissive"
+    )
+
+
+def fetch_derived(
+    engine: Connectable, dataset: Dataset, chunksize: int, dtype_backend: str
+) -> Generator[pa.RecordBatch, None, None]:
+    """Fetch a derived dataset result as record batches.
+
+    Sources results are fetched (or served from the result cache) as tables. The
+    dataset rows limit is enforced and columns hints are applied.
+    """
+    tables = {
+        basename: fetch_table(engine, source, chunksize, dtype_backend)
+        for basename, source in dataset.sources.items()
+    }
+    with measure("derive"):
+        table = derive_table(dataset, tables)
+    # An empty result is a single empty batch (as an empty query result)
+    batches = table.to_batches(max_chunksize=chunksize) or [
+        pa.RecordBatch.from_pylist([], schema=table.schema)
+    ]
+    for batch in limit_rows(batches, dataset):
+        yield apply_column_hints(batch, dataset)
+
+
+def take_rows(
+    batches: Iterator[pa.RecordBatch], rows: int
+) -> Generator[pa.RecordBatch, None, None]:
+    """Get the first rows of record batches (stops iterating once taken)."""
+    for batch in batches:
+        if batch.num_rows >= rows:
+            yield batch.slice(0, rows)
+            return
+        rows -= batch.num_rows
+        yield batch
+
+
+def fetch_head(
+    engine: Connectable, dataset: Dataset, chunksize: int, dtype_backend: str
+) -> Generator[pa.RecordBatch, None, None]:
+    """Fetch dataset query result first rows (`head` requests).
+
+    Rows are served from the dataset head sample if it has enough rows, else
+    fetched from the database (the query stops once enough rows are fetched).
+    """
+    table = get_sample(dataset, dtype_backend)
+    head = dataset.head or 0
+    dataset = replace(dataset, head=None)
+
+    if table is None:
+        with contextlib.closing(
+            fetch_batches(engine, dataset, min(chunksize, head), dtype_backend)
+        ) as batches:
+            yield from take_rows(batches, head)
+        return
+
+    hinted = (
+        apply_column_hints(batch, dataset)
+        for batch in timed(table.to_batches(max_chunksize=chunksize), "fetch")
+    )
+    yield from take_rows(limit_rows(restrict_batches(hinted, dataset), dataset), head)
+
+
+def unrestricted(dataset: Dataset) -> Dataset:
+    """Get a dataset copy with all columns and rows (rows are not limited)."""
+    return replace(dataset, select=[], filters=[], max_rows=0)
+
+
+def materialize(
+    engine: Connectable, dataset: Dataset, chunksize: int, dtype_backend: str
+) -> Path:
+    """Get the dataset materialization path (refreshed if expired).
+
+    Once refreshed, the dataset expired materializations are removed.
+    """
+    path = get_materialization_path(dataset, dtype_backend)
+    with lock(path):
+        if is_fresh(path, get_materialize_ttl(dataset)):
+            return path
+        logger.info("Materializing %s dataset", dataset.basename)
+        dataset = unrestricted(dataset)
+        schema = sniff_schema(
+            engine, dataset, dtype_backend, get_config().schema_sniffer_size
+        )
+        write_materialization(
+            path, schema, fetch_batches(engine, dataset, chunksize, dtype_backend)
+        )
+    # Other materializations locks are acquired once this one is released
+    remove_expired(dataset)
+    return path
+
+
+def is_cached(dataset: Dataset) -> bool:
+    """Check if the result cache is active for this dataset."""
+    return get_result_cache() is not None and bool(get_cache_ttl(dataset))
+
+
+def sniff_schema(
+    engine: Connectable, dataset: Dataset, dtype_backend: str, schema_sniffer_size: int
+) -> pa.Schema:
+    """Get dataset Arrow schema from a subset of data.
+
+    Dataset indexes are stored in the schema pandas metadata and columns hints
+    are applied.
+    """
+    cache = get_result_cache()
+    table = None
+    if dataset.is_derived:
+        table = fetch_table(engine, dataset, schema_sniffer_size, dtype_backend)
+    elif is_cached(dataset) and cache is not None:
+        table = cache.peek(get_cache_key(dataset, dtype_backend))
+
+    if table is not None:
+        sample = table.slice(0, schema_sniffer_size).to_pandas(
+            types_mapper=pd.ArrowDtype
+        )
+        if dataset.indexes:
+            sample = sample.set_index(dataset.indexes)
+    else:
+        with connect(engine, dataset) as conn:
+            sample = next(
                 pd.read_sql_query(
-                    dataset.query,
+                    get_statement(dataset),
                     conn,
-                    chunksize=settings.SCHEMA_SNIFFER_SIZE,
-                    dtype_backend=settings.DEFAULT_DTYPE_BACKEND,
+                    params=dataset.params or None,
+                    chunksize=schema_sniffer_size,
+                    dtype_backend=dtype_backend,
                     index_col=dataset.indexes,
                 )
             )
-        )
-        writer = pq.ParquetWriter(output, schema=schema, compression="GZIP")
-
-        for chunk in pd.read_sql_query(
-            dataset.query,
-            conn,
-            chunksize=chunksize,
-            dtype_backend=settings.DEFAULT_DTYPE_BACKEND,
-            index_col=dataset.indexes,
-        ):
-            writer.write_batch(
-                pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=True)
-            )
-            yield get_batch(output)
-            output.seek(0)
+    return get_hinted_schema(pa.Schema.from_pandas(sample), dataset)
 
-    writer.close()
+
+def get_schema(
+    engine: Connectable,
+    dataset: Dataset,
+    chunksize: int,
+    dtype_backend: str,
+    schema_sniffer_size: int,
+) -> pa.Schema:
+    """Get dataset Arrow schema restricted to selected columns.
+
+    The schema is read from the dataset head sample (for `head` requests served
+    from it) or materialization (if active), else sniffed from a subset of data.
+    """
+    if (table := get_sample(dataset, dtype_backend)) is not None:
+        return restrict_schema(get_hinted_schema(table.schema, dataset), dataset)
+    if is_materialized(dataset):
+        path = materialize(engine, dataset, chunksize, dtype_backend)
+        return restrict_schema(pq.read_schema(path), dataset)
+    return restrict_schema(
+        sniff_schema(engine, dataset, dtype_backend, schema_sniffer_size), dataset
+    )
+
+
+@limited
+def sql2parquet(
+    engine: Connectable,
+    dataset: Dataset,
+    chunksize: int = 5000,
+    dtype_backend: Optional[str] = None,
+    schema_sniffer_size: Optional[int] = None,
+) -> Generator:
+    """Stream SQL rows to parquet.
+
+    The `dtype_backend` and `schema_sniffer_size` arguments default to the
+    `DEFAULT_DTYPE_BACKEND` and `SCHEMA_SNIFFER_SIZE` settings. If a dataset limit
+    is hit, the stream ends without the Parquet footer.
+    """
+    logger.debug("SQL query: %s", dataset.query)
+    config = get_config()
+    if dtype_backend is None:
+        dtype_backend = config.default_dtype_backend
+    if schema_sniffer_size is None:
+        schema_sniffer_size = config.schema_sniffer_size
+    output = OutputSink(get_flush_size())
+
+    schema = get_schema(engine, dataset, chunksize, dtype_backend, schema_sniffer_size)
+    writer = pq.ParquetWriter(output.open_stream(), schema=schema, compression="GZIP")
+
+    for batch in fetch_batches(engine, dataset, chunksize, dtype_backend):
+        # Index columns come last in the schema
+        with measure("encode"):
+            writer.write_batch(batch.select(schema.names).cast(schema))
+        yield from output.drain()
+
+    with measure("encode"):
+        writer.close()
     # When closing file, the parquet writer adds required footer and magic bytes. We
     # need those so that the Parqet file is readable.
-    yield get_batch(output)
+    yield from output.drain(final=True)
     output.close()
 
 
-def sql2csv(
-    engine: Engine, dataset: Dataset, chunksize: int = 5000
-) -> Generator[str, None, None]:
-    """Stream SQL rows to CSV."""
-    with engine.connect() as conn:
+def to_sql_frame(batch: pa.RecordBatch) -> pd.DataFrame:
+    """Convert a record batch to a data frame typed as SQL query results.
+
+    Batches pandas metadata (_e.g._ the dtype backend they were fetched with) are
+    ignored, so that columns get NumPy types as `pd.read_sql_query` infers them
+    (_e.g._ an integer column with nulls is a float column). The pandas CSV output
+    of fetched batches (cached, restricted, derived or head requests) is then the
+    same as the query result output.
+    """
+    return batch.to_pandas(ignore_metadata=True)
+
+
+@limited
+def sql2csv(engine: Connectable, dataset: Dataset, chunksize: int = 5000) -> Generator:
+    """Stream SQL rows to CSV.
+
+    The CSV encoder is selected using the `CSV_ENCODER` setting. With the pandas
+    encoder, datasets are exported natively by the database when its driver
+    supports it (see `data7.native`).
+    """
+    if get_config().csv_encoder == "arrow":
+        yield from sql2csv_arrow(engine, dataset, chunksize=chunksize)
+        return
+
+    if (
+        is_cached(dataset)
+        or dataset.is_derived
+        or dataset.is_restricted
+        or dataset.head is not None
+    ):
+        for c, batch in enumerate(fetch_batches(engine, dataset, chunksize)):
+            with measure("encode"):
+                chunk = to_sql_frame(batch).to_csv(header=c == 0, index=False)
+            yield chunk
+        return
+
+    with connect(engine, dataset) as conn:
+        if (exporter := get_native_exporter(conn, dataset)) is not None:
+            logger.debug("Native CSV export: %s", dataset.basename)
+            yield from exporter(conn, dataset)
+            return
+
         for c, chunk in enumerate(
-            pd.read_sql_query(dataset.query, conn, chunksize=chunksize)
+            limit_rows(
+                timed(
+                    pd.read_sql_query(
+                        get_statement(dataset),
+                        conn,
+                        params=dataset.params or None,
+                        chunksize=chunksize,
+                    ),
+                    "fetch",
+                    first="first-chunk",
+                ),
+                dataset,
+            )
+        ):
+            with measure("encode"):
+                output = chunk.to_csv(header=True if c == 0 else False, index=False)
+            yield output
+
+
+def get_csv_schema(schema: pa.Schema) -> pa.Schema:
+    """Get the CSV output schema given the SQL query result schema.
+
+    Formatted fields (timestamps or nulls, given settings) are written as strings.
+    """
+    config = get_config()
+    timestamp_format = config.csv_timestamp_format
+    null_value = config.csv_null_value
+
+    fields = []
+    for field in schema:
+        if (
+            null_value is not None
+            or pa.types.is_null(field.type)
+            or (timestamp_format is not None and pa.types.is_temporal(field.type))
         ):
-            yield chunk.to_csv(header=True if c == 0 else False, index=False)
+            field = field.with_type(pa.string())  # noqa: PLW2901
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def format_csv_batch(
+    batch: pa.RecordBatch, schema: pa.Schema, csv_schema: pa.Schema
+) -> pa.RecordBatch:
+    """Format a record batch given CSV settings."""
+    config = get_config()
+    float_precision = config.csv_float_precision
+    timestamp_format = config.csv_timestamp_format
+    null_value = config.csv_null_value
+
+    arrays = []
+    for array in batch.cast(schema).columns:
+        if float_precision is not None and pa.types.is_floating(array.type):
+            array = pc.round(  # type: ignore[attr-defined]  # noqa: PLW2901
+                array, ndigits=float_precision
+            )
+        elif timestamp_format is not None and pa.types.is_temporal(array.type):
+            array = pc.strftime(  # type: ignore[attr-defined]  # noqa: PLW2901
+                array, format=timestamp_format
+            )
+        if null_value is not None:
+            array = pc.fill_null(array.cast(pa.string()), null_value)  # noqa: PLW2901
+        arrays.append(array)
+    return pa.RecordBatch.from_arrays(arrays, schema=csv_schema)
+
+
+def sql2csv_arrow(
+    engine: Connectable, dataset: Dataset, chunksize: int = 5000
+) -> Generator[bytes, None, None]:
+    """Stream SQL rows to CSV using the Arrow CSV writer.
+
+    Contrary to the pandas encoder, data types are inferred using the
+    `DEFAULT_DTYPE_BACKEND` (as for Parquet) and formatting can be configured
+    using the `CSV_*` settings.
+    """
+    output = OutputSink(get_flush_size())
+    config = get_config()
+    quoting_style = config.csv_quoting_style
+    writer = None
+    writer_schema = None
+
+    for batch in fetch_batches(engine, dataset, chunksize):
+        # Batches are formatted given their own schema as chunks types may differ
+        # (e.g. integers in a chunk, floats in the next one). Null typed fields
+        # (no value in the batch) are strings.
+        schema = pa.schema(
+            f.with_type(pa.string()) if pa.types.is_null(f.type) else f
+            for f in batch.schema
+        )
+        csv_schema = get_csv_schema(schema)
+        if writer is None or not csv_schema.equals(writer_schema):
+            if writer is not None:
+                writer.close()
+            writer_schema = csv_schema
+            write_options = pcsv.WriteOptions(
+                include_header=writer is None,
+                delimiter=config.csv_delimiter,
+                quoting_style=quoting_style,
+                quoting_header=quoting_style,
+            )
+            writer = pcsv.CSVWriter(
+                output.open_stream(), csv_schema, write_options=write_options
+            )
+        with measure("encode"):
+            writer.write_batch(format_csv_batch(batch, schema, csv_schema))
+        yield from output.drain()
+
+    if writer is not None:
+        writer.close()
+    yield from output.drain(final=True)
+    output.close()
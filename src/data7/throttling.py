@@ -0,0 +1,149 @@
+"""Data7 throttling module.
+
+Datasets downloads throughput can be shaped per client (identified by a known
+API key header or by IP address) using token buckets: a client may download `burst`
+bytes at full speed, then at most `rate` bytes per second, shared by all its
+concurrent downloads.
+
+Downloads that exceeded the burst (bulk transfers) also render their next chunks
+using a limited number of threads, so that interactive-sized requests always
+find a free thread and keep a low latency while bulk transfers are running.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import anyio
+from starlette.requests import HTTPConnection
+
+from .config import settings
+
+
+class TokenBucket:
+    """A token bucket with tokens being bytes."""
+
+    def __init__(self, rate: float, burst: float):
+        """Create a full bucket refilled with `rate` tokens per second."""
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, size: int) -> float:
+        """Consume `size` tokens, returns the delay before they are available.
+
+        Tokens can be borrowed, hence concurrent consumers wait in turn.
+        """
+        self._refill()
+        self._tokens -= size
+        return max(0.0, -self._tokens / self.rate)
+
+
+class Throttler:
+    """Per-client token buckets and bulk transfers threads limiter.
+
+    At most `max_clients` buckets are kept: least recently used buckets are
+    evicted to make room for new clients.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        rate: float,
+        burst: float,
+        *,
+        bulk_threads: int = 0,
+        client_header: Optional[str] = None,
+        client_keys: Iterable[str] = (),
+        max_clients: int = 10000,
+    ):
+        """Create a throttler without clients."""
+        self.rate = rate
+        self.burst = burst
+        self.client_header = client_header
+        self.client_keys = frozenset(client_keys)
+        self.max_clients = max_clients
+        self.bulk_limiter = (
+            anyio.CapacityLimiter(bulk_threads) if bulk_threads else None
+        )
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_client(self, conn: HTTPConnection) -> str:
+        """Get the client key (API key header value, else IP address).
+
+        Only known API keys (`client_keys`) identify clients, so that clients
+        cannot escape their IP address bucket by sending random keys.
+        """
+        if self.client_header is not None:
+            key = conn.headers.get(self.client_header)
+            if key is not None and key in self.client_keys:
+                return f"key:{key}"
+        return f"ip:{conn.client.host if conn.client else None}"
+
+    def get_bucket(self, client: str) -> TokenBucket:
+        """Get (or create) a client token bucket."""
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self._buckets[client] = bucket
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(client)
+            return bucket
+
+    def throttle(self, conn: HTTPConnection) -> "Throttle":
+        """Get a download throttle for the request client."""
+        return Throttle(self.get_bucket(self.get_client(conn)), self.bulk_limiter)
+
+
+class Throttle:
+    """A download throttle, drawing tokens from its client bucket."""
+
+    def __init__(
+        self, bucket: TokenBucket, bulk_limiter: Optional[anyio.CapacityLimiter]
+    ):
+        """Create a download throttle."""
+        self.bucket = bucket
+        self.bulk_limiter = bulk_limiter
+        self.sent = 0
+
+    @property
+    def bulk(self) -> bool:
+        """Check if the download exceeded its client burst size."""
+        return self.sent > self.bucket.burst
+
+    @property
+    def limiter(self) -> Optional[anyio.CapacityLimiter]:
+        """Get the threads limiter rendering the next chunk (None by default)."""
+        return self.bulk_limiter if self.bulk else None
+
+    async def consume(self, size: int):
+        """Wait until `size` bytes can be sent."""
+        self.sent += size
+        if delay := self.bucket.reserve(size):
+            await asyncio.sleep(delay)
+
+
+@functools.cache
+def get_throttler() -> Optional[Throttler]:
+    """Get the throttler (if enabled using the `THROTTLE_RATE` setting)."""
+    rate = settings.get("THROTTLE_RATE", 0)
+    if not rate:
+        return None
+    return Throttler(
+        rate,
+        settings.get("THROTTLE_BURST", rate),
+        bulk_threads=settings.get("THROTTLE_BULK_THREADS", 0),
+        client_header=settings.get("THROTTLE_CLIENT_HEADER"),
+        client_keys=settings.get("THROTTLE_CLIENT_KEYS", []),
+    )
@@ -0,0 +1,95 @@
+"""Data7 timing module.
+
+Request stages (connect, first chunk, fetch, convert, encode, send) are timed
+using a per-request `Timings` recorder bound to a context variable. Stages peak
+memory usage is also tracked if a `MemoryUsage` recorder is active (see
+`data7.memory`).
+"""
+
+import contextlib
+import time
+from contextvars import ContextVar
+from typing import Dict, Generator, Iterable, Iterator, Optional, TypeVar
+
+from .memory import current_memory, track
+
+T = TypeVar("T")
+
+current_timings: ContextVar[Optional["Timings"]] = ContextVar(
+    "current_timings", default=None
+)
+
+
+class Timings:
+    """Request stages timings recorder."""
+
+    def __init__(self):
+        """Start recording."""
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @property
+    def total(self) -> float:
+        """Get elapsed time since recording started."""
+        return time.perf_counter() - self.start
+
+    def add(self, stage: str, duration: float):
+        """Add a duration to a stage."""
+        self.stages[stage] = self.stages.get(stage, 0.0) + duration
+
+    def to_header(self, total: bool = False) -> str:
+        """Get the Server-Timing header value (durations are in milliseconds)."""
+        stages = dict(self.stages)
+        if total:
+            stages["total"] = self.total
+        return ", ".join(
+            f"{stage};dur={duration * 1000:.1f}" for stage, duration in stages.items()
+        )
+
+
+@contextlib.contextmanager
+def measure(stage: str) -> Generator[None, None, None]:
+    """Measure a stage duration (and memory) for the current request (if any)."""
+    timings = current_timings.get()
+    if timings is None and current_memory.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        with track(stage):
+            yield
+    finally:
+        if timings is not None:
+            timings.add(stage, time.perf_counter() - start)
+
+
+def timed(
+    iterable: Iterable[T], stage: str, first: Optional[str] = None
+) -> Iterator[T]:
+    """Measure time (and memory) spent getting items from an iterable.
+
+    The time spent getting the first item is also recorded as the `first` stage,
+    if set.
+    """
+    timings = current_timings.get()
+    if timings is None and current_memory.get() is None:
+        yield from iterable
+        return
+
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            with track(stage):
+                item = next(iterator)
+        except StopIteration:
+            if timings is not None:
+                timings.add(stage, time.perf_counter() - start)
+            return
+        duration = time.perf_counter() - start
+        if timings is not None:
+            timings.add(stage, duration)
+            if first is not None:
+                timings.add(first, duration)
+                first = None
+        yield item
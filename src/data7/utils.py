@@ -1,37 +1,150 @@
 """Data7 utils module."""
 
+import functools
 import logging
-from typing import List
+from dataclasses import replace
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
 
-from sqlalchemy import Engine
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import (
+    Boolean,
+    Date,
+    DateTime,
+    Engine,
+    Float,
+    Integer,
+    String,
+    TextClause,
+    bindparam,
+)
+from sqlalchemy.exc import ArgumentError, StatementError
 from sqlalchemy.sql import text
+from sqlalchemy.types import TypeEngine
 
-from .config import settings
+from .config import get_config, settings
 from .models import Dataset
 
+if TYPE_CHECKING:
+    from .databases import DatabaseRouter
+
 logger = logging.getLogger(__name__)
 
+# Dataset parameters SQL types
+PARAMETER_SQL_TYPES: Dict[str, TypeEngine] = {
+    "str": String(),
+    "int": Integer(),
+    "float": Float(),
+    "bool": Boolean(),
+    "date": Date(),
+    "datetime": DateTime(),
+}
+
+
+@functools.lru_cache(maxsize=256)
+def compile_statement(
+    query: str, parameters: Tuple[Tuple[str, str], ...]
+) -> TextClause:
+    """Get a text statement with typed bound parameters for a query."""
+    return text(query).bindparams(
+        *(
+            bindparam(name, type_=PARAMETER_SQL_TYPES[type_])
+            for name, type_ in parameters
+        )
+    )
+
+
+def get_statement(dataset: Dataset) -> Union[str, TextClause]:
+    """Get the dataset query statement.
+
+    Parameterized queries are text statements with typed bound parameters, so
+    that values are always sent separately from the query. Statements are cached
+    to be reused across requests (and hit the SQLAlchemy compiled cache). Other
+    queries are left as is, _i.e._ sent to the driver without being parsed.
+    """
+    if not dataset.parameters:
+        return dataset.query
+    return compile_statement(
+        dataset.query, tuple((p.name, p.type) for p in dataset.parameters)
+    )
+
+
+def resolve_sources(dataset: Dataset, datasets: List[Dataset]) -> Optional[Dataset]:
+    """Get a copy of a derived dataset with its source datasets set.
 
-def populate_datasets(engine: Engine) -> List[Dataset]:
-    """Validate configured datasets and get sql query expected field names."""
+    Sources should be active datasets without required parameters, querying the
+    same database. The derived dataset is ignored if a source is not active.
+    """
+    active = {d.basename: d for d in datasets}
+    sources = {}
+    for basename in dataset.derive.sources if dataset.derive is not None else []:
+        if basename not in active:
+            logger.warning(
+                "'%s' source '%s' is not active, dataset will be ignored",
+                dataset.basename,
+                basename,
+            )
+            return None
+        source = active[basename]
+        if source.required_parameters:
+            raise ValueError(
+                f"Dataset '{dataset.basename}' source '{basename}' has required "
+                "parameters"
+            )
+        sources[basename] = source
+
+    databases = {source.database for source in sources.values()}
+    if len(databases) > 1:
+        raise ValueError(
+            f"Dataset '{dataset.basename}' sources query different databases"
+        )
+    return replace(dataset, database=databases.pop(), sources=sources)
+
+
+def populate_datasets(
+    engine: Engine, router: Optional["DatabaseRouter"] = None
+) -> List[Dataset]:
+    """Validate configured datasets and get sql query expected field names.
+
+    If a database router is given, datasets queries are validated against the
+    primary of their database, else against the given engine. Parameterized
+    queries are validated using parameters defaults (or `NULL` for required
+    parameters).
+
+    Derived datasets are resolved against previously defined active datasets
+    (see `resolve_sources`).
+
+    Datasets head samples are captured if previews are active (see the
+    `PREVIEW_ROWS` setting).
+    """
     logging.debug("Will populate datasets given configuration...")
-    datasets = []
+    datasets: List[Dataset] = []
 
-    with engine.connect() as conn:
-        for raw_dataset in settings.datasets:
-            dataset = Dataset(**raw_dataset)
+    for raw_dataset in settings.datasets:
+        dataset = Dataset(**raw_dataset)
+        if dataset.is_derived:
+            if (resolved := resolve_sources(dataset, datasets)) is not None:
+                datasets.append(resolved)
+            continue
+        try:
+            get_statement(dataset)
+        except ArgumentError as exc:
+            raise ValueError(
+                f"Dataset '{dataset.basename}' parameters are not used in its query"
+            ) from exc
+        if router is not None:
+            engine = router.get_engine(dataset.database)
 
+        with engine.connect() as conn:
             # Validate database query and get expected field names
+            params = {p.name: p.default for p in dataset.parameters}
             try:
-                result = conn.execute(text(dataset.query))
-            except OperationalError as exc:
+                result = conn.execute(text(dataset.query), params)
+            except StatementError as exc:
                 raise ValueError(
                     f"Dataset '{dataset.basename}' query failed, maybe SQL is invalid"
                 ) from exc
 
             # Query returns no result, we cannot set fields.
-            if result.scalar() is None:
+            if result.scalar() is None and None not in params.values():
                 logger.warning(
                     "'%s' query returned no result, dataset will be ignored",
                     dataset.basename,
@@ -41,4 +154,9 @@ def populate_datasets(engine: Engine) -> List[Dataset]:
             datasets.append(dataset)
 
     logger.info("Active datasets: %s", ", ".join(d.basename for d in datasets))
+
+    if get_config().preview_rows:
+        from .preview import capture_samples  # noqa: PLC0415
+
+        capture_samples(datasets, engine, router)
     return datasets
@@ -4,13 +4,28 @@ import pytest
 from sqlalchemy import create_engine
 from typer.testing import CliRunner
 
-from data7.config import settings
+from data7.config import load_config, settings
 
 
 @pytest.fixture(scope="session", autouse=True)
 def set_test_settings():
     """Force testing environment for settings."""
     settings.configure(FORCE_ENV_FOR_DYNACONF="testing")
+    load_config()
+
+
+@pytest.fixture
+def configure():
+    """Override settings and reload the config snapshot (restored afterwards)."""
+    with pytest.MonkeyPatch.context() as patch:
+
+        def override(**values):
+            for name, value in values.items():
+                patch.setattr(settings, name, value, raising=False)
+            load_config()
+
+        yield override
+    load_config()
 
 
 @pytest.fixture
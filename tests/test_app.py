@@ -1,18 +1,60 @@
 """Tests for the data7.app module."""
 
+import io
+import time
+import tracemalloc
+import zipfile
 from pathlib import PurePath
 
+import anyio
+import httpx
 import pytest
-from starlette.status import HTTP_200_OK, HTTP_404_NOT_FOUND, HTTP_501_NOT_IMPLEMENTED
+from starlette.status import (
+    HTTP_200_OK,
+    HTTP_400_BAD_REQUEST,
+    HTTP_404_NOT_FOUND,
+    HTTP_413_CONTENT_TOO_LARGE,
+    HTTP_501_NOT_IMPLEMENTED,
+    HTTP_504_GATEWAY_TIMEOUT,
+)
 from starlette.testclient import TestClient
 
 from data7.app import (
+    HTTP_499_CLIENT_CLOSED_REQUEST,
+    MemoryMiddleware,
+    TimingMiddleware,
     app,
+    get_catalog,
     get_dataset_from_url,
+    get_pools,
+    get_result_cache_stats,
     get_routes_from_datasets,
+    router,
+    stream_bundle_archive,
     stream_dataset,
 )
-from data7.models import Dataset, Extension
+from data7.cache import get_result_cache
+from data7.catalog import catalog
+from data7.config import settings
+from data7.formats import formats
+from data7.limits import LimitExceeded
+from data7.models import Dataset
+from data7.preview import capture_samples, clear_samples
+from data7.throttling import get_throttler
+from data7.timing import measure
+
+SLOW_ROWS_QUERY = (
+    "WITH RECURSIVE n(i) AS "
+    "(SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000000000) "
+    "SELECT i FROM n"
+)
+SLOW_COUNT_QUERY = (
+    "WITH RECURSIVE n(i) AS "
+    "(SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000000000) "
+    "SELECT count(*) AS total FROM n"
+)
+# Maximal duration (in seconds) of a cancelled request
+CANCELLED_REQUEST_MAX_DURATION = 5
 
 
 def test_get_dataset_from_url():
@@ -40,15 +82,14 @@ def test_get_dataset_from_url():
         ),
     ]
 
-    dataset, extension = get_dataset_from_url(PurePath("/d/customers.csv"), datasets)
+    dataset, fmt = get_dataset_from_url(PurePath("/d/customers.csv"), datasets)
     assert dataset.basename == "customers"
-    assert extension == Extension.CSV
+    assert fmt.extension == "csv"
+    assert fmt.media_type == "text/csv"
 
-    dataset, extension = get_dataset_from_url(
-        PurePath("/d/customers.parquet"), datasets
-    )
+    dataset, fmt = get_dataset_from_url(PurePath("/d/customers.parquet"), datasets)
     assert dataset.basename == "customers"
-    assert extension == Extension.PARQUET
+    assert fmt.extension == "parquet"
 
     # Unsupported extension
     with pytest.raises(ValueError, match="Data7 extension 'xls' is not supported"):
@@ -148,6 +189,383 @@ def test_stream_dataset_route():
     assert response.text == "Data7 extension 'xls' is not supported"
 
 
+def test_stream_dataset_route_with_parameters():
+    """Test data7 application stream_dataset view for a parameterized dataset."""
+    app.state.datasets = [
+        Dataset(
+            basename="customers",
+            query=(
+                "SELECT CustomerId as id, Country as country "
+                "FROM Customer "
+                "WHERE Country = :country AND CustomerId >= :min_id"
+            ),
+            parameters=[
+                {"name": "country", "type": "str"},
+                {"name": "min_id", "type": "int", "default": 0},
+            ],
+        ),
+    ]
+    for route in get_routes_from_datasets(app.state.datasets):
+        app.add_route(route.path, route.endpoint)
+
+    client = TestClient(app)
+
+    response = client.get("/d/customers.csv?country=France")
+    assert response.status_code == HTTP_200_OK
+    lines = response.text.splitlines()
+    assert lines[0] == "id,country"
+    assert len(lines) > 1
+    assert all(line.endswith(",France") for line in lines[1:])
+
+    response = client.get("/d/customers.csv?country=France&min_id=30")
+    assert response.status_code == HTTP_200_OK
+    assert 1 < len(response.text.splitlines()) < len(lines)
+
+    response = client.get("/d/customers.parquet?country=France")
+    assert response.status_code == HTTP_200_OK
+
+    # Values are bound, never formatted in the query
+    response = client.get("/d/customers.csv?country=France' OR '1'='1")
+    assert response.status_code == HTTP_200_OK
+    assert response.text.splitlines() == ["id,country"]
+
+    # Missing required parameter
+    response = client.get("/d/customers.csv")
+    assert response.status_code == HTTP_400_BAD_REQUEST
+    assert response.text == "Parameter 'country' is required"
+
+    # Invalid parameter value
+    response = client.get("/d/customers.csv?country=France&min_id=foo")
+    assert response.status_code == HTTP_400_BAD_REQUEST
+    assert response.text == "Parameter 'min_id' value 'foo' is not a valid int"
+
+
+def test_stream_dataset_route_with_filters():
+    """Test data7 application stream_dataset view with selected columns/filters."""
+    app.state.datasets = [
+        Dataset(
+            basename="customers",
+            query="SELECT CustomerId as id, Country as country FROM Customer",
+        ),
+    ]
+    for route in get_routes_from_datasets(app.state.datasets):
+        app.add_route(route.path, route.endpoint)
+
+    client = TestClient(app)
+
+    response = client.get("/d/customers.csv?select=id&country=eq.France")
+    assert response.status_code == HTTP_200_OK
+    lines = response.text.splitlines()
+    assert lines[0] == "id"
+    assert 1 < len(lines) < len(client.get("/d/customers.csv").text.splitlines())
+
+    response = client.get("/d/customers.parquet?select=id&country=eq.France")
+    assert response.status_code == HTTP_200_OK
+
+    response = client.get("/d/customers.csv?select=foo")
+    assert response.status_code == HTTP_400_BAD_REQUEST
+    assert response.text == "Selected column 'foo' does not exist"
+
+    response = client.get("/d/customers.csv?id=gt.foo")
+    assert response.status_code == HTTP_400_BAD_REQUEST
+    assert response.text.startswith("Filter 'id' value 'foo' is not a valid")
+
+
+def test_stream_dataset_route_with_head(configure):
+    """Test data7 application stream_dataset view for previews (head requests)."""
+    configure(PREVIEW_ROWS=10)
+    app.state.datasets = [
+        Dataset(
+            basename="customers",
+            query="SELECT CustomerId as id, Country as country FROM Customer",
+        ),
+    ]
+    capture_samples(app.state.datasets, router.get_engine())
+    for route in get_routes_from_datasets(app.state.datasets):
+        app.add_route(route.path, route.endpoint)
+
+    client = TestClient(app)
+
+    try:
+        for head in (3, 20):
+            response = client.get(f"/d/customers.csv?head={head}")
+            assert response.status_code == HTTP_200_OK
+            lines = response.text.splitlines()
+            assert lines[0] == "id,country"
+            assert len(lines) == head + 1
+
+        response = client.get("/d/customers.parquet?head=3")
+        assert response.status_code == HTTP_200_OK
+
+        response = client.get("/d/customers.csv?head=0")
+        assert response.status_code == HTTP_400_BAD_REQUEST
+        assert response.text == "Argument 'head' value '0' is not a positive int"
+    finally:
+        clear_samples()
+
+
+def test_stream_dataset_route_with_render_cache(tmp_path, configure):
+    """Test data7 application stream_dataset view with the render cache."""
+    configure(RENDER_CACHE_TTL=60, RENDER_CACHE_DIR=str(tmp_path))
+    app.state.datasets = [
+        Dataset(
+            basename="customers",
+            query="SELECT CustomerId as id, Country as country FROM Customer",
+        ),
+    ]
+    for route in get_routes_from_datasets(app.state.datasets):
+        app.add_route(route.path, route.endpoint)
+
+    client = TestClient(app)
+
+    response = client.get("/d/customers.csv?country=eq.France")
+    assert response.status_code == HTTP_200_OK
+    (rendered,) = tmp_path.glob("customers-*.csv")
+    assert rendered.read_bytes() == response.content
+
+    # Served from the rendered file
+    rendered.write_bytes(b"id,country\n")
+    response = client.get("/d/customers.csv?country=eq.France")
+    assert response.text == "id,country\n"
+
+    response = client.get("/d/customers.parquet")
+    assert response.status_code == HTTP_200_OK
+    assert len(list(tmp_path.glob("customers-*.parquet"))) == 1
+
+    # Errors are not cached
+    response = client.get("/d/customers.csv?id=gt.foo")
+    assert response.status_code == HTTP_400_BAD_REQUEST
+    assert len(list(tmp_path.iterdir())) == 2  # noqa: PLR2004
+
+
+def test_catalog_route():
+    """Test data7 application catalog view."""
+    app.state.datasets = [
+        Dataset(
+            basename="customers",
+            query="SELECT CustomerId as id, Country as country FROM Customer",
+        ),
+    ]
+    for route in get_routes_from_datasets(app.state.datasets):
+        app.add_route(route.path, route.endpoint)
+    app.add_route("/catalog", get_catalog)
+
+    client = TestClient(app)
+    # Sizes recorded by other tests
+    catalog.clear()
+
+    try:
+        response = client.get("/catalog")
+        assert response.status_code == HTTP_200_OK
+        (entry,) = response.json()["datasets"]
+        assert entry["basename"] == "customers"
+        assert entry["rows"] is None
+        assert {f["size"] for f in entry["formats"]} == {None}
+
+        # Metadata are computed in the background and sizes recorded once rendered
+        catalog.refresh_all(app.state.datasets, router.get_engine())
+        size = len(client.get("/d/customers.csv").content)
+        client.get("/d/customers.parquet?head=1")
+
+        (entry,) = client.get("/catalog").json()["datasets"]
+        assert entry["rows"] == 59  # noqa: PLR2004
+        assert entry["columns"][0]["name"] == "id"
+        assert [f["size"] for f in entry["formats"]] == [size, None]
+    finally:
+        catalog.clear()
+
+
+def test_bundle_route():
+    """Test data7 application bundle view."""
+    app.state.datasets = [
+        Dataset(basename="customers", query="SELECT * FROM Customer"),
+        Dataset(basename="employees", query="SELECT * FROM Employee"),
+    ]
+    app.add_route("/bundle.zip", stream_bundle_archive)
+    client = TestClient(app)
+    pool = router.get_read_engine(None).pool
+    checkedout = pool.checkedout()
+
+    response = client.get("/bundle.zip?datasets=customers.csv,employees.parquet")
+    assert response.status_code == HTTP_200_OK
+    assert response.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.namelist() == ["customers.csv", "employees.parquet"]
+
+    response = client.get("/bundle.zip?datasets=foo.csv")
+    assert response.status_code == HTTP_400_BAD_REQUEST
+    assert response.text == "Dataset 'foo' is not registered"
+    assert pool.checkedout() == checkedout
+
+
+def test_lifespan_preloaded(monkeypatch):
+    """Test data7 application lifespan with preloaded datasets."""
+    datasets = [Dataset(basename="customers", query="SELECT * FROM Customer")]
+    app.state.datasets = datasets
+    app.state.preloaded = True
+    warm_ups = []
+    monkeypatch.setattr(settings, "DB_POOL_WARMUP", True)
+    monkeypatch.setattr(router, "warm_up", lambda: warm_ups.append(True))
+    try:
+        with TestClient(app):
+            assert app.state.datasets is datasets
+        assert warm_ups == [True]
+    finally:
+        app.state.preloaded = False
+
+
+def test_lifespan_pools_monitor(monkeypatch):
+    """Test data7 application lifespan with databases pools monitoring."""
+    monitors = []
+    monkeypatch.setattr(settings, "DB_POOL_MONITOR_INTERVAL", 60, raising=False)
+    monkeypatch.setattr(router, "monitor", lambda: monitors.append(True))
+    with TestClient(app):
+        # Pools are monitored in the background (first run at startup)
+        for _ in range(100):
+            if monitors:
+                break
+            time.sleep(0.01)
+    assert monitors == [True]
+
+
+def test_pools_route():
+    """Test data7 application databases connection pools view."""
+    app.add_route("/pools", get_pools)
+    client = TestClient(app)
+
+    response = client.get("/pools")
+    assert response.status_code == HTTP_200_OK
+    (default,) = response.json()["databases"]
+    assert default["name"] == "default"
+    (primary,) = default["engines"]
+    assert primary["primary"] is True
+    assert {"size", "idle", "checkouts", "wait_time", "reconnects"} <= set(primary)
+
+
+def test_result_cache_stats_route(monkeypatch, configure):
+    """Test data7 application query results cache statistics view."""
+    app.state.datasets = [
+        Dataset(basename="customers", query="SELECT * FROM Customer"),
+    ]
+    for route in get_routes_from_datasets(app.state.datasets):
+        app.add_route(route.path, route.endpoint)
+    app.add_route("/result-cache", get_result_cache_stats)
+    client = TestClient(app)
+
+    # The cache is disabled
+    get_result_cache.cache_clear()
+    monkeypatch.setattr(settings, "RESULT_CACHE_MAX_BYTES", 0, raising=False)
+    response = client.get("/result-cache")
+    assert response.status_code == HTTP_200_OK
+    assert response.json() == {"result_cache": None}
+
+    get_result_cache.cache_clear()
+    monkeypatch.setattr(settings, "RESULT_CACHE_MAX_BYTES", 10_000_000, raising=False)
+    configure(RESULT_CACHE_TTL=60)
+    try:
+        for _ in range(2):
+            assert client.get("/d/customers.parquet").status_code == HTTP_200_OK
+        stats = client.get("/result-cache").json()["result_cache"]
+    finally:
+        get_result_cache.cache_clear()
+    assert stats["hits"] >= 1
+    assert stats["misses"] >= 1
+    assert stats["entries"] == 1
+    assert 0 < stats["bytes"] <= stats["max_bytes"] == 10_000_000  # noqa: PLR2004
+
+
+@pytest.mark.anyio
+async def test_stream_dataset_route_throttled(monkeypatch, configure):
+    """Test data7 application dataset view with per-client throttling.
+
+    Durations are compared to lower bounds set by the throttling rate, so that
+    the test does not depend on the machine speed.
+    """
+    app.state.datasets = [
+        Dataset(basename="ids", query="SELECT CustomerId as id FROM Customer"),
+    ]
+    rate = 150
+    burst = 50
+    monkeypatch.setattr(settings, "THROTTLE_RATE", rate)
+    monkeypatch.setattr(settings, "THROTTLE_BURST", burst)
+    monkeypatch.setattr(settings, "THROTTLE_CLIENT_HEADER", "X-API-Key")
+    monkeypatch.setattr(
+        settings, "THROTTLE_CLIENT_KEYS", ["bulk", "foo", "bar"], raising=False
+    )
+    configure(CHUNK_SIZE=10)
+    get_throttler.cache_clear()
+    for route in get_routes_from_datasets(app.state.datasets):
+        app.add_route(route.path, route.endpoint)
+
+    async def download(client: httpx.AsyncClient, key: str) -> int:
+        response = await client.get("/d/ids.csv", headers={"X-API-Key": key})
+        assert response.status_code == HTTP_200_OK
+        return len(response.content)
+
+    async def download_concurrently(*keys: str) -> float:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+            start = time.perf_counter()
+            async with anyio.create_task_group() as tg:
+                for key in keys:
+                    tg.start_soon(download, c, key)
+            return time.perf_counter() - start
+
+    try:
+        size = len(TestClient(app).get("/d/ids.csv").content)
+        # Tokens borrowed to send the last chunk (1/6 of the output) are not
+        # waited for: a third of the output is not counted to stay on the safe side
+        margin = size / 3
+
+        # Concurrent downloads of a client share its bucket
+        shared = await download_concurrently("bulk", "bulk")
+        assert shared >= (2 * size - burst - margin) / rate
+
+        # Other clients are not throttled by the bulk client transfers: their
+        # concurrent downloads take as long as a single download
+        duration = await download_concurrently("foo", "bar")
+        assert duration >= (size - burst - margin) / rate
+        assert duration < (2 * size - burst - margin) / rate
+
+        # Unknown keys do not identify clients: they share their IP address bucket
+        shared = await download_concurrently("baz", "qux")
+        assert shared >= (2 * size - burst - margin) / rate
+    finally:
+        get_throttler.cache_clear()
+
+
+def test_stream_dataset_route_with_limits():
+    """Test data7 application stream_dataset view for a limited dataset."""
+    app.state.datasets = [
+        Dataset(
+            basename="customers",
+            query="SELECT CustomerId as id FROM Customer",
+            max_rows=10,
+        ),
+        Dataset(basename="slow", query=SLOW_COUNT_QUERY, statement_timeout=0.1),
+        Dataset(
+            basename="many", query=SLOW_ROWS_QUERY, max_rows=settings.CHUNK_SIZE + 1
+        ),
+    ]
+    for route in get_routes_from_datasets(app.state.datasets):
+        app.add_route(route.path, route.endpoint)
+
+    client = TestClient(app)
+
+    # Limits hit before the response starts
+    response = client.get("/d/customers.csv")
+    assert response.status_code == HTTP_413_CONTENT_TOO_LARGE
+    assert response.text == "Dataset 'customers' exceeds its 10 rows limit"
+
+    response = client.get("/d/slow.csv")
+    assert response.status_code == HTTP_504_GATEWAY_TIMEOUT
+    assert response.text == "Dataset 'slow' statement exceeded its 0.1s timeout"
+
+    # Limits hit while streaming abort the response
+    with pytest.raises(LimitExceeded):
+        client.get("/d/many.csv")
+
+
 def test_profiling_middleware():
     """Test the profiling middleware."""
     app.state.datasets = [
@@ -180,3 +598,273 @@ def test_profiling_middleware():
     response = client.get("/d/employees.csv?profile")
     assert response.status_code == HTTP_200_OK
     assert response.text.startswith("last_name,first_name,city")
+
+
+def test_timing_middleware():
+    """Test the timing middleware Server-Timing header."""
+    app.state.datasets = [
+        Dataset(
+            basename="employees",
+            query=(
+                "SELECT "
+                "LastName as last_name, "
+                "FirstName as first_name, "
+                "city as city "
+                "FROM Employee"
+            ),
+        ),
+    ]
+    for route in get_routes_from_datasets(app.state.datasets):
+        app.add_route(route.path, route.endpoint)
+
+    client = TestClient(app)
+
+    for extension in formats.extensions:
+        response = client.get(f"/d/employees.{extension}")
+        assert response.status_code == HTTP_200_OK
+        stages = [
+            timing.split(";")[0]
+            for timing in response.headers["Server-Timing"].split(", ")
+        ]
+        # Stages measured before the response starts
+        assert {"connect", "first-chunk", "fetch"}.issubset(stages)
+
+
+@pytest.mark.anyio
+async def test_timing_middleware_trailers():
+    """Test the timing middleware Server-Timing trailers."""
+
+    async def asgi_app(scope, receive, send):
+        with measure("encode"):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"foo", "more_body": True})
+        await send({"type": "http.response.body", "body": b"bar"})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/d/foo.csv",
+        "headers": [],
+        "extensions": {"http.response.trailers": {}},
+    }
+    await TimingMiddleware(asgi_app)(scope, None, send)
+
+    assert [m["type"] for m in messages] == [
+        "http.response.start",
+        "http.response.body",
+        "http.response.body",
+        "http.response.trailers",
+    ]
+    assert messages[0]["trailers"] is True
+    assert (b"trailer", b"Server-Timing") in messages[0]["headers"]
+    assert (b"server-timing", b"") in messages[0]["headers"]
+    name, value = messages[-1]["headers"][0]
+    assert name == b"server-timing"
+    assert value.startswith(b"encode;dur=")
+    assert b"send;dur=" in value
+    assert b"total;dur=" in value
+
+
+@pytest.mark.anyio
+async def test_memory_middleware(caplog):
+    """Test the memory middleware Server-Memory header and logs."""
+
+    async def asgi_app(scope, receive, send):
+        with measure("fetch"):
+            data = bytearray(1024**2)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        with measure("encode"):
+            body = bytes(data[:3])
+        await send({"type": "http.response.body", "body": body})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/d/foo.csv", "headers": []}
+    tracemalloc.start()
+    try:
+        with caplog.at_level("INFO", logger="data7.app"):
+            await MemoryMiddleware(asgi_app)(scope, None, send)
+    finally:
+        tracemalloc.stop()
+
+    # Stages tracked before the response starts
+    assert [m["type"] for m in messages] == [
+        "http.response.start",
+        "http.response.body",
+    ]
+    headers = dict(messages[0]["headers"])
+    assert b"trailer" not in headers
+    stages = dict(
+        metric.split(b";bytes=") for metric in headers[b"server-memory"].split(b", ")
+    )
+    assert list(stages) == [b"fetch", b"arrow", b"peak"]
+    assert int(stages[b"fetch"]) >= 1024**2
+
+    record = next(r for r in caplog.records if "memory:" in r.message)
+    assert record.message.startswith("GET /d/foo.csv memory: fetch=")
+    assert record.memory["fetch"] >= 1024**2
+    assert "encode" in record.memory
+    assert record.memory["peak"] >= record.memory["fetch"]
+
+
+@pytest.mark.anyio
+async def test_memory_middleware_trailers():
+    """Test the memory middleware Server-Memory trailers (with timings)."""
+
+    async def asgi_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        with measure("encode"):
+            data = bytearray(1024**2)
+        await send({"type": "http.response.body", "body": b"foo", "more_body": True})
+        await send({"type": "http.response.body", "body": bytes(data[:3])})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/d/foo.csv",
+        "headers": [],
+        "extensions": {"http.response.trailers": {}},
+    }
+    tracemalloc.start()
+    try:
+        await TimingMiddleware(MemoryMiddleware(asgi_app))(scope, None, send)
+    finally:
+        tracemalloc.stop()
+
+    # A single trailers message for both middlewares
+    assert [m["type"] for m in messages] == [
+        "http.response.start",
+        "http.response.body",
+        "http.response.body",
+        "http.response.trailers",
+    ]
+    assert messages[0]["trailers"] is True
+    assert (b"trailer", b"Server-Memory") in messages[0]["headers"]
+    assert (b"trailer", b"Server-Timing") in messages[0]["headers"]
+    assert (b"server-memory", b"arrow;bytes=0, peak;bytes=0") in messages[0]["headers"]
+    trailers = dict(messages[-1]["headers"])
+    assert trailers[b"server-memory"].startswith(b"encode;bytes=")
+    assert b"peak;bytes=" in trailers[b"server-memory"]
+    assert trailers[b"server-timing"].startswith(b"encode;dur=")
+    assert b"total;dur=" in trailers[b"server-timing"]
+
+
+def test_timing_middleware_slow_request_profiling(tmp_path, configure):
+    """Test the timing middleware slow requests profiling."""
+    app.state.datasets = [
+        Dataset(
+            basename="employees",
+            query=(
+                "SELECT "
+                "LastName as last_name, "
+                "FirstName as first_name, "
+                "city as city "
+                "FROM Employee"
+            ),
+        ),
+    ]
+    for route in get_routes_from_datasets(app.state.datasets):
+        app.add_route(route.path, route.endpoint)
+    configure(SLOW_REQUEST_PROFILES_DIR=str(tmp_path), SLOW_REQUEST_SAMPLE_RATE=1.0)
+
+    client = TestClient(app)
+
+    # Fast requests are not saved
+    configure(SLOW_REQUEST_THRESHOLD=60)
+    response = client.get("/d/employees.csv")
+    assert response.status_code == HTTP_200_OK
+    assert list(tmp_path.iterdir()) == []
+
+    # Slow requests are saved, the response is left untouched
+    configure(SLOW_REQUEST_THRESHOLD=0)
+    response = client.get("/d/employees.csv")
+    assert response.status_code == HTTP_200_OK
+    assert response.text.startswith("last_name,first_name,city")
+    assert len(list(tmp_path.glob("*-d_employees.csv-*ms.pyisession"))) == 1
+
+    # Requests are not sampled
+    configure(SLOW_REQUEST_SAMPLE_RATE=0)
+    response = client.get("/d/employees.csv")
+    assert len(list(tmp_path.glob("*.pyisession"))) == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("spec_version", ["2.0", "2.4"])
+@pytest.mark.parametrize(
+    "query,disconnect_after_first_chunk",
+    [
+        # Client disconnects while the response is streamed
+        (SLOW_ROWS_QUERY, True),
+        # Client disconnects while the first chunk is fetched
+        (SLOW_COUNT_QUERY, False),
+    ],
+)
+async def test_stream_dataset_client_disconnect(
+    spec_version, query, disconnect_after_first_chunk
+):
+    """Test database work is cancelled when the client disconnects."""
+    app.state.datasets = [Dataset(basename="slow", query=query)]
+    for route in get_routes_from_datasets(app.state.datasets):
+        app.add_route(route.path, route.endpoint)
+    pool = router.get_read_engine(None).pool
+
+    disconnected = anyio.Event()
+    messages = []
+    received = 0
+
+    async def receive():
+        nonlocal received
+        received += 1
+        if received == 1:
+            return {"type": "http.request", "body": b"", "more_body": False}
+        if not disconnect_after_first_chunk:
+            with anyio.move_on_after(0.2):
+                await disconnected.wait()
+            disconnected.set()
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+        if message["type"] == "http.response.body" and message["body"]:
+            disconnected.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": spec_version},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/d/slow.csv",
+        "raw_path": b"/d/slow.csv",
+        "query_string": b"",
+        "headers": [],
+        "server": ("testserver", 80),
+    }
+    start = time.perf_counter()
+    with anyio.fail_after(10):
+        await app(scope, receive, send)
+    assert time.perf_counter() - start < CANCELLED_REQUEST_MAX_DURATION
+
+    # The connection has been returned to the pool
+    assert pool.checkedout() == 0
+
+    status = messages[0]["status"]
+    if disconnect_after_first_chunk:
+        assert status == HTTP_200_OK
+        assert messages[1]["body"].startswith(b"i\n1\n")
+    else:
+        assert status == HTTP_499_CLIENT_CLOSED_REQUEST
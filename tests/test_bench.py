@@ -0,0 +1,129 @@
+"""Tests for the data7.bench module."""
+
+from data7.bench import (
+    BenchCase,
+    BenchResult,
+    count_rows,
+    get_cases,
+    recommend,
+    run_case,
+)
+from data7.formats import formats
+from data7.models import Dataset
+
+N_CUSTOMERS = 59
+
+customers = Dataset(
+    basename="customers",
+    query=(
+        "SELECT "
+        "LastName as last_name, "
+        "FirstName as first_name, "
+        "Company as company "
+        "FROM Customer"
+    ),
+)
+
+
+def test_count_rows(db_engine):
+    """Test the count_rows function."""
+    assert count_rows(db_engine, customers) == N_CUSTOMERS
+
+    # Derived datasets rows are counted from their result
+    derived = Dataset(
+        basename="companies",
+        derive={"source": "customers", "filters": {"company": "neq.foo"}},
+        sources={"customers": customers},
+    )
+    assert count_rows(db_engine, derived) < N_CUSTOMERS
+
+
+def test_get_cases():
+    """Test the get_cases function."""
+    cases = get_cases(
+        [customers],
+        formats.extensions,
+        [10, 100],
+        ["numpy_nullable", "pyarrow"],
+        [50],
+    )
+    # CSV streamer cannot be tuned (2 chunk sizes), while the parquet streamer
+    # can (2 chunk sizes x 2 backends x 1 sniffer size)
+    assert len(cases) == 2 + 4
+    assert [c.label for c in cases if c.extension == "csv"] == [
+        "customers-csv-10",
+        "customers-csv-100",
+    ]
+    assert cases[2].label == "customers-parquet-10-numpy_nullable-50"
+
+
+def test_get_cases_with_column_hints():
+    """Test the get_cases function for a dataset with columns hints."""
+    hinted = Dataset(
+        basename="customers",
+        query=customers.query,
+        columns=[{"name": "company", "dictionary": True}],
+    )
+    cases = get_cases([hinted], formats.extensions, [10], ["pyarrow"], [50])
+    assert [c.label for c in cases] == [
+        "customers-csv-10-hints",
+        "customers-csv-10-no-hints",
+        "customers-parquet-10-pyarrow-50-hints",
+        "customers-parquet-10-pyarrow-50-no-hints",
+    ]
+
+
+def test_run_case_with_column_hints(db_engine):
+    """Test the run_case function for a dataset with columns hints."""
+    hinted = Dataset(
+        basename="invoices",
+        query="SELECT CustomerId as customer, Total as total FROM Invoice",
+        columns=[
+            {"name": "customer", "type": "int16", "dictionary": True},
+            {"name": "total", "type": "float32"},
+        ],
+    )
+    with_hints, without_hints = (
+        run_case(db_engine, BenchCase(hinted, "parquet", 500, "pyarrow", 50, h), 412)
+        for h in (True, False)
+    )
+    assert with_hints.size < without_hints.size
+
+
+def test_run_case(db_engine):
+    """Test the run_case function."""
+    case = BenchCase(customers, "parquet", 10, "pyarrow", 20)
+    result = run_case(db_engine, case, rows=N_CUSTOMERS)
+    assert result.rows == N_CUSTOMERS
+    assert 0 < result.ttfb <= result.duration
+    assert result.size > 0
+    assert result.peak_memory > 0
+    assert result.rows_per_second > 0
+    assert result.mb_per_second > 0
+    assert result.session is None
+
+    result = run_case(db_engine, case, rows=N_CUSTOMERS, profile=True)
+    assert result.session is not None
+
+
+def test_recommend():
+    """Test the recommend function."""
+    slow, fast, csv = (
+        BenchCase(customers, "parquet", 10, "pyarrow", 20),
+        BenchCase(customers, "parquet", 100, "pyarrow", 20),
+        BenchCase(customers, "csv", 10),
+    )
+    results = [
+        BenchResult(
+            slow, rows=N_CUSTOMERS, ttfb=0.1, duration=2.0, size=10, peak_memory=1
+        ),
+        BenchResult(
+            fast, rows=N_CUSTOMERS, ttfb=0.1, duration=1.0, size=10, peak_memory=1
+        ),
+        BenchResult(
+            csv, rows=N_CUSTOMERS, ttfb=0.1, duration=1.0, size=10, peak_memory=1
+        ),
+    ]
+    best = recommend(results)
+    assert best["customers"]["parquet"].case == fast
+    assert best["customers"]["csv"].case == csv
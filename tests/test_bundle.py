@@ -0,0 +1,164 @@
+"""Tests for the data7.bundle module."""
+
+import io
+import sqlite3
+import zipfile
+
+import pytest
+from pyarrow import parquet as pq
+from sqlalchemy import create_engine, event, text
+
+from data7.bundle import (
+    BundleError,
+    get_bundle_members,
+    snapshot,
+    stream_bundle,
+)
+from data7.cache import get_result_cache
+from data7.config import settings
+from data7.formats import formats
+from data7.models import Dataset
+from data7.streamers import fetch_batches, sql2csv, sql2parquet
+
+
+@pytest.fixture
+def datasets():
+    """Get bundled datasets."""
+    return [
+        Dataset(basename="customers", query="SELECT * FROM Customer"),
+        Dataset(basename="employees", query="SELECT * FROM Employee"),
+        Dataset(
+            basename="invoices",
+            query="SELECT * FROM Invoice WHERE Total > :total",
+            parameters=[{"name": "total", "type": "float"}],
+        ),
+        Dataset(basename="other", query="SELECT 1", database="other"),
+    ]
+
+
+def test_get_bundle_members(datasets):
+    """Test the get_bundle_members function."""
+    members = get_bundle_members("customers.csv,employees.parquet", datasets)
+    assert [(d.basename, f.extension) for d, f in members] == [
+        ("customers", "csv"),
+        ("employees", "parquet"),
+    ]
+    assert members[1][1] == formats.get("parquet")
+
+    # Datasets can be bundled in multiple formats
+    members = get_bundle_members("customers.csv,customers.parquet", datasets)
+    assert len(members) == 2  # noqa: PLR2004
+
+
+@pytest.mark.parametrize(
+    "value,message",
+    [
+        ("", "No dataset to bundle"),
+        (",", "No dataset to bundle"),
+        ("customers.csv,customers.csv", "Bundled files should be unique"),
+        ("foo.csv", "Dataset 'foo' is not registered"),
+        ("customers.xlsx", "Cannot bundle 'customers.xlsx': Data7 extension"),
+        ("customers", "Cannot bundle 'customers': Data7 extension"),
+        ("invoices.csv", "Cannot bundle 'invoices.csv': Parameter 'total' is"),
+        ("customers.csv,other.csv", "Bundled datasets should use the same database"),
+    ],
+)
+def test_get_bundle_members_errors(datasets, value, message):
+    """Test the get_bundle_members function with invalid files."""
+    with pytest.raises(BundleError, match=message):
+        get_bundle_members(value, datasets)
+
+
+def test_stream_bundle(db_engine, datasets, configure):
+    """Test the stream_bundle function."""
+    # Do not coalesce archive chunks
+    configure(OUTPUT_FLUSH_SIZE=0)
+    members = get_bundle_members("customers.csv,employees.parquet", datasets)
+    chunks = list(stream_bundle(db_engine, members, chunksize=10))
+    assert len(chunks) > 2  # noqa: PLR2004
+    assert all(chunks)
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.namelist() == ["customers.csv", "employees.parquet"]
+        assert archive.read("customers.csv").decode() == "".join(
+            sql2csv(db_engine, members[0][0], chunksize=10)
+        )
+        assert archive.read("employees.parquet") == b"".join(
+            sql2parquet(db_engine, members[1][0], chunksize=10)
+        )
+
+
+def test_stream_bundle_snapshot(tmp_path):
+    """Test bundled datasets are queried in a single snapshot."""
+    path = tmp_path / "bundle.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE a (id INTEGER)")
+        conn.execute("CREATE TABLE b (id INTEGER)")
+        conn.executemany("INSERT INTO a VALUES (?)", [(i,) for i in range(100)])
+        conn.executemany("INSERT INTO b VALUES (?)", [(i,) for i in range(100)])
+
+    engine = create_engine(f"sqlite:///{path}")
+    datasets = [
+        Dataset(basename="a", query="SELECT id FROM a"),
+        Dataset(basename="b", query="SELECT id FROM b"),
+    ]
+    chunks = stream_bundle(engine, get_bundle_members("a.csv,b.csv", datasets), 10)
+    output = [next(chunks)]
+
+    # Rows inserted while the bundle is streamed are not part of it
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO b VALUES (100)"))
+    output.extend(chunks)
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(output))) as archive:
+        assert len(archive.read("b.csv").decode().splitlines()) == 101  # noqa: PLR2004
+    engine.dispose()
+
+
+def test_stream_bundle_uncached(tmp_path, monkeypatch, configure):
+    """Test bundled datasets are not served from the results cache."""
+    path = tmp_path / "bundle.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE a (id INTEGER)")
+        conn.executemany("INSERT INTO a VALUES (?)", [(i,) for i in range(100)])
+
+    engine = create_engine(f"sqlite:///{path}")
+    datasets = [Dataset(basename="a", query="SELECT id FROM a", cache_ttl=60)]
+    members = get_bundle_members("a.csv,a.parquet", datasets)
+    assert members[0][0].cache_ttl == 0
+    assert members[0][0].materialize_ttl == 0
+
+    get_result_cache.cache_clear()
+    monkeypatch.setattr(settings, "RESULT_CACHE_MAX_BYTES", 10_000_000, raising=False)
+    # Arrow CSV and Parquet streamers read (cached) results as record batches
+    configure(CSV_ENCODER="arrow")
+    try:
+        # Cache the query result, then insert a row
+        list(fetch_batches(engine, datasets[0].bind({})))
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO a VALUES (100)"))
+        output = b"".join(stream_bundle(engine, members, 10))
+    finally:
+        get_result_cache.cache_clear()
+
+    with zipfile.ZipFile(io.BytesIO(output)) as archive:
+        assert len(archive.read("a.csv").decode().splitlines()) == 102  # noqa: PLR2004
+        table = pq.read_table(io.BytesIO(archive.read("a.parquet")))
+        assert table.num_rows == 101  # noqa: PLR2004
+    engine.dispose()
+
+
+def test_snapshot_invalidates_connection(db_engine):
+    """Test the snapshot connection is invalidated on errors."""
+    invalidated = []
+    event.listen(db_engine, "invalidate", lambda *args: invalidated.append(args))
+
+    with snapshot(db_engine) as conn:
+        assert conn.in_transaction() is True
+    assert invalidated == []
+
+    with pytest.raises(RuntimeError), snapshot(db_engine):
+        raise RuntimeError
+    assert len(invalidated) == 1
+    assert db_engine.pool.checkedout() == 0
@@ -0,0 +1,90 @@
+"""Tests for the data7.cache module."""
+
+import time
+
+import pyarrow as pa
+
+from data7.cache import (
+    CacheStats,
+    ResultCache,
+    get_cache_key,
+    get_cache_ttl,
+    get_result_cache,
+)
+from data7.config import settings
+from data7.models import Dataset
+
+
+def test_result_cache():
+    """Test the ResultCache class."""
+    table = pa.table({"id": list(range(100))})
+    size = table.nbytes
+    cache = ResultCache(max_bytes=size * 2)
+    assert cache.stats == CacheStats(max_bytes=size * 2)
+
+    assert cache.get("foo") is None
+    assert cache.set("foo", table, ttl=60) is True
+    assert cache.get("foo") == table
+    assert cache.peek("foo") == table
+    assert cache.stats == CacheStats(
+        hits=1, misses=1, entries=1, bytes=size, max_bytes=size * 2
+    )
+
+    # Least recently used entries are evicted
+    assert cache.set("bar", table, ttl=60) is True
+    assert cache.get("foo") == table
+    assert cache.set("baz", table, ttl=60) is True
+    assert cache.get("bar") is None
+    assert cache.get("foo") == table
+    assert cache.get("baz") == table
+    assert cache.stats.bytes == size * 2
+
+    # Too large to be cached
+    assert cache.set("large", pa.concat_tables([table] * 3), ttl=60) is False
+    assert cache.stats.entries == 2  # noqa: PLR2004
+
+    # Expired entries
+    assert cache.set("foo", table, ttl=0.01) is True
+    time.sleep(0.02)
+    assert cache.peek("foo") is None
+    assert cache.get("foo") is None
+    assert cache.stats.bytes == size
+
+    cache.clear()
+    assert cache.stats.entries == 0
+    assert cache.stats.bytes == 0
+
+
+def test_get_result_cache(monkeypatch):
+    """Test the get_result_cache function."""
+    get_result_cache.cache_clear()
+    monkeypatch.setattr(settings, "RESULT_CACHE_MAX_BYTES", 0, raising=False)
+    assert get_result_cache() is None
+
+    get_result_cache.cache_clear()
+    monkeypatch.setattr(settings, "RESULT_CACHE_MAX_BYTES", 1000, raising=False)
+    cache = get_result_cache()
+    assert cache is not None
+    assert cache.max_bytes == 1000  # noqa: PLR2004
+    assert get_result_cache() is cache
+    get_result_cache.cache_clear()
+
+
+def test_get_cache_ttl_and_key(configure):
+    """Test the get_cache_ttl and get_cache_key functions."""
+    configure(RESULT_CACHE_TTL=60)
+    dataset = Dataset(basename="foo", query="SELECT 1")
+    assert get_cache_ttl(dataset) == 60  # noqa: PLR2004
+    dataset.cache_ttl = 0
+    assert get_cache_ttl(dataset) == 0
+
+    assert get_cache_key(dataset) == ("foo", ())
+    assert get_cache_key(dataset, "pyarrow") == ("foo", (), "pyarrow")
+
+    # Bound parameters are part of the key
+    dataset.params = {"year": 2024, "country": "France"}
+    assert get_cache_key(dataset, "pyarrow") == (
+        "foo",
+        (("country", "France"), ("year", 2024)),
+        "pyarrow",
+    )
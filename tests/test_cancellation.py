@@ -0,0 +1,80 @@
+"""Tests for the data7.cancellation module."""
+
+import threading
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from data7.cancellation import (
+    Cancellation,
+    cancel_statement,
+    current_cancellation,
+    track,
+)
+
+SLOW_QUERY = (
+    "WITH RECURSIVE n(i) AS "
+    "(SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000000000) "
+    "SELECT count(*) FROM n"
+)
+
+
+def test_cancel_statement(db_engine):
+    """Test the cancel_statement function."""
+    with db_engine.connect() as conn:
+        timer = threading.Timer(0.1, cancel_statement, args=(conn,))
+        timer.start()
+        with pytest.raises(OperationalError, match="interrupted"):
+            conn.execute(text(SLOW_QUERY))
+        timer.join()
+
+        # The connection is still usable
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+
+    # Closed connection
+    assert cancel_statement(conn) is False
+
+
+def test_cancel_statement_unsupported_driver(db_engine, monkeypatch):
+    """Test the cancel_statement function with an unsupported driver."""
+    with db_engine.connect() as conn:
+        monkeypatch.setattr(conn.dialect, "driver", "foo")
+        assert cancel_statement(conn) is False
+
+
+def test_cancellation(db_engine):
+    """Test the Cancellation class."""
+    cancellation = Cancellation()
+    assert cancellation.cancelled is False
+
+    with db_engine.connect() as conn, cancellation.track(conn):
+        timer = threading.Timer(0.1, cancellation.cancel)
+        timer.start()
+        with pytest.raises(OperationalError, match="interrupted"):
+            conn.execute(text(SLOW_QUERY))
+        timer.join()
+    assert cancellation.cancelled is True
+
+    # No more connections can be tracked once cancelled
+    with (
+        db_engine.connect() as conn,
+        pytest.raises(RuntimeError, match="has been cancelled"),
+        cancellation.track(conn),
+    ):
+        pass
+
+
+def test_track(db_engine):
+    """Test the track context manager."""
+    with db_engine.connect() as conn, track(conn) as tracked:
+        assert tracked is conn
+
+    cancellation = Cancellation()
+    token = current_cancellation.set(cancellation)
+    try:
+        with db_engine.connect() as conn, track(conn):
+            assert cancellation._connections == [conn]
+        assert cancellation._connections == []
+    finally:
+        current_cancellation.reset(token)
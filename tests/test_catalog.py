@@ -0,0 +1,153 @@
+"""Tests for the data7.catalog module."""
+
+import datetime
+
+import pytest
+from sqlalchemy import create_engine
+
+from data7.catalog import (
+    Catalog,
+    estimate_rows,
+    get_default_params,
+    is_default_request,
+)
+from data7.databases import DatabaseRouter
+from data7.formats import formats
+from data7.models import Dataset, DatasetMetadata
+
+CUSTOMERS_QUERY = "SELECT CustomerId as id, Country as country FROM Customer"
+N_CUSTOMERS = 59
+N_FRENCH_CUSTOMERS = 17
+
+
+@pytest.fixture
+def sales():
+    """Get a parameterized dataset."""
+    return Dataset(
+        basename="sales",
+        query="SELECT * FROM Invoice WHERE InvoiceDate >= :since AND Total > :total",
+        parameters=[
+            {"name": "since", "type": "date", "default": datetime.date(2020, 1, 1)},
+            {"name": "total", "type": "float"},
+        ],
+    )
+
+
+def test_get_default_params(sales):
+    """Test the get_default_params function."""
+    assert get_default_params(Dataset(basename="foo", query="SELECT 1")) == {}
+    assert get_default_params(sales) is None
+    sales.parameters[1].default = 1.0
+    assert get_default_params(sales) == {
+        "since": datetime.date(2020, 1, 1),
+        "total": 1.0,
+    }
+
+
+def test_is_default_request(sales):
+    """Test the is_default_request function."""
+    dataset = Dataset(basename="customers", query=CUSTOMERS_QUERY)
+    assert is_default_request(dataset.bind({})) is True
+    assert is_default_request(dataset.bind({"profile": "1"})) is True
+    assert is_default_request(dataset.bind({"select": "id"})) is False
+    assert is_default_request(dataset.bind({"country": "eq.France"})) is False
+    assert is_default_request(dataset.bind({"head": "1"})) is False
+
+    # Datasets with required parameters have no default request
+    assert is_default_request(sales.bind({"total": "1.0"})) is False
+    sales.parameters[1].default = 1.0
+    assert is_default_request(sales.bind({})) is True
+    assert is_default_request(sales.bind({"total": "1.0"})) is True
+    assert is_default_request(sales.bind({"total": "2.0"})) is False
+
+
+def test_estimate_rows(db_engine):
+    """Test the estimate_rows function."""
+    dataset = Dataset(basename="customers", query=CUSTOMERS_QUERY)
+    with db_engine.connect() as conn:
+        assert estimate_rows(conn, dataset, {}) == N_CUSTOMERS
+        dataset.query = f"{CUSTOMERS_QUERY} WHERE Country = :country"
+        rows = estimate_rows(conn, dataset, {"country": "France"})
+        assert rows == N_FRENCH_CUSTOMERS
+
+
+def test_catalog(db_engine, sales):
+    """Test the Catalog class."""
+    catalog = Catalog()
+    customers = Dataset(
+        basename="customers",
+        query=CUSTOMERS_QUERY,
+        columns=[{"name": "id", "type": "int16"}],
+    )
+    assert catalog.get("customers") == DatasetMetadata("customers")
+
+    entry = catalog.describe(customers)
+    assert entry["basename"] == "customers"
+    assert entry["formats"][0] == {
+        "extension": "csv",
+        "media_type": "text/csv",
+        "url": "/d/customers.csv",
+        "size": None,
+    }
+    assert [f["extension"] for f in entry["formats"]] == formats.extensions
+    assert entry["columns"] is None
+    assert entry["rows"] is None
+    assert entry["refreshed"] is None
+
+    catalog.refresh_all([customers, sales], db_engine)
+    metadata = catalog.get("customers")
+    assert metadata.columns == {"id": "int16", "country": "string"}
+    assert metadata.rows == N_CUSTOMERS
+    assert metadata.refreshed is not None
+    # Datasets with required parameters are not described
+    assert catalog.get("sales") == DatasetMetadata("sales")
+
+    catalog.record_size(customers.bind({}), "csv", 1234)
+    catalog.record_size(customers.bind({"head": "1"}), "csv", 12)
+    catalog.record_size(customers.bind({}), "parquet", 567)
+    entry = catalog.describe(customers)
+    assert [f["size"] for f in entry["formats"]] == [1234, 567]
+    assert entry["columns"] == [
+        {"name": "id", "type": "int16"},
+        {"name": "country", "type": "string"},
+    ]
+    assert entry["rows"] == N_CUSTOMERS
+    assert datetime.datetime.fromisoformat(entry["refreshed"]).tzinfo is not None
+
+    assert catalog.describe(sales)["parameters"] == [
+        {"name": "since", "type": "date", "default": "2020-01-01"},
+        {"name": "total", "type": "float", "default": None},
+    ]
+
+    # Derived datasets rows are counted from their result
+    countries = Dataset(
+        basename="countries",
+        derive={"source": "customers", "group_by": ["country"]},
+        sources={"customers": customers},
+    )
+    catalog.refresh(db_engine, countries)
+    assert catalog.get("countries").columns == {"country": "string"}
+    assert catalog.get("countries").rows == 3  # noqa: PLR2004
+
+    catalog.clear()
+    assert catalog.get("customers") == DatasetMetadata("customers")
+
+
+def test_catalog_refresh_failure(db_engine, caplog):
+    """Test the Catalog class keeps metadata that cannot be refreshed."""
+    catalog = Catalog()
+    customers = Dataset(basename="customers", query=CUSTOMERS_QUERY)
+    catalog.refresh(db_engine, customers)
+    metadata = catalog.get("customers")
+
+    broken_engine = create_engine("sqlite:////nonexistent/db.sqlite")
+    catalog.refresh(broken_engine, customers)
+    assert "Failed to refresh 'customers' dataset metadata" in caplog.text
+    assert catalog.get("customers") == metadata
+
+    # Metadata are computed against the dataset database
+    router = DatabaseRouter.from_settings()
+    catalog.clear()
+    catalog.refresh_all([customers], broken_engine, router)
+    assert catalog.get("customers").rows == N_CUSTOMERS
+    router.dispose()
@@ -6,7 +6,9 @@ from pathlib import Path
 import pytest
 
 import data7
+from data7 import server
 from data7.cli import ExitCodes, cli
+from data7.flight import FlightServer
 
 
 def test_command_help(runner):
@@ -118,6 +120,13 @@ def test_stream_command_with_invalid_dataset(runner, extension):
     assert "Dataset 'foo' not found." in result.output
 
 
+def test_stream_command_with_invalid_extension(runner):
+    """Test the `data7 stream [extension]` command with an invalid extension."""
+    result = runner.invoke(cli, ["stream", "xls", "customers"])
+    assert result.exit_code == ExitCodes.INVALID_ARGUMENT
+    assert "Data7 extension 'xls' is not supported." in result.output
+
+
 @pytest.mark.parametrize(
     "extension,dataset",
     (
@@ -131,3 +140,138 @@ def test_stream_command(runner, extension, dataset):
     """Test the `data7 stream [extension]` command with an invalid dataset."""
     result = runner.invoke(cli, ["stream", extension, dataset])
     assert result.exit_code == ExitCodes.OK
+
+
+def test_stream_command_with_parameters(runner, monkeypatch):
+    """Test the `data7 stream [extension]` command with a parameterized dataset."""
+    monkeypatch.setattr(
+        data7.config.settings,
+        "datasets",
+        [
+            {
+                "basename": "customers",
+                "query": "SELECT Country FROM Customer WHERE Country = :country",
+                "parameters": [{"name": "country"}],
+            }
+        ],
+    )
+    result = runner.invoke(cli, ["stream", "csv", "customers", "-p", "country=USA"])
+    assert result.exit_code == ExitCodes.OK
+
+    result = runner.invoke(cli, ["stream", "csv", "customers"])
+    assert result.exit_code == ExitCodes.INVALID_ARGUMENT
+    assert "Parameter 'country' is required." in result.output
+
+
+def test_stream_command_with_limits(runner, monkeypatch):
+    """Test the `data7 stream [extension]` command with a limited dataset."""
+    monkeypatch.setattr(
+        data7.config.settings,
+        "datasets",
+        [
+            {
+                "basename": "customers",
+                "query": "SELECT Country FROM Customer",
+                "max_rows": 10,
+            }
+        ],
+    )
+    result = runner.invoke(cli, ["stream", "csv", "customers"])
+    assert result.exit_code == ExitCodes.LIMIT_EXCEEDED
+    assert "Dataset 'customers' exceeds its 10 rows limit" in result.output
+
+
+def test_bench_command(runner, tmp_path):
+    """Test the `data7 bench` command."""
+    result = runner.invoke(
+        cli,
+        [
+            "bench",
+            "--dataset",
+            "customers",
+            "--chunk-size",
+            "5",
+            "--dtype-backend",
+            "pyarrow",
+            "--profile-dir",
+            str(tmp_path),
+            "--profile-slowest",
+            "1",
+        ],
+    )
+    assert result.exit_code == ExitCodes.OK
+    assert "recommended settings" in result.output
+    assert len(list(tmp_path.glob("customers-*.pyisession"))) == 1
+
+
+def test_bench_command_with_invalid_dataset(runner):
+    """Test the `data7 bench` command with an invalid dataset."""
+    result = runner.invoke(cli, ["bench", "--dataset", "foo"])
+    assert result.exit_code == ExitCodes.INVALID_ARGUMENT
+    assert "not found" in result.output
+
+
+def test_bench_command_with_invalid_extension(runner):
+    """Test the `data7 bench` command with an invalid extension."""
+    result = runner.invoke(cli, ["bench", "--extension", "xls"])
+    assert result.exit_code == ExitCodes.INVALID_ARGUMENT
+    assert "not supported" in result.output
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        ["--preload", "--reload"],
+        ["--reuse-port"],
+    ],
+)
+def test_run_command_with_invalid_options(runner, options):
+    """Test the `data7 run` command with incompatible options."""
+    result = runner.invoke(cli, ["run", *options])
+    assert result.exit_code == ExitCodes.INVALID_ARGUMENT
+
+
+def test_run_command_with_preload(runner, monkeypatch):
+    """Test the `data7 run --preload` command."""
+    calls = []
+    monkeypatch.setattr(server, "preload", lambda: calls.append("preload"))
+    monkeypatch.setattr(
+        server,
+        "serve",
+        lambda config, workers, reuse_port: calls.append(
+            (config.port, workers, reuse_port)
+        ),
+    )
+    result = runner.invoke(
+        cli, ["run", "--preload", "--reuse-port", "--workers", "2", "--port", "8765"]
+    )
+    assert result.exit_code == ExitCodes.OK
+    assert calls == ["preload", (8765, 2, True)]
+
+
+def test_flight_command(runner, monkeypatch):
+    """Test the `data7 flight` command."""
+    served = []
+
+    def serve(server):
+        served.append(server)
+
+    monkeypatch.setattr(FlightServer, "serve", serve)
+    result = runner.invoke(cli, ["flight", "--port", "0"])
+    assert result.exit_code == ExitCodes.OK
+    (server,) = served
+    assert server.port > 0
+    assert "Serving datasets on grpc://" in result.output
+    server.shutdown()
+
+
+def test_check_command_with_invalid_settings_value(runner, monkeypatch):
+    """Test the `data7 check` command with an invalid settings value."""
+    monkeypatch.setattr(data7.config.settings, "CHUNK_SIZE", "foo")
+    try:
+        result = runner.invoke(cli, ["check"])
+        assert result.exit_code == ExitCodes.INVALID_CONFIGURATION
+        assert "'CHUNK_SIZE' value 'foo' is not a valid int" in result.output
+    finally:
+        monkeypatch.undo()
+        data7.config.load_config()
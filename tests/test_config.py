@@ -0,0 +1,30 @@
+"""Tests for the data7.config module."""
+
+import pytest
+
+from data7.config import get_config, load_config, settings
+
+
+def test_get_config(monkeypatch):
+    """Test the get_config function."""
+    config = get_config()
+    assert config.chunk_size == settings.CHUNK_SIZE
+    assert get_config() is config
+
+    # Settings are compiled once
+    monkeypatch.setattr(settings, "CHUNK_SIZE", 10)
+    assert get_config() is config
+    try:
+        assert load_config().chunk_size == 10  # noqa: PLR2004
+        assert get_config().chunk_size == 10  # noqa: PLR2004
+    finally:
+        monkeypatch.undo()
+        load_config()
+
+
+def test_load_config_with_invalid_settings(configure):
+    """Test the load_config function with invalid settings values."""
+    with pytest.raises(ValueError, match="'CSV_ENCODER' value 'foo' is not one of"):
+        configure(CSV_ENCODER="foo")
+    with pytest.raises(ValueError, match="'MAX_ROWS' value '1k' is not a valid int"):
+        configure(CSV_ENCODER="arrow", MAX_ROWS="1k")
@@ -0,0 +1,117 @@
+"""Tests for the data7.derive module."""
+
+import pyarrow as pa
+import pytest
+
+from data7.derive import derive_table
+from data7.models import Dataset
+
+
+@pytest.fixture
+def tables():
+    """Source datasets results."""
+    return {
+        "invoices": pa.table(
+            {
+                "id": [1, 2, 3, 4, 5],
+                "customer": [1, 1, 2, 3, 3],
+                "total": [1.5, 2.5, 4.0, 1.0, 3.0],
+            }
+        ),
+        "customers": pa.table(
+            {
+                "customer": [1, 2, 3, 4],
+                "country": ["France", "Germany", "France", "Spain"],
+            }
+        ),
+    }
+
+
+def test_derive_table_filters_and_select(tables):
+    """Test the derive_table function with filters and selected columns."""
+    dataset = Dataset(
+        basename="large_invoices",
+        derive={
+            "source": "invoices",
+            "filters": {"total": "gte.2.5"},
+            "select": ["total", "id"],
+        },
+    )
+    table = derive_table(dataset, tables)
+    assert table.column_names == ["total", "id"]
+    assert table.column("id").to_pylist() == [2, 3, 5]
+
+
+def test_derive_table_aggregates(tables):
+    """Test the derive_table function with grouped aggregates."""
+    dataset = Dataset(
+        basename="customers_totals",
+        derive={
+            "source": "invoices",
+            "group_by": ["customer"],
+            "aggregates": [
+                {"column": "total", "function": "sum"},
+                {"column": "id", "function": "count", "name": "invoices"},
+            ],
+        },
+    )
+    table = derive_table(dataset, tables).sort_by("customer")
+    assert table.column_names == ["customer", "total_sum", "invoices"]
+    assert table.to_pydict() == {
+        "customer": [1, 2, 3],
+        "total_sum": [4.0, 4.0, 4.0],
+        "invoices": [2, 1, 2],
+    }
+
+    # Without groups
+    dataset.derive.group_by = []
+    table = derive_table(dataset, tables)
+    assert table.to_pydict() == {"total_sum": [12.0], "invoices": [5]}
+
+
+def test_derive_table_join(tables):
+    """Test the derive_table function with a joined dataset."""
+    dataset = Dataset(
+        basename="countries_totals",
+        derive={
+            "source": "invoices",
+            "join": {"dataset": "customers", "keys": ["customer"]},
+            "filters": {"country": "eq.France"},
+            "group_by": ["country"],
+            "aggregates": [{"column": "total", "function": "max", "name": "max"}],
+        },
+    )
+    table = derive_table(dataset, tables)
+    assert table.to_pydict() == {"country": ["France"], "max": [3.0]}
+
+    # Customers without invoices
+    dataset = Dataset(
+        basename="inactive_customers",
+        derive={
+            "source": "customers",
+            "join": {
+                "dataset": "invoices",
+                "keys": ["customer"],
+                "type": "left anti",
+            },
+        },
+    )
+    table = derive_table(dataset, tables)
+    assert table.to_pydict() == {"customer": [4], "country": ["Spain"]}
+
+
+def test_derive_table_with_unknown_columns(tables):
+    """Test the derive_table function with unknown derivation columns."""
+    for derive in (
+        {"source": "invoices", "select": ["foo"]},
+        {"source": "invoices", "filters": {"foo": "eq.1"}},
+        {"source": "invoices", "group_by": ["foo"]},
+        {"source": "invoices", "aggregates": [{"column": "foo", "function": "sum"}]},
+        {"source": "invoices", "join": {"dataset": "customers", "keys": ["foo"]}},
+    ):
+        dataset = Dataset(basename="derived", derive=derive)
+        with pytest.raises(ValueError, match="derivation column 'foo' does not"):
+            derive_table(dataset, tables)
+
+    with pytest.raises(ValueError, match="Dataset 'customers' is not derived"):
+        derive_table(Dataset(basename="customers", query="SELECT 1"), tables)
@@ -0,0 +1,142 @@
+"""Tests for the data7.flight module."""
+
+import concurrent.futures
+import json
+
+import pyarrow as pa
+import pytest
+from pyarrow import flight
+
+from data7.config import settings
+from data7.databases import DEFAULT_DATABASE, DatabaseRouter
+from data7.flight import FlightServer, get_descriptor, parse_request
+from data7.models import Database, Dataset
+
+N_CUSTOMERS = 59
+N_FRENCH_CUSTOMERS = 17
+
+
+@pytest.fixture
+def client():
+    """Get a client of a local Flight server."""
+    router = DatabaseRouter(
+        [Database(name=DEFAULT_DATABASE, url=settings.DATABASE_URL)]
+    )
+    datasets = [
+        Dataset(
+            basename="customers",
+            query="SELECT CustomerId AS id, Country AS country FROM Customer",
+            partition_column="id",
+            partitions=3,
+        ),
+        Dataset(
+            basename="country_customers",
+            query="SELECT CustomerId AS id FROM Customer WHERE Country = :country",
+            parameters=[{"name": "country"}],
+        ),
+        Dataset(
+            basename="limited_customers",
+            query="SELECT * FROM Customer",
+            max_rows=10,
+        ),
+    ]
+    server = FlightServer("grpc://127.0.0.1:0", datasets, router, chunksize=10)
+    client = flight.connect(f"grpc://127.0.0.1:{server.port}")
+    yield client
+    client.close()
+    server.shutdown()
+    router.dispose()
+
+
+def read_flight(client: flight.FlightClient, info: flight.FlightInfo) -> pa.Table:
+    """Read all flight endpoints in parallel."""
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        tables = executor.map(
+            lambda endpoint: client.do_get(endpoint.ticket).read_all(),
+            info.endpoints,
+        )
+        return pa.concat_tables(tables)
+
+
+def test_get_descriptor():
+    """Test the get_descriptor function."""
+    assert get_descriptor("customers").path == [b"customers"]
+    descriptor = get_descriptor("customers", country="France")
+    assert json.loads(descriptor.command) == {
+        "basename": "customers",
+        "arguments": {"country": "France"},
+    }
+
+
+def test_parse_request():
+    """Test the parse_request function."""
+    assert parse_request(b'{"basename": "customers"}') == ("customers", {}, 0)
+    assert parse_request(
+        b'{"basename": "customers", "arguments": {"head": "1"}, "partition": 2}'
+    ) == ("customers", {"head": "1"}, 2)
+    with pytest.raises(flight.FlightServerError, match="Invalid flight request"):
+        parse_request(b"{}")
+
+
+def test_list_flights(client):
+    """Test listing datasets flights."""
+    # Datasets with required parameters are not listed
+    info, limited = list(client.list_flights())
+    assert info.descriptor.path == [b"customers"]
+    assert limited.descriptor.path == [b"limited_customers"]
+    assert info.schema.names == ["id", "country"]
+    assert len(info.endpoints) == 3  # noqa: PLR2004
+
+
+def test_do_get_partitions(client):
+    """Test retrieving a partitioned dataset in parallel."""
+    info = client.get_flight_info(get_descriptor("customers"))
+    table = read_flight(client, info)
+    assert table.schema == info.schema
+    assert sorted(table["id"].to_pylist()) == list(range(1, N_CUSTOMERS + 1))
+
+    # Requests arguments are supported
+    info = client.get_flight_info(
+        get_descriptor("customers", country="eq.France", select="id")
+    )
+    table = read_flight(client, info)
+    assert table.schema.names == ["id"]
+    assert table.num_rows == N_FRENCH_CUSTOMERS
+
+    # Previews are not partitioned
+    info = client.get_flight_info(get_descriptor("customers", head="5"))
+    assert len(info.endpoints) == 1
+    assert read_flight(client, info).num_rows == 5  # noqa: PLR2004
+
+
+def test_do_get_parameters(client):
+    """Test retrieving a parameterized dataset."""
+    descriptor = get_descriptor("country_customers", country="France")
+    assert client.get_schema(descriptor).schema.names == ["id"]
+    info = client.get_flight_info(descriptor)
+    assert read_flight(client, info).num_rows == N_FRENCH_CUSTOMERS
+
+
+@pytest.mark.parametrize(
+    "descriptor,message",
+    [
+        (get_descriptor("foo"), "Dataset 'foo' is not registered"),
+        (get_descriptor("country_customers"), "Parameter 'country' is required"),
+        (get_descriptor("customers", head="foo"), "is not a positive int"),
+    ],
+)
+def test_get_flight_info_errors(client, descriptor, message):
+    """Test invalid flight requests."""
+    with pytest.raises(flight.FlightServerError, match=message):
+        client.get_flight_info(descriptor)
+
+
+def test_do_get_limits(client):
+    """Test datasets limits are enforced."""
+    info = client.get_flight_info(get_descriptor("limited_customers"))
+    with pytest.raises(flight.FlightServerError, match="exceeds its 10 rows limit"):
+        read_flight(client, info)
+
+    ticket = flight.Ticket(json.dumps({"basename": "customers", "partition": 3}))
+    with pytest.raises(flight.FlightServerError, match="partition 3 does not exist"):
+        client.do_get(ticket).read_all()
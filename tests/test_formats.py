@@ -0,0 +1,101 @@
+"""Data7 formats tests."""
+
+import importlib.metadata
+import logging
+
+import pytest
+
+from data7.formats import BUILTIN_FORMATS, Format, FormatRegistry, formats
+from data7.streamers import sql2csv, sql2parquet
+
+xlsx = Format("xlsx", "application/vnd.ms-excel", "data7.streamers:sql2csv")
+
+
+class FakeEntryPoint:
+    """Fake entry point that loads a given object."""
+
+    def __init__(self, value, obj):
+        """Set the entry point value and target."""
+        self.value = value
+        self.obj = obj
+
+    def load(self):
+        """Load the entry point target."""
+        return self.obj
+
+
+@pytest.fixture
+def entry_points(monkeypatch):
+    """Declare fake `data7.formats` entry points."""
+    declared = []
+
+    def fake_entry_points(group):
+        assert group == "data7.formats"
+        return declared
+
+    monkeypatch.setattr(importlib.metadata, "entry_points", fake_entry_points)
+    return declared
+
+
+def test_format_streamer():
+    """Test the format streamer lazy loading."""
+    fmt = Format("csv", "text/csv", "data7.streamers:sql2csv")
+    assert fmt._streamer is None
+    assert fmt.streamer == sql2csv
+    assert fmt._streamer == sql2csv
+    assert str(fmt) == "csv"
+
+
+def test_format_streamer_with_invalid_path():
+    """Test the format streamer with an invalid import path."""
+    with pytest.raises(ImportError):
+        _ = Format("foo", "text/plain", "data7.foo:sql2foo").streamer
+    with pytest.raises(AttributeError):
+        _ = Format("foo", "text/plain", "data7.streamers:sql2foo").streamer
+
+
+def test_builtin_formats():
+    """Test the default registry built-in formats."""
+    assert formats.extensions == ["csv", "parquet"]
+    assert formats.get("csv").streamer == sql2csv
+    assert formats.get("PARQUET").streamer == sql2parquet
+    assert formats.get("parquet").media_type == "application/vnd.apache.parquet"
+
+
+def test_registry_get():
+    """Test the registry get method."""
+    registry = FormatRegistry(BUILTIN_FORMATS)
+    assert registry.get("csv") == BUILTIN_FORMATS[0]
+    assert list(registry) == BUILTIN_FORMATS
+
+    with pytest.raises(ValueError, match="Data7 extension 'xls' is not supported"):
+        registry.get("xls")
+
+
+def test_registry_register():
+    """Test the registry register method."""
+    registry = FormatRegistry()
+    assert registry.extensions == []
+
+    registry.register(xlsx)
+    assert registry.get("xlsx") == xlsx
+
+    # Override a registered format
+    other = Format("xlsx", "text/plain", "data7.streamers:sql2csv")
+    registry.register(other)
+    assert registry.get("xlsx") == other
+
+
+def test_registry_entry_points(entry_points, caplog):
+    """Test formats registration using entry points."""
+    entry_points.append(FakeEntryPoint("plugin.formats:xlsx", xlsx))
+    entry_points.append(FakeEntryPoint("plugin.formats:foo", "foo"))
+
+    registry = FormatRegistry(BUILTIN_FORMATS)
+    with caplog.at_level(logging.WARNING):
+        assert registry.extensions == ["csv", "parquet", "xlsx"]
+    assert "'plugin.formats:foo' is not a data7 Format" in caplog.text
+
+    # Entry points are loaded only once
+    entry_points.clear()
+    assert registry.get("xlsx") == xlsx
@@ -0,0 +1,178 @@
+"""Tests for the data7.limits module."""
+
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+import pyarrow as pa
+import pytest
+from pyarrow import parquet as pq
+from sqlalchemy import text
+
+from data7.limits import (
+    LimitExceeded,
+    StatementTimeout,
+    get_max_bytes,
+    get_max_rows,
+    get_statement_timeout,
+    limit_bytes,
+    limit_rows,
+    limited,
+    statement_timeout,
+)
+from data7.models import Dataset
+from data7.streamers import sql2csv, sql2parquet
+
+SLOW_QUERY = (
+    "WITH RECURSIVE n(i) AS "
+    "(SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000000000) "
+    "SELECT count(*) FROM n"
+)
+# Maximal duration (in seconds) of a timed out statement
+TIMED_OUT_STATEMENT_MAX_DURATION = 5
+
+
+def test_get_limits(configure):
+    """Test limits getters."""
+    dataset = Dataset(basename="foo", query="SELECT 1")
+    assert get_statement_timeout(dataset) is None
+    assert get_max_rows(dataset) is None
+    assert get_max_bytes(dataset) is None
+
+    # Settings defaults
+    configure(STATEMENT_TIMEOUT=30, MAX_ROWS=1000, MAX_BYTES=1024)
+    assert get_statement_timeout(dataset) == 30  # noqa: PLR2004
+    assert get_max_rows(dataset) == 1000  # noqa: PLR2004
+    assert get_max_bytes(dataset) == 1024  # noqa: PLR2004
+
+    # Datasets limits override defaults, 0 disables them
+    dataset = Dataset(
+        basename="foo", query="SELECT 1", statement_timeout=0.5, max_rows=0
+    )
+    assert get_statement_timeout(dataset) == 0.5  # noqa: PLR2004
+    assert get_max_rows(dataset) is None
+    assert get_max_bytes(dataset) == 1024  # noqa: PLR2004
+
+
+def test_statement_timeout(db_engine):
+    """Test the statement_timeout context manager."""
+    dataset = Dataset(basename="foo", query=SLOW_QUERY, statement_timeout=0.1)
+    start = time.perf_counter()
+    with (
+        db_engine.connect() as conn,
+        pytest.raises(StatementTimeout, match="exceeded its 0.1s timeout"),
+        statement_timeout(conn, dataset),
+    ):
+        conn.execute(text(dataset.query))
+    assert time.perf_counter() - start < TIMED_OUT_STATEMENT_MAX_DURATION
+
+    # Fast statements are not affected
+    with db_engine.connect() as conn, statement_timeout(conn, dataset):
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+        time.sleep(0.2)
+
+
+def test_statement_timeout_postgresql():
+    """Test the statement_timeout context manager on PostgreSQL."""
+    statements = []
+    conn = SimpleNamespace(
+        dialect=SimpleNamespace(name="postgresql"),
+        execute=lambda statement, params: statements.append((str(statement), params)),
+        exec_driver_sql=lambda statement: statements.append((statement, None)),
+    )
+    dataset = Dataset(basename="foo", query=SLOW_QUERY, statement_timeout=0.1)
+
+    # The timeout is set for the transaction, then reset for later statements
+    with statement_timeout(conn, dataset):
+        assert statements == [
+            (
+                "SELECT set_config('statement_timeout', :timeout, true)",
+                {"timeout": "100ms"},
+            )
+        ]
+    assert statements[1:] == [("SET LOCAL statement_timeout TO DEFAULT", None)]
+
+
+def test_limit_rows():
+    """Test the limit_rows function."""
+    batches = [pa.RecordBatch.from_pydict({"a": [1, 2, 3]})] * 3
+    dataset = Dataset(basename="foo", query="SELECT 1")
+    assert list(limit_rows(batches, dataset)) == batches
+
+    dataset = Dataset(basename="foo", query="SELECT 1", max_rows=9)
+    assert list(limit_rows(batches, dataset)) == batches
+
+    dataset = Dataset(basename="foo", query="SELECT 1", max_rows=8)
+    output = []
+    with pytest.raises(LimitExceeded, match="exceeds its 8 rows limit"):
+        output.extend(limit_rows(batches, dataset))
+    assert output == batches[:2]
+
+
+def test_limit_bytes():
+    """Test the limit_bytes function."""
+    dataset = Dataset(basename="foo", query="SELECT 1", max_bytes=6)
+    assert list(limit_bytes(["foo", b"bar"], dataset)) == ["foo", b"bar"]
+
+    output = []
+    with pytest.raises(LimitExceeded, match="exceeds its 6 bytes limit"):
+        output.extend(limit_bytes(["foo", "éé"], dataset))
+    assert output == ["foo"]
+
+
+def test_limited():
+    """Test the limited decorator."""
+
+    @limited
+    def streamer(engine, dataset, chunk="foo"):
+        """Stream chunks."""
+        yield from [chunk] * 3
+
+    assert streamer.__doc__ == "Stream chunks."
+    dataset = Dataset(basename="foo", query="SELECT 1", max_bytes=8)
+    with pytest.raises(LimitExceeded):
+        list(streamer(None, dataset))
+    assert list(streamer(None, dataset, chunk="fo")) == ["fo"] * 3
+
+
+@pytest.mark.parametrize(
+    "limits",
+    [
+        {"max_rows": 50},
+        {"max_bytes": 500},
+    ],
+)
+def test_streamers_limits(db_engine, limits, configure):
+    """Test streamers enforce datasets limits."""
+    # Stream output chunks as soon as they are written
+    configure(OUTPUT_FLUSH_SIZE=0)
+    dataset = Dataset(
+        basename="customers",
+        query="SELECT CustomerId, FirstName, LastName FROM Customer",
+        **limits,
+    )
+
+    output = []
+    with pytest.raises(LimitExceeded):
+        output.extend(sql2csv(db_engine, dataset, chunksize=10))
+    assert output
+
+    # The Parquet footer is not written
+    output = []
+    with pytest.raises(LimitExceeded):
+        output.extend(sql2parquet(db_engine, dataset, chunksize=10))
+    assert output
+    with pytest.raises(pa.ArrowInvalid):
+        pq.read_table(BytesIO(b"".join(output)))
+
+
+def test_streamers_statement_timeout(db_engine):
+    """Test streamers enforce datasets statement timeout."""
+    dataset = Dataset(
+        basename="slow",
+        query=SLOW_QUERY.replace("count(*)", "i"),
+        statement_timeout=0.2,
+    )
+    with pytest.raises(StatementTimeout):
+        for _ in sql2csv(db_engine, dataset, chunksize=1000):
+            pass
@@ -0,0 +1,267 @@
+"""Tests for the data7.materialize module."""
+
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pytest
+from pyarrow import parquet as pq
+
+from data7 import streamers
+from data7.materialize import (
+    get_filter_expression,
+    get_materialization_path,
+    get_materialize_ttl,
+    is_fresh,
+    is_materialized,
+    restrict_batches,
+    restrict_schema,
+    scan_materialization,
+    write_materialization,
+)
+from data7.models import Dataset, FilterError
+from data7.streamers import fetch_batches, sql2csv, sql2parquet
+
+SCHEMA = pa.schema(
+    [
+        pa.field("id", pa.int64()),
+        pa.field("country", pa.dictionary(pa.int32(), pa.string())),
+        pa.field("total", pa.float64()),
+    ]
+)
+
+
+@pytest.fixture
+def materialize_dir(tmp_path, configure):
+    """Store materializations in a temporary directory."""
+    configure(MATERIALIZE_DIR=str(tmp_path))
+    yield tmp_path
+
+
+def test_get_materialize_ttl(configure):
+    """Test the get_materialize_ttl and is_materialized functions."""
+    dataset = Dataset(basename="foo", query="SELECT 1")
+    assert get_materialize_ttl(dataset) == 0
+    assert is_materialized(dataset) is False
+
+    configure(MATERIALIZE_TTL=60)
+    assert get_materialize_ttl(dataset) == 60  # noqa: PLR2004
+    # Only filtered or projected requests are served from materializations
+    assert is_materialized(dataset) is False
+    assert is_materialized(dataset.bind({"select": "id"})) is True
+
+    dataset = Dataset(basename="foo", query="SELECT 1", materialize_ttl=0)
+    assert is_materialized(dataset.bind({"select": "id"})) is False
+
+
+def test_get_materialization_path(materialize_dir):
+    """Test the get_materialization_path function."""
+    dataset = Dataset(
+        basename="foo",
+        query="SELECT * FROM Foo WHERE year = :year",
+        parameters=[{"name": "year", "type": "int"}],
+    )
+    path = get_materialization_path(dataset.bind({"year": "2024"}), "pyarrow")
+    assert path.parent == materialize_dir
+    assert path.name.startswith("foo-")
+    assert path.suffix == ".parquet"
+
+    # Selected columns and filters share the same materialization
+    assert path == get_materialization_path(
+        dataset.bind({"year": "2024", "select": "id", "id": "gt.2"}), "pyarrow"
+    )
+    assert path != get_materialization_path(dataset.bind({"year": "2023"}), "pyarrow")
+    assert path != get_materialization_path(
+        dataset.bind({"year": "2024"}), "numpy_nullable"
+    )
+
+
+def test_is_fresh(tmp_path):
+    """Test the is_fresh function."""
+    path = tmp_path / "foo.parquet"
+    assert is_fresh(path, 60) is False
+    path.touch()
+    assert is_fresh(path, 60) is True
+    time.sleep(0.02)
+    assert is_fresh(path, 0.01) is False
+
+
+def test_get_filter_expression():
+    """Test the get_filter_expression function."""
+    dataset = Dataset(basename="foo", query="SELECT 1")
+    assert get_filter_expression(dataset, SCHEMA) is None
+
+    batch = pa.RecordBatch.from_pydict(
+        {"id": [1, 2, 3], "country": ["FR", "US", "FR"], "total": [1.0, 2.5, 3.0]},
+        schema=SCHEMA,
+    )
+    for filters, expected in (
+        ({"id": "eq.2"}, [2]),
+        ({"id": "neq.2"}, [1, 3]),
+        ({"id": "lt.2"}, [1]),
+        ({"id": "lte.2"}, [1, 2]),
+        ({"total": "gt.2"}, [2, 3]),
+        ({"total": "gte.3"}, [3]),
+        ({"id": "in.1,3"}, [1, 3]),
+        ({"country": "eq.FR"}, [1, 3]),
+        ({"country": "in.US"}, [2]),
+        ({"country": "eq.FR", "total": "gt.2"}, [3]),
+    ):
+        expression = get_filter_expression(dataset.bind(filters), SCHEMA)
+        assert batch.filter(expression)["id"].to_pylist() == expected
+
+    with pytest.raises(FilterError, match="Filter column 'foo' does not exist"):
+        get_filter_expression(dataset.bind({"foo": "eq.1"}), SCHEMA)
+
+    with pytest.raises(FilterError, match="Filter 'id' value 'one' is not a valid"):
+        get_filter_expression(dataset.bind({"id": "eq.one"}), SCHEMA)
+
+
+def test_restrict_schema_and_batches():
+    """Test the restrict_schema and restrict_batches functions."""
+    dataset = Dataset(basename="foo", query="SELECT 1")
+    assert restrict_schema(SCHEMA, dataset) is SCHEMA
+    assert restrict_schema(SCHEMA, dataset.bind({"select": "total,id"})).names == [
+        "total",
+        "id",
+    ]
+    with pytest.raises(FilterError, match="Selected column 'foo' does not exist"):
+        restrict_schema(SCHEMA, dataset.bind({"select": "foo"}))
+
+    batches = [
+        pa.RecordBatch.from_pydict(
+            {"id": [1, 2], "country": ["FR", "US"], "total": [1.0, 2.5]},
+            schema=SCHEMA,
+        ),
+        pa.RecordBatch.from_pydict(
+            {"id": [3], "country": ["FR"], "total": [3.0]}, schema=SCHEMA
+        ),
+    ]
+    restricted = list(
+        restrict_batches(batches, dataset.bind({"select": "id", "country": "eq.FR"}))
+    )
+    assert [b.to_pydict() for b in restricted] == [{"id": [1]}, {"id": [3]}]
+
+
+def test_write_and_scan_materialization(tmp_path, configure):
+    """Test materializations are written and scanned with row groups pruning."""
+    configure(MATERIALIZE_ROW_GROUP_SIZE=10)
+    schema = pa.schema([pa.field("id", pa.int64())])
+    path = tmp_path / "foo.parquet"
+    write_materialization(
+        path,
+        schema,
+        (pa.RecordBatch.from_pydict({"id": list(range(i, i + 25))}) for i in (0, 25)),
+    )
+    assert pq.ParquetFile(path).metadata.num_row_groups == 6  # noqa: PLR2004
+    # Temporary files have been removed
+    assert list(tmp_path.iterdir()) == [path]
+
+    dataset = Dataset(basename="foo", query="SELECT 1").bind({"id": "gte.45"})
+    batches = list(scan_materialization(path, dataset, chunksize=100))
+    assert pa.Table.from_batches(batches)["id"].to_pylist() == list(range(45, 50))
+
+    # Row groups statistics prune row groups that cannot match filters
+    (fragment,) = ds.dataset(path).get_fragments()
+    expression = get_filter_expression(dataset, schema)
+    assert len(fragment.split_by_row_group(expression)) == 1
+
+
+def test_restricted_requests(db_engine, materialize_dir, monkeypatch):
+    """Test restricted requests are served from the dataset materialization."""
+    dataset = Dataset(
+        basename="customers",
+        query="SELECT CustomerId, Country FROM Customer",
+        materialize_ttl=60,
+    )
+    values = {"select": "CustomerId", "Country": "eq.France"}
+    total = sum(
+        b.num_rows for b in fetch_batches(db_engine, dataset.bind({}), chunksize=10)
+    )
+
+    csv = "".join(sql2csv(db_engine, dataset.bind(values), chunksize=10))
+    lines = csv.splitlines()
+    assert lines[0] == "CustomerId"
+    assert 1 < len(lines) < total + 1
+    assert len(list(materialize_dir.glob("customers-*.parquet"))) == 1
+
+    # Materialized requests do not hit the database anymore
+    def connect(*args, **kwargs):
+        raise AssertionError("Database should not be queried")
+
+    with monkeypatch.context() as m:
+        m.setattr(streamers, "connect", connect)
+        assert "".join(sql2csv(db_engine, dataset.bind(values), chunksize=10)) == csv
+        table = pq.read_table(
+            pa.BufferReader(
+                b"".join(sql2parquet(db_engine, dataset.bind(values), chunksize=10))
+            )
+        )
+    assert table.column_names == ["CustomerId"]
+    assert table.num_rows == len(lines) - 1
+
+    # Without materialization, query results are filtered
+    dataset.materialize_ttl = 0
+    assert "".join(sql2csv(db_engine, dataset.bind(values), chunksize=10)) == csv
+
+
+@pytest.mark.parametrize("materialize_ttl", [0, 60])
+def test_restricted_requests_csv_with_nulls(
+    db_engine, materialize_dir, materialize_ttl
+):
+    """Test restricted CSV rows are formatted as in the full dataset CSV."""
+    dataset = Dataset(
+        basename="invoices",
+        query=(
+            "SELECT "
+            "InvoiceId as id, "
+            "CASE WHEN InvoiceId % 3 = 0 THEN NULL ELSE CustomerId END as customer, "
+            "CASE WHEN InvoiceId % 4 = 0 THEN NULL ELSE Total END as total "
+            "FROM Invoice "
+            "ORDER BY id"
+        ),
+        materialize_ttl=materialize_ttl,
+    )
+    lines = "".join(sql2csv(db_engine, dataset.bind({}))).splitlines()
+    assert lines[3] == "3,,5.25"
+    assert lines[4] == "4,1.0,"
+
+    csv = "".join(sql2csv(db_engine, dataset.bind({"id": "lt.13"})))
+    assert csv.splitlines() == lines[:13]
+
+
+def test_remove_expired(db_engine, materialize_dir):
+    """Test expired materializations are removed once a materialization is written."""
+    dataset = Dataset(
+        basename="invoices",
+        query="SELECT InvoiceId AS id FROM Invoice WHERE Total > :total",
+        parameters=[{"name": "total", "type": "float"}],
+        materialize_ttl=60,
+    )
+    values = {"select": "id", "id": "lt.10"}
+    now = time.time()
+    paths = {}
+    for total, age in (("1", 30), ("2", 90), ("3", 150)):
+        paths[total] = get_materialization_path(
+            dataset.bind({"total": total}), "pyarrow"
+        )
+        write_materialization(paths[total], SCHEMA, [])
+        os.utime(paths[total], (now - age, now - age))
+    # Other datasets materializations are left untouched
+    other = materialize_dir / f"invoices-foo-{'0' * 16}.parquet"
+    other.touch()
+    os.utime(other, (now - 150, now - 150))
+
+    # Fresh materializations are served as is
+    list(fetch_batches(db_engine, dataset.bind({"total": "1", **values})))
+    assert all(path.exists() for path in paths.values())
+
+    # Materializations expired for longer than their TTL are removed once a
+    # materialization has been refreshed
+    list(fetch_batches(db_engine, dataset.bind({"total": "0", **values})))
+    assert paths["1"].exists()
+    assert paths["2"].exists()
+    assert not paths["3"].exists()
+    assert other.exists()
+    assert len(list(materialize_dir.glob("invoices-*.parquet"))) == 4  # noqa: PLR2004
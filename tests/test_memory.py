@@ -0,0 +1,87 @@
+"""Tests for the data7.memory module."""
+
+import tracemalloc
+
+import pyarrow as pa
+import pytest
+
+from data7.memory import MemoryUsage, current_memory, format_bytes, track
+from data7.timing import measure, timed
+
+
+@pytest.fixture
+def tracing():
+    """Trace Python memory allocations."""
+    tracemalloc.start()
+    yield
+    tracemalloc.stop()
+
+
+def test_format_bytes():
+    """Test the format_bytes function."""
+    assert format_bytes(12) == "12.0B"
+    assert format_bytes(1536) == "1.5KiB"
+    assert format_bytes(3 * 1024**2) == "3.0MiB"
+    assert format_bytes(2 * 1024**3) == "2.0GiB"
+
+
+def test_memory_usage():
+    """Test the MemoryUsage class."""
+    memory = MemoryUsage()
+    assert memory.peak == 0
+    assert memory.to_dict() == {"arrow": 0, "peak": 0}
+
+    memory.add("fetch", 100, memory.arrow_start + 10)
+    memory.add("fetch", 50, memory.arrow_start + 30)
+    memory.add("encode", 2048, memory.arrow_start + 20)
+    assert memory.stages == {"fetch": 100, "encode": 2048}
+    assert memory.arrow == 30  # noqa: PLR2004
+    assert memory.peak == 2048 + 30
+    assert str(memory) == "fetch=100.0B, encode=2.0KiB, arrow=30.0B, peak=2.0KiB"
+    assert memory.to_header() == (
+        "fetch;bytes=100, encode;bytes=2048, arrow;bytes=30, peak;bytes=2078"
+    )
+
+
+def test_track(tracing):
+    """Test the track context manager."""
+    # No active memory usage recorder
+    with track("fetch"):
+        pass
+
+    memory = MemoryUsage()
+    token = current_memory.set(memory)
+    try:
+        with track("fetch"):
+            data = bytearray(1024**2)
+            table = pa.table({"a": pa.array(range(100_000))})
+        del data
+    finally:
+        current_memory.reset(token)
+    assert memory.stages["fetch"] >= 1024**2
+    assert memory.arrow >= table.nbytes
+
+
+def test_track_without_tracing():
+    """Test the track context manager when tracemalloc is not tracing."""
+    memory = MemoryUsage()
+    token = current_memory.set(memory)
+    try:
+        with track("fetch"):
+            bytearray(1024)
+    finally:
+        current_memory.reset(token)
+    assert memory.stages == {}
+
+
+def test_timing_stages(tracing):
+    """Test timing stages track memory without active timings."""
+    memory = MemoryUsage()
+    token = current_memory.set(memory)
+    try:
+        with measure("encode"):
+            bytearray(1024)
+        assert list(timed([bytearray(10)], "fetch")) == [bytearray(10)]
+    finally:
+        current_memory.reset(token)
+    assert list(memory.stages) == ["encode", "fetch"]
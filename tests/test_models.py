@@ -0,0 +1,273 @@
+"""Tests for the data7.models module."""
+
+from dataclasses import FrozenInstanceError
+from datetime import date, datetime
+
+import pytest
+
+from data7.models import (
+    Aggregate,
+    ColumnHint,
+    Config,
+    Dataset,
+    Derivation,
+    Filter,
+    Join,
+    Parameter,
+    parse_bool,
+)
+
+
+def test_parse_bool():
+    """Test the parse_bool function."""
+    for value in ("1", "true", "True", "yes", "on"):
+        assert parse_bool(value) is True
+    for value in ("0", "false", "FALSE", "no", "off"):
+        assert parse_bool(value) is False
+    with pytest.raises(ValueError, match="invalid boolean: 'foo'"):
+        parse_bool("foo")
+
+
+@pytest.mark.parametrize(
+    "type_,value,expected",
+    (
+        ("str", "2024", "2024"),
+        ("int", "2024", 2024),
+        ("float", "20.24", 20.24),
+        ("bool", "true", True),
+        ("date", "2024-01-31", date(2024, 1, 31)),
+        ("datetime", "2024-01-31T12:30:00", datetime(2024, 1, 31, 12, 30)),
+    ),
+)
+def test_parameter_parse(type_, value, expected):
+    """Test the Parameter.parse method."""
+    assert Parameter(name="foo", type=type_).parse(value) == expected
+
+
+def test_parameter_with_invalid_value_or_type():
+    """Test the Parameter model with an invalid value or type."""
+    with pytest.raises(ValueError, match="Parameter 'year' value 'foo' is not a valid"):
+        Parameter(name="year", type="int").parse("foo")
+
+    with pytest.raises(ValueError, match="Parameter 'year' type 'long' is not"):
+        Parameter(name="year", type="long")
+
+
+def test_dataset_bind():
+    """Test the Dataset.bind method."""
+    dataset = Dataset(
+        basename="sales",
+        query="SELECT * FROM Sales WHERE year = :year AND region = :region",
+        parameters=[
+            {"name": "year", "type": "int"},
+            {"name": "region", "default": "EU"},
+        ],
+    )
+    assert dataset.parameters == [
+        Parameter(name="year", type="int"),
+        Parameter(name="region", type="str", default="EU"),
+    ]
+    assert dataset.required_parameters == ["year"]
+    assert dataset.params == {}
+
+    bound = dataset.bind({"year": "2024", "profile": "1"})
+    assert bound.params == {"year": 2024, "region": "EU"}
+    assert bound.parameters == dataset.parameters
+    # The original dataset is left untouched
+    assert dataset.params == {}
+
+    bound = dataset.bind({"year": "2024", "region": "US"})
+    assert bound.params == {"year": 2024, "region": "US"}
+
+    with pytest.raises(ValueError, match="Parameter 'year' is required"):
+        dataset.bind({"region": "US"})
+
+
+def test_column_hint():
+    """Test the ColumnHint model."""
+    assert ColumnHint(name="total", type="float32").dictionary is False
+    with pytest.raises(ValueError, match="Column 'total' type 'decimal' is not"):
+        ColumnHint(name="total", type="decimal")
+
+
+def test_dataset_columns_hints():
+    """Test the Dataset model columns hints."""
+    dataset = Dataset(basename="invoices", query="SELECT * FROM Invoice")
+    assert dataset.has_column_hints is False
+
+    dataset = Dataset(
+        basename="invoices",
+        query="SELECT * FROM Invoice",
+        columns=[{"name": "country", "dictionary": True}],
+    )
+    assert dataset.columns == [ColumnHint(name="country", dictionary=True)]
+    assert dataset.has_column_hints is True
+
+    dataset = Dataset(
+        basename="invoices", query="SELECT * FROM Invoice", large_strings=False
+    )
+    assert dataset.has_column_hints is True
+
+
+def test_filter_parse():
+    """Test the Filter.parse method."""
+    assert Filter.parse("year", "gte.2020") == Filter("year", "gte", "2020")
+    assert Filter.parse("name", "eq.foo.bar") == Filter("name", "eq", "foo.bar")
+    assert Filter.parse("region", "in.EU,US") == Filter("region", "in", "EU,US")
+    assert Filter.parse("profile", "1") is None
+    assert Filter.parse("name", "like.foo") is None
+
+    with pytest.raises(ValueError, match="Filter operator 'like' is not supported"):
+        Filter("name", "like", "foo")
+
+
+def test_dataset_bind_select_and_filters():
+    """Test the Dataset.bind method with selected columns and filters."""
+    dataset = Dataset(
+        basename="sales",
+        query="SELECT * FROM Sales WHERE year = :year",
+        parameters=[{"name": "year", "type": "int", "default": 2024}],
+    )
+    bound = dataset.bind({})
+    assert bound.select == []
+    assert bound.filters == []
+    assert bound.is_restricted is False
+
+    bound = dataset.bind(
+        {"year": "2023", "select": "id,amount", "amount": "gt.10", "profile": "1"}
+    )
+    assert bound.params == {"year": 2023}
+    assert bound.select == ["id", "amount"]
+    assert bound.filters == [Filter("amount", "gt", "10")]
+    assert bound.is_restricted is True
+
+    # Parameters values are not parsed as filters
+    with pytest.raises(ValueError, match="value 'eq.2023' is not a valid int"):
+        dataset.bind({"year": "eq.2023"})
+
+
+def test_dataset_bind_head():
+    """Test the Dataset.bind method with a preview (head) request."""
+    dataset = Dataset(basename="sales", query="SELECT * FROM Sales")
+    assert dataset.bind({}).head is None
+    bound = dataset.bind({"head": "10"})
+    assert bound.head == 10  # noqa: PLR2004
+    # A preview is not a restricted request
+    assert bound.is_restricted is False
+
+    for value in ("0", "-1", "foo", "eq.1"):
+        with pytest.raises(ValueError, match=f"'head' value '{value}' is not a"):
+            dataset.bind({"head": value})
+
+    # Parameters take precedence
+    dataset = Dataset(
+        basename="sales",
+        query="SELECT * FROM Sales WHERE head = :head",
+        parameters=[{"name": "head"}],
+    )
+    bound = dataset.bind({"head": "foo"})
+    assert bound.params == {"head": "foo"}
+    assert bound.head is None
+
+
+def test_dataset_partition():
+    """Test the Dataset.partition method."""
+    dataset = Dataset(
+        basename="customers",
+        query="SELECT * FROM Customer",
+        partition_column="CustomerId",
+        partitions=4,
+    )
+    partition = dataset.partition(1)
+    assert partition.basename == "customers-1-of-4"
+    assert partition.query == (
+        "SELECT * FROM (SELECT * FROM Customer) AS data7_partition "
+        "WHERE ABS(CustomerId % 4) = 1"
+    )
+    assert partition.partitions == 1
+    assert partition.partition_column is None
+
+    with pytest.raises(ValueError, match="partition 4 does not exist"):
+        dataset.partition(4)
+    with pytest.raises(ValueError, match="partitions should be a positive int"):
+        Dataset(basename="customers", query="SELECT 1", partitions=0)
+    with pytest.raises(ValueError, match="partitions require a partition column"):
+        Dataset(basename="customers", query="SELECT 1", partitions=2)
+
+
+def test_derivation():
+    """Test the Derivation model."""
+    dataset = Dataset(
+        basename="countries",
+        derive={
+            "source": "invoices",
+            "join": {"dataset": "customers", "keys": ["customer"]},
+            "filters": {"country": "in.France,Germany", "total": "gt.1"},
+            "group_by": ["country"],
+            "aggregates": [
+                {"column": "total", "function": "sum"},
+                {"column": "id", "function": "count", "name": "invoices"},
+            ],
+        },
+    )
+    assert dataset.is_derived is True
+    assert dataset.derive is not None
+    assert isinstance(dataset.derive, Derivation)
+    assert dataset.derive.join == Join(dataset="customers", keys=["customer"])
+    assert dataset.derive.filters == [
+        Filter("country", "in", "France,Germany"),
+        Filter("total", "gt", "1"),
+    ]
+    assert dataset.derive.aggregates == [
+        Aggregate("total", "sum", "total_sum"),
+        Aggregate("id", "count", "invoices"),
+    ]
+    assert dataset.derive.sources == ["invoices", "customers"]
+    assert Dataset(basename="customers", query="SELECT 1").is_derived is False
+
+    with pytest.raises(ValueError, match="Aggregate function 'median' is not"):
+        Aggregate("total", "median")
+    with pytest.raises(ValueError, match="Join type 'cross' is not supported"):
+        Join("customers", ["customer"], type="cross")
+    with pytest.raises(ValueError, match="Filter 'total' value 'foo' has no"):
+        Derivation("invoices", filters={"total": "foo"})
+
+
+def test_derived_dataset_definition():
+    """Test derived datasets definition checks."""
+    with pytest.raises(ValueError, match="should either define a query or derive"):
+        Dataset(basename="invoices")
+    with pytest.raises(ValueError, match="should either define a query or derive"):
+        Dataset(basename="invoices", query="SELECT 1", derive={"source": "foo"})
+    with pytest.raises(ValueError, match="cannot be parameterized or partitioned"):
+        Dataset(
+            basename="invoices",
+            derive={"source": "foo"},
+            parameters=[{"name": "year"}],
+        )
+    with pytest.raises(ValueError, match="cannot be parameterized or partitioned"):
+        Dataset(
+            basename="invoices",
+            derive={"source": "foo"},
+            partition_column="id",
+            partitions=2,
+        )
+
+
+def test_config():
+    """Test the Config model values checks."""
+    config = Config(chunk_size=10, result_cache_ttl=60, csv_null_value="NA")
+    assert config.result_cache_ttl == 60  # noqa: PLR2004
+    with pytest.raises(FrozenInstanceError):
+        config.chunk_size = 20  # type: ignore[misc]
+
+    for values, match in (
+        ({"chunk_size": "10"}, "'CHUNK_SIZE' value '10' is not a valid int"),
+        ({"max_rows": True}, "'MAX_ROWS' value True is not a valid int"),
+        ({"csv_null_value": 0}, "'CSV_NULL_VALUE' value 0 is not a valid str"),
+        ({"materialize_dir": None}, "'MATERIALIZE_DIR' value None is not a valid"),
+        ({"csv_encoder": "foo"}, "'CSV_ENCODER' value 'foo' is not one of pandas"),
+        ({"chunk_size": 0}, "'CHUNK_SIZE' should be positive"),
+    ):
+        with pytest.raises(ValueError, match=match):
+            Config(**values)
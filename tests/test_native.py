@@ -0,0 +1,128 @@
+"""Tests for the data7.native module."""
+
+import contextlib
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects.postgresql import psycopg
+
+from data7 import native
+from data7.models import Dataset
+from data7.native import (
+    copy_csv_psycopg,
+    get_driver_query,
+    get_native_exporter,
+)
+from data7.streamers import sql2csv
+
+POSTGRESQL_DIALECT = psycopg.dialect()
+
+
+class FakeCursor:
+    """A psycopg cursor copying given rows."""
+
+    def __init__(self, rows):
+        """Create the cursor."""
+        self.rows = rows
+        self.copied = None
+        self.closed = False
+
+    @contextlib.contextmanager
+    def copy(self, statement, params=None):
+        """Copy rows (as memoryviews)."""
+        self.copied = (statement, params)
+        yield (memoryview(row) for row in self.rows)
+
+    def close(self):
+        """Close the cursor."""
+        self.closed = True
+
+
+def get_postgresql_connection(cursor):
+    """Get a fake SQLAlchemy connection using the psycopg dialect."""
+    return SimpleNamespace(
+        dialect=POSTGRESQL_DIALECT,
+        connection=SimpleNamespace(cursor=lambda: cursor),
+    )
+
+
+@pytest.fixture
+def native_export(configure):
+    """Activate native exports."""
+    configure(CSV_NATIVE_EXPORT=True)
+
+
+def test_get_driver_query():
+    """Test the get_driver_query function."""
+    dataset = Dataset(basename="invoices", query="SELECT * FROM Invoice")
+    assert get_driver_query(dataset, POSTGRESQL_DIALECT) == (
+        "SELECT * FROM Invoice",
+        None,
+    )
+
+    dataset = Dataset(
+        basename="invoices",
+        query="SELECT * FROM Invoice WHERE Total > :total AND Country LIKE 'F%'",
+        parameters=[{"name": "total", "type": "float"}],
+    ).bind({"total": "1.5"})
+    query, params = get_driver_query(dataset, POSTGRESQL_DIALECT)
+    assert query == (
+        "SELECT * FROM Invoice WHERE Total > %(total)s AND Country LIKE 'F%%'"
+    )
+    assert params == {"total": 1.5}
+
+
+def test_copy_csv_psycopg(configure):
+    """Test the copy_csv_psycopg function."""
+    configure(OUTPUT_FLUSH_SIZE=8)
+    cursor = FakeCursor([b"id,name\n", b"1,foo\n", b"2,bar\n"])
+    dataset = Dataset(basename="customers", query="SELECT id, name FROM customers")
+
+    chunks = list(copy_csv_psycopg(get_postgresql_connection(cursor), dataset))
+    assert chunks == [b"id,name\n", b"1,foo\n2,bar\n"]
+    assert cursor.copied == (
+        "COPY (SELECT id, name FROM customers) TO STDOUT WITH (FORMAT CSV, HEADER)",
+        None,
+    )
+    assert cursor.closed is True
+
+
+def test_get_native_exporter(db_engine, native_export, configure):
+    """Test the get_native_exporter function."""
+    dataset = Dataset(basename="customers", query="SELECT * FROM Customer")
+    conn = get_postgresql_connection(FakeCursor([]))
+    assert get_native_exporter(conn, dataset) is copy_csv_psycopg
+    # Rows limits are enforced by parsing rows
+    limited = Dataset(basename="customers", query="SELECT 1", max_rows=10)
+    assert get_native_exporter(conn, limited) is None
+    # SQLite has no native exporter
+    with db_engine.connect() as sqlite_conn:
+        assert get_native_exporter(sqlite_conn, dataset) is None
+
+    configure(CSV_NATIVE_EXPORT=False)
+    assert get_native_exporter(conn, dataset) is None
+
+
+def test_sql2csv_native_export(db_engine, native_export, monkeypatch):
+    """Test the sql2csv streamer dispatches to native exporters."""
+    dataset = Dataset(
+        basename="customers",
+        query="SELECT CustomerId as id FROM Customer ORDER BY id LIMIT 2",
+    )
+    expected = "id\n1\n2\n"
+    assert "".join(sql2csv(db_engine, dataset)) == expected
+
+    def export(conn, dataset):
+        yield b"id\n"
+        yield from (
+            f"{row.id}\n".encode() for row in conn.exec_driver_sql(dataset.query)
+        )
+
+    monkeypatch.setitem(native.NATIVE_CSV_EXPORTERS, ("sqlite", "pysqlite"), export)
+    chunks = list(sql2csv(db_engine, dataset))
+    assert all(isinstance(chunk, bytes) for chunk in chunks)
+    assert b"".join(chunks).decode() == expected
+
+    # Previews are encoded by pandas
+    chunks = list(sql2csv(db_engine, dataset.bind({"head": "1"})))
+    assert "".join(chunks) == "id\n1\n"
@@ -0,0 +1,136 @@
+"""Tests for the data7.preview module."""
+
+import pytest
+from sqlalchemy import create_engine
+
+from data7.config import settings
+from data7.databases import DatabaseRouter
+from data7.models import Dataset
+from data7.preview import (
+    capture_sample,
+    capture_samples,
+    clear_samples,
+    get_preview_rows,
+    get_sample,
+)
+
+CUSTOMERS_QUERY = "SELECT CustomerId as id, Country as country FROM Customer"
+
+
+@pytest.fixture(autouse=True)
+def preview_rows(configure):
+    """Sample 10 rows and clear samples after each test."""
+    configure(PREVIEW_ROWS=10)
+    yield 10
+    clear_samples()
+
+
+def test_get_preview_rows(configure):
+    """Test the get_preview_rows function."""
+    assert get_preview_rows() == 10  # noqa: PLR2004
+    configure(PREVIEW_ROWS=0)
+    assert get_preview_rows() == 0
+
+
+def test_capture_sample(db_engine):
+    """Test the capture_sample function."""
+    dataset = Dataset(basename="customers", query=CUSTOMERS_QUERY)
+    sample = capture_sample(db_engine, dataset)
+    assert sample is not None
+    assert sample.table.num_rows == 10  # noqa: PLR2004
+    assert sample.table.column_names == ["id", "country"]
+    assert sample.params == {}
+    assert sample.dtype_backend == settings.DEFAULT_DTYPE_BACKEND
+    assert sample.complete is False
+
+    # Small query results are fully sampled
+    dataset = Dataset(basename="customers", query=f"{CUSTOMERS_QUERY} LIMIT 5")
+    sample = capture_sample(db_engine, dataset)
+    assert sample.table.num_rows == 5  # noqa: PLR2004
+    assert sample.complete is True
+
+    # Parameters defaults are used
+    dataset = Dataset(
+        basename="customers",
+        query=f"{CUSTOMERS_QUERY} WHERE Country = :country",
+        parameters=[{"name": "country", "default": "France"}],
+    )
+    sample = capture_sample(db_engine, dataset)
+    assert sample.params == {"country": "France"}
+    assert set(sample.table["country"].to_pylist()) == {"France"}
+
+    # Datasets with required parameters are not sampled
+    dataset = Dataset(
+        basename="customers",
+        query=f"{CUSTOMERS_QUERY} WHERE Country = :country",
+        parameters=[{"name": "country"}],
+    )
+    assert capture_sample(db_engine, dataset) is None
+
+    # Derived datasets are not sampled
+    dataset = Dataset(basename="countries", derive={"source": "customers"})
+    assert capture_sample(db_engine, dataset) is None
+
+
+def test_get_sample(db_engine):
+    """Test the get_sample function."""
+    dataset = Dataset(
+        basename="customers",
+        query=f"{CUSTOMERS_QUERY} WHERE CustomerId > :id",
+        parameters=[{"name": "id", "type": "int", "default": 0}],
+    )
+    dtype_backend = settings.DEFAULT_DTYPE_BACKEND
+    assert get_sample(dataset.bind({"head": "5"}), dtype_backend) is None
+
+    capture_samples([dataset], db_engine)
+    # Not a head request
+    assert get_sample(dataset.bind({}), dtype_backend) is None
+    table = get_sample(dataset.bind({"head": "5"}), dtype_backend)
+    assert table is not None
+    assert table.num_rows == 10  # noqa: PLR2004
+    assert get_sample(dataset.bind({"head": "10", "id": "0"}), dtype_backend)
+    # Not enough rows
+    assert get_sample(dataset.bind({"head": "11"}), dtype_backend) is None
+    # Other parameters values or dtype backend
+    assert get_sample(dataset.bind({"head": "5", "id": "1"}), dtype_backend) is None
+    assert get_sample(dataset.bind({"head": "5"}), "numpy_nullable") is None
+    # Filtered requests need a complete sample
+    assert (
+        get_sample(dataset.bind({"head": "5", "select": "id"}), dtype_backend) is None
+    )
+
+    dataset.parameters[0].default = 55
+    capture_samples([dataset], db_engine)
+    table = get_sample(dataset.bind({"head": "10", "select": "id"}), dtype_backend)
+    assert table is not None
+    assert table.num_rows == 4  # noqa: PLR2004
+
+
+def test_capture_samples(db_engine, caplog):
+    """Test the capture_samples function."""
+    customers = Dataset(basename="customers", query=CUSTOMERS_QUERY)
+    invalid = Dataset(basename="invalid", query="SELECT * FROM Foo")
+    capture_samples([customers, invalid], db_engine)
+    assert (
+        get_sample(customers.bind({"head": "1"}), settings.DEFAULT_DTYPE_BACKEND)
+        is not None
+    )
+    assert "Failed to capture 'invalid' dataset sample" in caplog.text
+
+    # Samples that cannot be refreshed are kept
+    broken_engine = create_engine("sqlite:////nonexistent/db.sqlite")
+    capture_samples([customers], broken_engine)
+    assert (
+        get_sample(customers.bind({"head": "1"}), settings.DEFAULT_DTYPE_BACKEND)
+        is not None
+    )
+
+    # Samples are read from the dataset database
+    clear_samples()
+    router = DatabaseRouter.from_settings()
+    capture_samples([customers], broken_engine, router)
+    assert (
+        get_sample(customers.bind({"head": "1"}), settings.DEFAULT_DTYPE_BACKEND)
+        is not None
+    )
+    router.dispose()
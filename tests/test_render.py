@@ -0,0 +1,325 @@
+"""Tests for the data7.render module."""
+
+import multiprocessing
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Union
+
+import pytest
+
+from data7.config import settings
+from data7.models import Dataset
+from data7.render import (
+    HOST,
+    RenderAborted,
+    RenderError,
+    acquire,
+    break_lock,
+    evict,
+    get_lock_path,
+    get_partial_path,
+    get_render_cache_ttl,
+    get_render_path,
+    is_stale,
+    read_lock,
+    release,
+    render_cached,
+)
+
+fork = multiprocessing.get_context("fork")
+
+
+def slow_render(counter: Path, chunks: int = 5, delay: float = 0.05):
+    """Get a render function counting its calls in a file."""
+
+    def render():
+        with counter.open("a") as file:
+            file.write(f"{os.getpid()}\n")
+        for index in range(chunks):
+            time.sleep(delay)
+            yield f"chunk-{index};"
+
+    return render
+
+
+def to_bytes(chunks: Iterable[Union[str, bytes]]) -> bytes:
+    """Join streamed chunks as bytes."""
+    return b"".join(c.encode() if isinstance(c, str) else c for c in chunks)
+
+
+def render_in_process(path: Path, counter: Path, output: Path):
+    """Render an output from the render cache and write it to a file."""
+    output.write_bytes(to_bytes(render_cached(path, slow_render(counter), 60)))
+
+
+def join_render(path: Path):
+    """Wait for an output render thread (e.g. evicting other outputs) to end."""
+    for thread in threading.enumerate():
+        if thread.name == f"render-{path.name}":
+            thread.join()
+
+
+def get_dead_pid() -> int:
+    """Get the PID of an exited process."""
+    process = fork.Process(target=lambda: None)
+    process.start()
+    process.join()
+    assert process.pid is not None
+    return process.pid
+
+
+def test_get_render_cache_ttl(configure):
+    """Test the get_render_cache_ttl function."""
+    assert get_render_cache_ttl() == settings.RENDER_CACHE_TTL
+    configure(RENDER_CACHE_TTL=60)
+    assert get_render_cache_ttl() == 60  # noqa: PLR2004
+
+
+def test_get_render_path(tmp_path, configure):
+    """Test the get_render_path function."""
+    configure(RENDER_CACHE_DIR=str(tmp_path))
+    dataset = Dataset(
+        basename="sales",
+        query="SELECT * FROM Sales WHERE year = :year",
+        parameters=[{"name": "year", "type": "int", "default": 2024}],
+    )
+    path = get_render_path(dataset.bind({}), "csv")
+    assert path.parent == tmp_path
+    assert path.name.startswith("sales-")
+    assert path.suffix == ".csv"
+    assert get_render_path(dataset.bind({}), "parquet").stem == path.stem
+    for arguments in (
+        {"year": "2023"},
+        {"select": "id"},
+        {"id": "eq.1"},
+        {"head": "1"},
+    ):
+        assert get_render_path(dataset.bind(arguments), "csv") != path
+
+
+def test_locks(tmp_path):
+    """Test render locks acquisition, release and stale locks detection."""
+    lock = tmp_path / "sales.csv.lock"
+    owner = {"host": HOST, "pid": os.getpid(), "token": "a"}
+    other = {"host": HOST, "pid": os.getpid(), "token": "b"}
+    assert read_lock(lock) is None
+    assert acquire(lock, owner) is True
+    assert acquire(lock, other) is False
+    assert read_lock(lock) == owner
+    assert list(tmp_path.iterdir()) == [lock]
+
+    # Owners on this host are checked given their process
+    assert is_stale(lock, owner, 0) is False
+    assert is_stale(lock, {**owner, "pid": get_dead_pid()}, 60) is True
+    # Other owners given the lock age
+    remote = {"host": "remote", "pid": 1, "token": "c"}
+    assert is_stale(lock, remote, 60) is False
+    os.utime(lock, (time.time() - 120, time.time() - 120))
+    assert is_stale(lock, remote, 60) is True
+
+    release(lock, other)
+    assert read_lock(lock) == owner
+    release(lock, owner)
+    assert read_lock(lock) is None
+
+    # Stale locks are broken if still held by the stale owner
+    path = tmp_path / "sales.csv"
+    assert acquire(get_lock_path(path), other) is True
+    get_partial_path(path, other).touch()
+    break_lock(path, owner)
+    assert read_lock(get_lock_path(path)) == other
+    break_lock(path, other)
+    assert read_lock(get_lock_path(path)) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_render_cached(tmp_path):
+    """Test the render_cached function."""
+    path = tmp_path / "rendered" / "sales.csv"
+    counter = tmp_path / "counter"
+    render = slow_render(counter, delay=0)
+    expected = b"chunk-0;chunk-1;chunk-2;chunk-3;chunk-4;"
+
+    assert b"".join(render_cached(path, render, 60)) == expected
+    assert path.read_bytes() == expected
+    assert counter.read_text().count("\n") == 1
+    assert sorted(p.name for p in path.parent.iterdir()) == ["sales.csv"]
+
+    # Served from the rendered file
+    assert b"".join(render_cached(path, render, 60)) == expected
+    assert counter.read_text().count("\n") == 1
+
+    # Expired
+    os.utime(path, (time.time() - 120, time.time() - 120))
+    assert b"".join(render_cached(path, render, 60)) == expected
+    assert counter.read_text().count("\n") == 2  # noqa: PLR2004
+
+
+def test_evict(tmp_path):
+    """Test the evict function."""
+    now = time.time()
+    for age, name in enumerate(("a.csv", "b.csv", "c.csv", "d.csv")):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 10)
+        os.utime(path, (now - age * 10, now - age * 10))
+    # Locks and partial files are not outputs
+    for name in ("a.csv.lock", "a.csv.lock.token", "a.csv.token.partial"):
+        (tmp_path / name).write_bytes(b"x" * 100)
+        os.utime(tmp_path / name, (now - 100, now - 100))
+    others = ["a.csv.lock", "a.csv.lock.token", "a.csv.token.partial"]
+
+    # Expired outputs are removed
+    evict(tmp_path, 25)
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        ["a.csv", "b.csv", "c.csv", *others]
+    )
+
+    # Least recently rendered outputs are removed to fit
+    evict(tmp_path, 60, max_bytes=25)
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        ["a.csv", "b.csv", *others]
+    )
+
+    # The kept output is never removed
+    evict(tmp_path, 60, max_bytes=5, keep=tmp_path / "b.csv")
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(["b.csv", *others])
+    evict(tmp_path, 0, keep=tmp_path / "b.csv")
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(["b.csv", *others])
+
+
+def test_render_cached_evicts(tmp_path):
+    """Test the render_cached function evicts other outputs once rendered."""
+    root = tmp_path / "rendered"
+    root.mkdir()
+    expired = root / "expired.csv"
+    expired.write_bytes(b"expired")
+    os.utime(expired, (time.time() - 120, time.time() - 120))
+    fresh = root / "fresh.csv"
+    fresh.write_bytes(b"x" * 100)
+    path = root / "sales.csv"
+    render = slow_render(tmp_path / "counter", delay=0)
+
+    to_bytes(render_cached(path, render, 60))
+    join_render(path)
+    assert sorted(p.name for p in root.iterdir()) == ["fresh.csv", "sales.csv"]
+
+    os.utime(path, (time.time() - 120, time.time() - 120))
+    to_bytes(render_cached(path, render, 60, max_bytes=100))
+    join_render(path)
+    assert sorted(p.name for p in root.iterdir()) == ["sales.csv"]
+
+
+def test_render_cached_single_flight(tmp_path):
+    """Test that concurrent requests share a single render."""
+    path = tmp_path / "sales.csv"
+    counter = tmp_path / "counter"
+    outputs = []
+
+    def request():
+        outputs.append(b"".join(render_cached(path, slow_render(counter), 60)))
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.read_text().count("\n") == 1
+    assert outputs == [b"chunk-0;chunk-1;chunk-2;chunk-3;chunk-4;"] * 4
+
+
+def test_render_cached_across_processes(tmp_path):
+    """Test that concurrent processes share a single render."""
+    path = tmp_path / "sales.csv"
+    counter = tmp_path / "counter"
+    processes = [
+        fork.Process(
+            target=render_in_process, args=(path, counter, tmp_path / f"{i}.out")
+        )
+        for i in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert counter.read_text().count("\n") == 1
+    for i in range(4):
+        assert (tmp_path / f"{i}.out").read_bytes() == path.read_bytes()
+
+
+def test_render_cached_with_stale_lock(tmp_path):
+    """Test that stale locks of crashed owners are taken over."""
+    path = tmp_path / "sales.csv"
+    counter = tmp_path / "counter"
+    owner = {"host": HOST, "pid": get_dead_pid(), "token": "crashed"}
+    acquire(get_lock_path(path), owner)
+    get_partial_path(path, owner).write_bytes(b"chunk-0;")
+
+    assert b"".join(render_cached(path, slow_render(counter, delay=0), 60)) == (
+        b"chunk-0;chunk-1;chunk-2;chunk-3;chunk-4;"
+    )
+    assert counter.read_text().count("\n") == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["counter", "sales.csv"]
+
+
+def test_render_cached_with_crashed_owner(tmp_path):
+    """Test following a render whose owner crashes."""
+    path = tmp_path / "sales.csv"
+    started = fork.Event()
+    crash = fork.Event()
+
+    def owner():
+        def render():
+            yield b"chunk-0;"
+            started.set()
+            crash.wait(10)
+            os._exit(1)
+
+        list(render_cached(path, render, 60))
+
+    process = fork.Process(target=owner)
+    process.start()
+    assert started.wait(10)
+
+    chunks = render_cached(path, slow_render(tmp_path / "counter"), 60)
+    assert next(chunks) == b"chunk-0;"
+    crash.set()
+    process.join()
+    with pytest.raises(RenderAborted, match="aborted \\(owner crashed\\)"):
+        next(chunks)
+
+    # The next request takes the render over
+    assert b"".join(render_cached(path, slow_render(tmp_path / "counter"), 60)) == (
+        b"chunk-0;chunk-1;chunk-2;chunk-3;chunk-4;"
+    )
+
+
+def test_render_cached_with_failing_render(tmp_path):
+    """Test that failed renders are not cached and raise their error."""
+    path = tmp_path / "sales.csv"
+
+    def render():
+        raise ValueError("Render failed")
+        yield b"chunk-0;"  # pragma: no cover
+
+    # Nothing has been streamed: the request renders the output itself
+    with pytest.raises(ValueError, match="Render failed"):
+        b"".join(render_cached(path, render, 60))
+    assert list(tmp_path.iterdir()) == []
+
+    # Something has been streamed
+    failure = threading.Event()
+
+    def failing_render():
+        yield b"chunk-0;"
+        failure.wait(10)
+        raise ValueError("Render failed")
+
+    chunks = render_cached(path, failing_render, 60)
+    assert next(chunks) == b"chunk-0;"
+    failure.set()
+    with pytest.raises(RenderError, match="aborted \\(render failed\\)"):
+        next(chunks)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,66 @@
+"""Tests for the data7.server module."""
+
+import socket
+
+import pytest
+import uvicorn
+
+from data7 import server
+from data7.app import app, router
+
+
+def test_preload():
+    """Test the preload function."""
+    try:
+        server.preload()
+        assert app.state.preloaded is True
+        assert len(app.state.datasets)
+        # Validation connections are not shared with forked workers
+        assert router.get_engine().pool.checkedin() == 0
+    finally:
+        app.state.preloaded = False
+
+
+def test_bind_reuse_port_socket():
+    """Test the bind_reuse_port_socket function."""
+    first = server.bind_reuse_port_socket("127.0.0.1", 0)
+    port = first.getsockname()[1]
+    second = server.bind_reuse_port_socket("127.0.0.1", port)
+    try:
+        assert second.getsockname()[1] == port
+    finally:
+        first.close()
+        second.close()
+
+
+async def failing_app(scope, receive, send):
+    """An ASGI application failing to start."""
+    message = await receive()
+    assert message["type"] == "lifespan.startup"
+    await send({"type": "lifespan.startup.failed", "message": "boom"})
+
+
+@pytest.mark.parametrize("reuse_port", [False, True])
+def test_serve_startup_failure(reuse_port):
+    """Test the serve function when workers fail to start."""
+    config = uvicorn.Config(
+        failing_app, host="127.0.0.1", port=0, lifespan="on", log_config=None
+    )
+    with pytest.raises(SystemExit) as exc_info:
+        server.serve(config, workers=2, reuse_port=reuse_port)
+    assert exc_info.value.code == server.STARTUP_FAILURE
+
+
+def test_run_worker(monkeypatch):
+    """Test the run_worker function."""
+    handlers = {}
+    monkeypatch.setattr(
+        server.signal, "signal", lambda sig, handler: handlers.update({sig: handler})
+    )
+    monkeypatch.setattr(uvicorn.Server, "run", lambda self, sockets: None)
+    sock = socket.socket()
+    try:
+        assert server.run_worker(uvicorn.Config(failing_app), sock) == 0
+    finally:
+        sock.close()
+    assert set(handlers.values()) == {server.signal.SIG_DFL}
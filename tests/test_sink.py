@@ -0,0 +1,112 @@
+"""Tests for the data7.sink module."""
+
+import pyarrow as pa
+from pyarrow import csv as pcsv
+
+from data7.config import settings
+from data7.sink import OutputSink, get_flush_size
+
+
+def test_get_flush_size(configure):
+    """Test the get_flush_size function."""
+    assert get_flush_size() == settings.OUTPUT_FLUSH_SIZE
+    configure(OUTPUT_FLUSH_SIZE=1024)
+    assert get_flush_size() == 1024  # noqa: PLR2004
+
+
+def test_output_sink():
+    """Test the OutputSink class."""
+    sink = OutputSink()
+    assert sink.writable() is True
+    assert sink.seekable() is False
+    assert sink.pop() == b""
+
+    data = b"foo"
+    assert sink.write(data) == len(data)
+    assert sink.write(b"") == 0
+    # A single kept buffer is not copied
+    assert sink.pop() is data
+    assert sink.pending == 0
+
+    sink.write(b"foo")
+    sink.write(memoryview(b"bar"))
+    assert sink.pending == 6  # noqa: PLR2004
+    assert sink.pop() == b"foobar"
+    assert sink.pop() == b""
+
+
+def test_output_sink_copies_reused_buffers():
+    """Test the OutputSink class with buffers reused by writers."""
+    sink = OutputSink(flush_size=10)
+    buffer = bytearray(b"foo")
+    sink.write(buffer)
+    buffer[:] = b"bar"
+    sink.write(pa.py_buffer(buffer))
+    assert sink.pop(final=True) == b"foobar"
+
+
+def test_output_sink_flush_size():
+    """Test the OutputSink class flush size."""
+    sink = OutputSink(flush_size=6)
+    sink.write(b"foo")
+    assert sink.pop() == b""
+    assert sink.pending == 3  # noqa: PLR2004
+    sink.write(b"bar")
+    sink.write(b"baz")
+    assert sink.pop() == b"foobarbaz"
+
+    sink.write(b"foo")
+    assert sink.pop(final=True) == b"foo"
+    assert sink.pop(final=True) == b""
+
+
+def test_output_sink_stream():
+    """Test the OutputSink class Arrow output stream."""
+    sink = OutputSink(flush_size=6)
+    stream = sink.open_stream()
+    assert sink.open_stream() is stream
+
+    # Writes are buffered until they do not fit in the flush size
+    stream.write(b"fo")
+    stream.write(b"bar")
+    assert sink.drain() == []
+    stream.write(b"baz")
+    assert sink.drain() == [b"fobar"]
+    # Larger writes are written as is
+    stream.write(b"0123456789")
+    assert sink.drain() == [b"baz", b"0123456789"]
+    stream.write(b"foo")
+    assert sink.drain(final=True) == [b"foo"]
+    assert sink.drain(final=True) == []
+
+
+def test_output_sink_stream_not_coalesced():
+    """Test the OutputSink class Arrow output stream without flush size."""
+    sink = OutputSink()
+    stream = sink.open_stream()
+    stream.write(b"foo")
+    stream.write(b"bar")
+    chunks = sink.drain()
+    assert chunks == [b"foobar"]
+    assert type(chunks[0]) is bytes
+
+
+def test_output_sink_stream_with_reused_buffers():
+    """Test the OutputSink class Arrow stream with buffers reused by writers."""
+    table = pa.table({"id": range(3000)})
+    expected = "".join(f"{i}\n" for i in ['"id"', *range(3000)]).encode()
+
+    for flush_size in (0, 1024):
+        sink = OutputSink(flush_size)
+        writer = pcsv.CSVWriter(
+            sink.open_stream(),
+            table.schema,
+            write_options=pcsv.WriteOptions(quoting_style="none"),
+        )
+        chunks = []
+        for batch in table.to_batches(max_chunksize=100):
+            writer.write_batch(batch)
+            chunks += sink.drain()
+        writer.close()
+        chunks += sink.drain(final=True)
+        assert b"".join(chunks) == expected
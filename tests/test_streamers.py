@@ -1,10 +1,38 @@
 """Tests for the data7.streamers module."""
 
+import tracemalloc
+from dataclasses import replace
+from itertools import pairwise
+
+import pandas as pd
 import pyarrow as pa
+import pytest
 from pyarrow import parquet
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
 
-from data7.models import Dataset
-from data7.streamers import sql2csv, sql2parquet
+from data7.cache import get_result_cache
+from data7.config import settings
+from data7.formats import formats
+from data7.models import (
+    Aggregate,
+    ColumnHint,
+    Dataset,
+    Derivation,
+    Filter,
+    FilterError,
+    Parameter,
+)
+from data7.preview import capture_samples, clear_samples
+from data7.streamers import (
+    apply_column_hints,
+    fetch_batches,
+    get_hinted_schema,
+    sql2csv,
+    sql2csv_arrow,
+    sql2parquet,
+    take_rows,
+)
 
 
 def test_sql2csv(db_engine):
@@ -57,3 +85,585 @@ def test_sql2parquet(db_engine):
         assert str(table["last_name"][-1]) == "Zimmermann"
         assert str(table["first_name"][-1]) == "Fynn"
         assert str(table["company"][-1]) == "None"
+
+
+def test_sql2csv_with_arrow_encoder(db_engine, configure):
+    """Test sql2csv function using the arrow encoder."""
+    dataset = Dataset(
+        basename="customers",
+        query=(
+            "SELECT "
+            "LastName as last_name, "
+            "FirstName as first_name, "
+            "Company as company "
+            "FROM Customer "
+            "ORDER BY last_name, first_name"
+        ),
+    )
+    configure(CSV_ENCODER="arrow")
+
+    n_customers = 59
+    output = b"".join(sql2csv(db_engine, dataset, chunksize=10)).decode()
+    lines = list(filter(len, output.split("\n")))
+    assert len(lines) == n_customers + 1
+    assert lines[0] == '"last_name","first_name","company"'
+    assert lines[1] == '"Almeida","Roberto","Riotur"'
+    assert lines[-1] == '"Zimmermann","Fynn",'
+
+
+@pytest.mark.parametrize(
+    "options,expected",
+    (
+        ({}, ['"id","date","total","none"', '1,"2021-03-03 00:00:00",3.52,']),
+        (
+            {"CSV_DELIMITER": ";", "CSV_QUOTING_STYLE": "none"},
+            ["id;date;total;none", "1;2021-03-03 00:00:00;3.52;"],
+        ),
+        (
+            {"CSV_NULL_VALUE": "NA", "CSV_FLOAT_PRECISION": 1},
+            ['"id","date","total","none"', '"1","2021-03-03 00:00:00","3.5","NA"'],
+        ),
+        (
+            {"CSV_QUOTING_STYLE": "all_valid", "CSV_FLOAT_PRECISION": 0},
+            ['"id","date","total","none"', '"1","2021-03-03 00:00:00","4",'],
+        ),
+    ),
+)
+def test_sql2csv_arrow_options(db_engine, configure, options, expected):
+    """Test sql2csv_arrow function formatting options."""
+    dataset = Dataset(
+        basename="invoices",
+        query=(
+            "SELECT "
+            "InvoiceId as id, "
+            "InvoiceDate as date, "
+            "3.52 as total, "
+            "NULL as none "
+            "FROM Invoice "
+            "ORDER BY id "
+            "LIMIT 3"
+        ),
+    )
+    configure(**options)
+
+    output = b"".join(sql2csv_arrow(db_engine, dataset, chunksize=2)).decode()
+    assert output.splitlines()[:2] == expected
+    assert len(output.splitlines()) == 3 + 1
+
+
+def test_sql2csv_arrow_with_chunks_types(db_engine):
+    """Test sql2csv_arrow function when chunks types differ."""
+    dataset = Dataset(
+        basename="values",
+        query=(
+            "SELECT 1 AS value, NULL AS none "
+            "UNION ALL SELECT 2, NULL "
+            "UNION ALL SELECT 2.75, 'foo' "
+            "UNION ALL SELECT 3.5, NULL"
+        ),
+    )
+    # Integers (and nulls) in the first chunk, floats (and strings) in the next one
+    output = b"".join(sql2csv_arrow(db_engine, dataset, chunksize=2)).decode()
+    assert output.splitlines() == ['"value","none"', "1,", "2,", '2.75,"foo"', "3.5,"]
+
+
+def test_sql2csv_arrow_timestamp_format(db_engine, monkeypatch, configure):
+    """Test sql2csv_arrow function timestamp formatting."""
+    dataset = Dataset(
+        basename="invoices",
+        query="SELECT InvoiceId as id FROM Invoice ORDER BY id LIMIT 3",
+    )
+    configure(CSV_TIMESTAMP_FORMAT="%Y")
+    monkeypatch.setattr(
+        "data7.streamers.pd.read_sql_query",
+        lambda *args, **kwargs: iter(
+            [pd.DataFrame({"date": pd.to_datetime(["2021-03-03", None])})]
+        ),
+    )
+    output = b"".join(sql2csv_arrow(db_engine, dataset)).decode()
+    assert output.splitlines() == ['"date"', '"2021"', ""]
+
+
+def test_sql2csv_arrow_with_empty_result(db_engine):
+    """Test sql2csv_arrow function when the query returns no result."""
+    dataset = Dataset(
+        basename="invoices",
+        query="SELECT InvoiceId as id FROM Invoice WHERE id < 0",
+    )
+    assert b"".join(sql2csv_arrow(db_engine, dataset)) == b'"id"\n'
+    assert "".join(sql2csv(db_engine, dataset)) == "id\n"
+
+
+@pytest.fixture
+def result_cache(monkeypatch, configure):
+    """Activate the result cache."""
+    get_result_cache.cache_clear()
+    monkeypatch.setattr(settings, "RESULT_CACHE_MAX_BYTES", 10_000_000, raising=False)
+    configure(RESULT_CACHE_TTL=60)
+    yield get_result_cache()
+    get_result_cache.cache_clear()
+
+
+def test_fetch_batches_with_result_cache(db_engine, result_cache):
+    """Test fetch_batches function with the result cache."""
+    dataset = Dataset(
+        basename="invoices",
+        query="SELECT InvoiceId as id, Total as total FROM Invoice ORDER BY id",
+    )
+    n_invoices = 412
+
+    # Miss
+    batches = list(fetch_batches(db_engine, dataset, chunksize=100))
+    assert sum(b.num_rows for b in batches) == n_invoices
+    assert result_cache.stats.misses == 1
+    assert result_cache.stats.entries == 1
+
+    # Hit: no database connection needed
+    batches = list(fetch_batches(None, dataset, chunksize=100))
+    assert [b.num_rows for b in batches] == [100, 100, 100, 100, 12]
+    assert batches[0].column("id").to_pylist()[:2] == [1, 2]
+    assert result_cache.stats.hits == 1
+
+    # Not cached for this dataset
+    dataset.cache_ttl = 0
+    list(fetch_batches(db_engine, dataset, chunksize=100))
+    assert result_cache.stats.hits == 1
+    assert result_cache.stats.misses == 1
+
+
+def test_fetch_batches_larger_than_result_cache(db_engine, result_cache):
+    """Test fetch_batches function when the result does not fit in the cache."""
+    dataset = Dataset(
+        basename="invoices",
+        query="SELECT InvoiceId as id, Total as total FROM Invoice ORDER BY id",
+    )
+    result_cache.max_bytes = 1000
+    assert len(list(fetch_batches(db_engine, dataset, chunksize=10))) > 1
+    assert result_cache.stats.entries == 0
+
+
+def test_streamers_share_result_cache(db_engine, result_cache):
+    """Test that CSV and Parquet streamers share cached results."""
+    dataset = Dataset(
+        basename="customers",
+        query=(
+            "SELECT "
+            "CustomerId as id, "
+            "LastName as last_name, "
+            "Company as company "
+            "FROM Customer "
+            "ORDER BY last_name"
+        ),
+        indexes=["id"],
+    )
+    n_customers = 59
+
+    cached_csv = "".join(sql2csv(db_engine, dataset, chunksize=10))
+    assert result_cache.stats.misses == 1
+
+    # Rendered from the cache
+    with pa.BufferReader(
+        b"".join(sql2parquet(db_engine, dataset, chunksize=10))
+    ) as stream:
+        table = parquet.ParquetFile(stream).read()
+        assert table.num_rows == n_customers
+        assert table.schema.pandas_metadata["index_columns"] == ["id"]
+        assert str(table["last_name"][0]) == "Almeida"
+    assert result_cache.stats.hits == 1
+    assert result_cache.stats.misses == 1
+
+    # CSV output is the same with or without cache
+    dataset.cache_ttl = 0
+    assert "".join(sql2csv(db_engine, dataset, chunksize=10)) == cached_csv
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        (
+            "SELECT "
+            "InvoiceId as id, "
+            "CASE WHEN InvoiceId % 3 = 0 THEN NULL ELSE CustomerId END as customer, "
+            "CASE WHEN InvoiceId % 4 = 0 THEN NULL ELSE Total END as total "
+            "FROM Invoice "
+            "ORDER BY id"
+        ),
+        "SELECT InvoiceId as id FROM Invoice WHERE InvoiceId < 0",
+    ],
+)
+def test_sql2csv_with_result_cache_nulls(db_engine, result_cache, query):
+    """Test that cached CSV output is the same as the query result output."""
+    dataset = Dataset(basename="invoices", query=query)
+
+    direct = "".join(sql2csv(db_engine, replace(dataset, cache_ttl=0), chunksize=10))
+    assert "".join(sql2csv(db_engine, dataset, chunksize=10)) == direct
+    assert result_cache.stats.misses == 1
+
+    # Rendered from the cache
+    assert "".join(sql2csv(db_engine, dataset, chunksize=10)) == direct
+    assert result_cache.stats.hits == 1
+
+
+def test_fetch_batches_with_parameters(db_engine, result_cache):
+    """Test fetch_batches function for a parameterized dataset."""
+    dataset = Dataset(
+        basename="customers",
+        query="SELECT Country as country FROM Customer WHERE Country = :country",
+        parameters=[{"name": "country"}],
+    )
+
+    france = dataset.bind({"country": "France"})
+    batches = list(fetch_batches(db_engine, france))
+    assert set(batches[0].column("country").to_pylist()) == {"France"}
+
+    # Results are cached per parameters values
+    usa = dataset.bind({"country": "USA"})
+    batches = list(fetch_batches(db_engine, usa))
+    assert set(batches[0].column("country").to_pylist()) == {"USA"}
+    assert result_cache.stats.misses == 2  # noqa: PLR2004
+    assert result_cache.stats.entries == 2  # noqa: PLR2004
+
+    batches = list(fetch_batches(None, france))
+    assert set(batches[0].column("country").to_pylist()) == {"France"}
+    assert result_cache.stats.hits == 1
+
+
+def test_get_hinted_schema():
+    """Test the get_hinted_schema function."""
+    schema = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("country", pa.large_string()),
+            ("city", pa.large_string()),
+            ("total", pa.float64()),
+        ],
+        metadata={"foo": "bar"},
+    )
+    dataset = Dataset(basename="invoices", query="SELECT 1")
+    assert get_hinted_schema(schema, dataset) == schema
+
+    dataset.columns = [
+        ColumnHint(name="id", type="int32"),
+        ColumnHint(name="country", dictionary=True),
+        ColumnHint(name="total", type="float32"),
+        ColumnHint(name="unknown", type="int8"),
+    ]
+    dataset.large_strings = False
+    hinted = get_hinted_schema(schema, dataset)
+    assert hinted.types == [
+        pa.int32(),
+        pa.dictionary(pa.int32(), pa.string()),
+        pa.string(),
+        pa.float32(),
+    ]
+    assert hinted.metadata == {b"foo": b"bar"}
+
+
+def test_apply_column_hints():
+    """Test the apply_column_hints function."""
+    batch = pa.record_batch({"id": [1, 2, 300], "status": ["ok", "ko", "ok"]})
+    dataset = Dataset(basename="orders", query="SELECT 1")
+    assert apply_column_hints(batch, dataset) is batch
+
+    dataset.columns = [
+        ColumnHint(name="id", type="int16"),
+        ColumnHint(name="status", dictionary=True),
+    ]
+    hinted = apply_column_hints(batch, dataset)
+    assert hinted.column("id").type == pa.int16()
+    assert hinted.column("status").dictionary.to_pylist() == ["ok", "ko"]
+    assert hinted.nbytes < batch.nbytes
+
+    # Values should fit in the target type
+    dataset.columns = [ColumnHint(name="id", type="int8")]
+    with pytest.raises(pa.ArrowInvalid):
+        apply_column_hints(batch, dataset)
+
+
+def test_streamers_with_column_hints(db_engine, result_cache):
+    """Test streamers for a dataset with columns hints."""
+    dataset = Dataset(
+        basename="invoices",
+        query=(
+            "SELECT InvoiceId as id, CustomerId as customer, Total as total "
+            "FROM Invoice ORDER BY id"
+        ),
+        indexes=["id"],
+        columns=[
+            {"name": "id", "type": "int32"},
+            {"name": "customer", "type": "int16", "dictionary": True},
+            {"name": "total", "type": "float32"},
+        ],
+    )
+
+    with pa.BufferReader(
+        b"".join(sql2parquet(db_engine, dataset, chunksize=100))
+    ) as stream:
+        table = parquet.ParquetFile(stream).read()
+    assert table.schema.field("id").type == pa.int32()
+    # Parquet columns are dictionary encoded, numeric values are read as is
+    assert table.schema.field("customer").type == pa.int16()
+    assert table.schema.field("total").type == pa.float32()
+    assert table.to_pandas()["total"].dtype == "float32"
+
+    # Hinted batches are cached
+    cached = result_cache.peek(("invoices", (), settings.DEFAULT_DTYPE_BACKEND))
+    assert cached.schema.field("total").type == pa.float32()
+
+    # CSV output is not altered
+    csv = "".join(sql2csv(db_engine, dataset, chunksize=100))
+    dataset.columns = []
+    dataset.cache_ttl = 0
+    assert "".join(sql2csv(db_engine, dataset, chunksize=100)) == csv
+
+
+@pytest.fixture
+def samples(configure):
+    """Activate datasets head samples."""
+    configure(PREVIEW_ROWS=20)
+    yield
+    clear_samples()
+
+
+def test_take_rows():
+    """Test the take_rows function."""
+    consumed = []
+
+    def batches():
+        for i in range(3):
+            consumed.append(i)
+            yield pa.RecordBatch.from_pydict({"a": [i] * 5})
+
+    assert sum(b.num_rows for b in take_rows(batches(), 7)) == 7  # noqa: PLR2004
+    assert consumed == [0, 1]
+
+    consumed.clear()
+    assert sum(b.num_rows for b in take_rows(batches(), 5)) == 5  # noqa: PLR2004
+    assert consumed == [0]
+
+    assert sum(b.num_rows for b in take_rows(batches(), 100)) == 15  # noqa: PLR2004
+
+
+def test_fetch_batches_head(db_engine):
+    """Test fetch_batches function for head requests without sample."""
+    dataset = Dataset(
+        basename="customers",
+        query="SELECT CustomerId as id, Country as country FROM Customer",
+    )
+    batches = list(fetch_batches(db_engine, dataset.bind({"head": "15"}), 10))
+    assert [b.num_rows for b in batches] == [10, 5]
+    assert pa.Table.from_batches(batches)["id"].to_pylist() == list(range(1, 16))
+
+    # Filters apply before rows are taken
+    batches = list(
+        fetch_batches(db_engine, dataset.bind({"head": "2", "country": "eq.France"}))
+    )
+    table = pa.Table.from_batches(batches)
+    assert table["country"].to_pylist() == ["France", "France"]
+
+
+def test_fetch_batches_with_invalid_restrictions(db_engine):
+    """Test fetch_batches releases its connection if restrictions are invalid."""
+    dataset = Dataset(
+        basename="customers", query="SELECT CustomerId as id FROM Customer"
+    )
+    for arguments in ({"select": "foo"}, {"id": "gt.foo"}):
+        with pytest.raises(FilterError) as excinfo:
+            list(fetch_batches(db_engine, dataset.bind(arguments), 10))
+        # Even if the error traceback (and its frames) is kept
+        assert excinfo.traceback
+        assert db_engine.pool.checkedout() == 0
+
+
+def test_streamers_head_from_sample(db_engine, samples):
+    """Test streamers serve head requests from datasets samples."""
+    dataset = Dataset(
+        basename="customers",
+        query="SELECT CustomerId as id, Country as country FROM Customer",
+        columns=[{"name": "id", "type": "int16"}],
+    )
+    capture_samples([dataset], db_engine)
+    # Samples are served without hitting the database
+    broken_engine = create_engine("sqlite:////nonexistent/db.sqlite")
+    bound = dataset.bind({"head": "5"})
+
+    batches = list(fetch_batches(broken_engine, bound, chunksize=2))
+    assert [b.num_rows for b in batches] == [2, 2, 1]
+    assert batches[0].schema.field("id").type == pa.int16()
+
+    csv = "".join(sql2csv(broken_engine, bound))
+    assert (
+        csv.splitlines()
+        == ["id,country"]
+        + "".join(sql2csv(db_engine, dataset, chunksize=5)).splitlines()[1:6]
+    )
+
+    table = parquet.read_table(
+        pa.BufferReader(b"".join(sql2parquet(broken_engine, bound)))
+    )
+    assert table.num_rows == 5  # noqa: PLR2004
+    assert table.schema.field("id").type == pa.int16()
+
+    csv = b"".join(sql2csv_arrow(broken_engine, bound)).decode()
+    assert len(csv.splitlines()) == 6  # noqa: PLR2004
+
+    # Larger heads are fetched from the database
+    with pytest.raises(OperationalError):
+        list(fetch_batches(broken_engine, dataset.bind({"head": "21"})))
+    table = pa.Table.from_batches(
+        fetch_batches(db_engine, dataset.bind({"head": "21"}))
+    )
+    assert table.num_rows == 21  # noqa: PLR2004
+
+
+@pytest.mark.parametrize("sampled", [False, True])
+def test_sql2csv_head_with_nulls(db_engine, samples, sampled):
+    """Test CSV previews are the first lines of the full dataset CSV."""
+    dataset = Dataset(
+        basename="invoices",
+        query=(
+            "SELECT "
+            "InvoiceId as id, "
+            "CASE WHEN InvoiceId % 3 = 0 THEN NULL ELSE CustomerId END as customer, "
+            "CASE WHEN InvoiceId % 4 = 0 THEN NULL ELSE Total END as total "
+            "FROM Invoice "
+            "ORDER BY id"
+        ),
+    )
+    if sampled:
+        capture_samples([dataset], db_engine)
+    lines = "".join(sql2csv(db_engine, dataset)).splitlines()
+    assert lines[4] == "4,1.0,"
+
+    csv = "".join(sql2csv(db_engine, dataset.bind({"head": "12"})))
+    assert csv.splitlines() == lines[:13]
+
+
+# Memory regression tests
+NUMBERS_QUERY = (
+    "WITH RECURSIVE n(i) AS "
+    "(SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rows) "
+    "SELECT i AS id, 'label ' || i AS label, i * 1.5 AS value FROM n"
+)
+# Streaming many chunks peak memory should not exceed this multiple of one chunk
+MEMORY_CHUNKS_RATIO = 3
+
+
+def get_streaming_peak_memory(engine, streamer, rows: int, chunksize: int) -> int:
+    """Get peak memory (Python and Arrow) used to stream a numbers dataset."""
+    dataset = Dataset(
+        basename="numbers",
+        query=NUMBERS_QUERY,
+        parameters=[Parameter(name="rows", type="int")],
+    ).bind({"rows": str(rows)})
+    arrow_start = pa.total_allocated_bytes()
+    arrow = 0
+    tracemalloc.start()
+    try:
+        for _ in streamer(engine, dataset, chunksize=chunksize):
+            arrow = max(arrow, pa.total_allocated_bytes() - arrow_start)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak + arrow
+
+
+@pytest.mark.parametrize("csv_encoder", ["pandas", "arrow"])
+@pytest.mark.parametrize("extension", formats.extensions)
+def test_streamers_memory(db_engine, extension, csv_encoder, configure):
+    """Test streaming N rows peak memory is bounded by a multiple of one chunk."""
+    configure(CSV_ENCODER=csv_encoder)
+    streamer = formats.get(extension).streamer
+    chunksize = 1000
+
+    # Warm up (imports, caches)
+    get_streaming_peak_memory(db_engine, streamer, chunksize, chunksize)
+
+    one_chunk = get_streaming_peak_memory(db_engine, streamer, chunksize, chunksize)
+    many_chunks = get_streaming_peak_memory(
+        db_engine, streamer, 50 * chunksize, chunksize
+    )
+    assert many_chunks < MEMORY_CHUNKS_RATIO * one_chunk
+
+
+@pytest.mark.parametrize("streamer", [sql2parquet, sql2csv_arrow])
+def test_streamers_output_flush_size(db_engine, streamer, configure):
+    """Test streamers output chunks are coalesced up to the output flush size."""
+    dataset = Dataset(
+        basename="numbers",
+        query=NUMBERS_QUERY,
+        parameters=[Parameter(name="rows", type="int")],
+    ).bind({"rows": "10000"})
+
+    configure(OUTPUT_FLUSH_SIZE=0)
+    chunks = list(streamer(db_engine, dataset, chunksize=100))
+
+    flush_size = 16 * 1024
+    configure(OUTPUT_FLUSH_SIZE=flush_size)
+    coalesced = list(streamer(db_engine, dataset, chunksize=100))
+    assert b"".join(coalesced) == b"".join(chunks)
+    assert len(coalesced) < len(chunks)
+    # A chunk is handed out once the next write does not fit in the flush size
+    assert all(len(a) + len(b) >= flush_size for a, b in pairwise(coalesced))
+
+
+def test_streamers_with_derived_dataset(db_engine, result_cache):
+    """Test streamers with a derived dataset (sources query results are cached)."""
+    customers = Dataset(
+        basename="customers",
+        query="SELECT CustomerId as id, Country as country FROM Customer",
+    )
+    dataset = Dataset(
+        basename="countries",
+        derive=Derivation(
+            source="customers",
+            filters=[Filter("country", "in", "France,Canada")],
+            group_by=["country"],
+            aggregates=[Aggregate("id", "count", "customers")],
+        ),
+        sources={"customers": customers},
+    )
+
+    assert "".join(sql2csv(db_engine, dataset)) == "country,customers\nFrance,17\n"
+    assert result_cache.stats.misses == 1
+
+    # Sources results are served from the cache
+    with pa.BufferReader(b"".join(sql2parquet(None, dataset))) as buffer:
+        table = parquet.read_table(buffer)
+    assert table.schema.names == ["country", "customers"]
+    assert table.to_pydict() == {"country": ["France"], "customers": [17]}
+    assert result_cache.stats.misses == 1
+
+    # Requests filters, selection and head apply to the derived result
+    bound = dataset.bind({"customers": "gt.20"})
+    assert list(fetch_batches(None, bound))[0].num_rows == 0
+    bound = dataset.bind({"select": "customers", "head": "1"})
+    assert [b.to_pydict() for b in fetch_batches(None, bound)] == [{"customers": [17]}]
+
+    # Empty results have a schema
+    dataset.derive.filters = [Filter("country", "eq", "Spain")]
+    assert b"".join(sql2csv_arrow(None, dataset)) == b'"country","customers"\n'
+
+
+def test_sql2csv_derived_dataset_with_nulls(db_engine):
+    """Test derived datasets CSV rows are formatted as their source CSV rows."""
+    invoices = Dataset(
+        basename="invoices",
+        query=(
+            "SELECT "
+            "InvoiceId as id, "
+            "CASE WHEN InvoiceId % 3 = 0 THEN NULL ELSE CustomerId END as customer, "
+            "CASE WHEN InvoiceId % 4 = 0 THEN NULL ELSE Total END as total "
+            "FROM Invoice "
+            "ORDER BY id"
+        ),
+    )
+    dataset = Dataset(
+        basename="first_invoices",
+        derive=Derivation(source="invoices", filters=[Filter("id", "lt", "13")]),
+        sources={"invoices": invoices},
+    )
+    lines = "".join(sql2csv(db_engine, invoices)).splitlines()
+    assert lines[4] == "4,1.0,"
+
+    assert "".join(sql2csv(db_engine, dataset)).splitlines() == lines[:13]
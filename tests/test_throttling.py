@@ -0,0 +1,119 @@
+"""Tests for the data7.throttling module."""
+
+import time
+
+import pytest
+from starlette.requests import HTTPConnection
+
+from data7.config import settings
+from data7.throttling import Throttle, Throttler, TokenBucket, get_throttler
+
+# Token buckets rate (bytes per second) used in tests
+RATE = 1000
+
+
+def get_connection(host: str = "127.0.0.1", headers=None) -> HTTPConnection:
+    """Get an HTTP connection from a client."""
+    return HTTPConnection(
+        {
+            "type": "http",
+            "client": (host, 1234),
+            "headers": [
+                (k.lower().encode(), v.encode()) for k, v in (headers or {}).items()
+            ],
+        }
+    )
+
+
+def test_token_bucket():
+    """Test the TokenBucket class."""
+    bucket = TokenBucket(rate=RATE, burst=500)
+    # The burst is consumed without delay
+    assert bucket.reserve(500) == 0
+    # Borrowed tokens are available later on
+    assert bucket.reserve(100) == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve(100) == pytest.approx(0.2, abs=0.01)
+
+
+def test_throttler_get_client():
+    """Test the Throttler.get_client method."""
+    throttler = Throttler(rate=RATE, burst=RATE)
+    assert throttler.get_client(get_connection()) == "ip:127.0.0.1"
+    assert throttler.get_client(get_connection(headers={"X-API-Key": "foo"})) == (
+        "ip:127.0.0.1"
+    )
+
+    throttler = Throttler(
+        rate=RATE, burst=RATE, client_header="X-API-Key", client_keys=["foo"]
+    )
+    assert throttler.get_client(get_connection(headers={"X-API-Key": "foo"})) == (
+        "key:foo"
+    )
+    assert throttler.get_client(get_connection("10.0.0.1")) == "ip:10.0.0.1"
+    # Unknown keys do not identify clients
+    assert throttler.get_client(get_connection(headers={"X-API-Key": "bar"})) == (
+        "ip:127.0.0.1"
+    )
+
+
+def test_throttler_get_bucket():
+    """Test the Throttler.get_bucket method."""
+    throttler = Throttler(rate=RATE, burst=RATE, max_clients=2)
+    bucket = throttler.get_bucket("ip:10.0.0.1")
+    assert throttler.get_bucket("ip:10.0.0.1") is bucket
+    assert throttler.get_bucket("ip:10.0.0.2") is not bucket
+
+    # Least recently used clients buckets are evicted
+    throttler.get_bucket("ip:10.0.0.3")
+    assert throttler.get_bucket("ip:10.0.0.1") is not bucket
+
+
+def test_throttler_throttle():
+    """Test the Throttler.throttle method."""
+    throttler = Throttler(rate=RATE, burst=RATE, bulk_threads=1)
+    first = throttler.throttle(get_connection())
+    second = throttler.throttle(get_connection())
+    # Concurrent client downloads share the client bucket
+    assert first.bucket is second.bucket
+    assert first.limiter is None
+
+    first.sent = RATE + 1
+    assert first.bulk is True
+    assert first.limiter is throttler.bulk_limiter
+    assert second.limiter is None
+
+
+@pytest.mark.anyio
+async def test_throttle_consume():
+    """Test the Throttle.consume method."""
+    throttle = Throttle(TokenBucket(rate=RATE, burst=100), bulk_limiter=None)
+
+    start = time.perf_counter()
+    await throttle.consume(100)
+    assert time.perf_counter() - start < 0.05  # noqa: PLR2004
+
+    await throttle.consume(100)
+    assert time.perf_counter() - start >= 0.09  # noqa: PLR2004
+    assert throttle.sent == 200  # noqa: PLR2004
+
+
+def test_get_throttler(monkeypatch):
+    """Test the get_throttler function."""
+    get_throttler.cache_clear()
+    assert get_throttler() is None
+
+    monkeypatch.setattr(settings, "THROTTLE_RATE", RATE)
+    monkeypatch.setattr(settings, "THROTTLE_BURST", 10 * RATE)
+    monkeypatch.setattr(settings, "THROTTLE_CLIENT_HEADER", "X-API-Key")
+    monkeypatch.setattr(settings, "THROTTLE_CLIENT_KEYS", ["foo"], raising=False)
+    get_throttler.cache_clear()
+    throttler = get_throttler()
+    assert throttler is not None
+    assert throttler.rate == RATE
+    assert throttler.burst == 10 * RATE
+    assert throttler.client_header == "X-API-Key"
+    assert throttler.client_keys == {"foo"}
+    assert throttler.bulk_limiter is not None
+    assert throttler.bulk_limiter.total_tokens == settings.THROTTLE_BULK_THREADS
+
+    get_throttler.cache_clear()
@@ -0,0 +1,53 @@
+"""Tests for the data7.timing module."""
+
+import re
+
+from data7.timing import Timings, current_timings, measure, timed
+
+
+def test_timings():
+    """Test the Timings class."""
+    timings = Timings()
+    assert timings.to_header() == ""
+
+    timings.add("fetch", 0.001)
+    timings.add("fetch", 0.002)
+    timings.add("encode", 0.0105)
+    assert timings.stages == {"fetch": 0.003, "encode": 0.0105}
+    assert timings.to_header() == "fetch;dur=3.0, encode;dur=10.5"
+    assert re.match(
+        r"^fetch;dur=3.0, encode;dur=10.5, total;dur=\d+\.\d$",
+        timings.to_header(total=True),
+    )
+    assert timings.total > 0
+
+
+def test_measure():
+    """Test the measure context manager."""
+    # No active timings
+    with measure("encode"):
+        pass
+
+    timings = Timings()
+    token = current_timings.set(timings)
+    with measure("encode"):
+        pass
+    with measure("encode"):
+        pass
+    current_timings.reset(token)
+    assert list(timings.stages) == ["encode"]
+    assert timings.stages["encode"] > 0
+
+
+def test_timed():
+    """Test the timed generator."""
+    # No active timings
+    assert list(timed(range(3), "fetch")) == [0, 1, 2]
+
+    timings = Timings()
+    token = current_timings.set(timings)
+    assert list(timed(range(3), "fetch", first="first-chunk")) == [0, 1, 2]
+    assert list(timed([], "send", first="first-send")) == []
+    current_timings.reset(token)
+    assert list(timings.stages) == ["fetch", "first-chunk", "send"]
+    assert timings.stages["fetch"] >= timings.stages["first-chunk"]
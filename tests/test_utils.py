@@ -1,10 +1,14 @@
 """Tests for the data7.utils module."""
 
 import pytest
+from sqlalchemy import String, TextClause
+from sqlalchemy.exc import ArgumentError
 
 from data7.config import settings
-from data7.models import Dataset
-from data7.utils import populate_datasets
+from data7.databases import DEFAULT_DATABASE, DatabaseRouter
+from data7.models import Database, Dataset
+from data7.preview import clear_samples, get_sample
+from data7.utils import get_statement, populate_datasets
 
 
 def test_populate_datasets(db_engine, monkeypatch):
@@ -101,3 +105,230 @@ def test_populate_datasets_with_invalid_query(db_engine, monkeypatch):
         ValueError, match="Dataset 'employees' query failed, maybe SQL is invalid"
     ):
         populate_datasets(db_engine)
+
+
+def test_populate_datasets_with_router(db_engine, monkeypatch, tmp_path):
+    """Test the populate_datasets function with named databases."""
+    employees_query = (
+        "SELECT "
+        "LastName as last_name, "
+        "FirstName as first_name, "
+        "city as city "
+        "FROM Employee"
+    )
+
+    monkeypatch.setattr(
+        settings,
+        "datasets",
+        [
+            {
+                "basename": "employees",
+                "query": employees_query,
+            },
+            {
+                "basename": "archived_employees",
+                "query": employees_query,
+                "database": "archives",
+            },
+        ],
+    )
+
+    # The archives database is empty: the query will fail
+    router = DatabaseRouter(
+        [
+            Database(name=DEFAULT_DATABASE, url=settings.DATABASE_URL),
+            Database(name="archives", url=f"sqlite:///{tmp_path / 'archives.db'}"),
+        ]
+    )
+    with pytest.raises(
+        ValueError,
+        match="Dataset 'archived_employees' query failed, maybe SQL is invalid",
+    ):
+        populate_datasets(db_engine, router)
+
+    # The archives database now targets the default one
+    router = DatabaseRouter(
+        [
+            Database(name=DEFAULT_DATABASE, url=settings.DATABASE_URL),
+            Database(name="archives", url=settings.DATABASE_URL),
+        ]
+    )
+    datasets = populate_datasets(db_engine, router)
+    assert [d.database for d in datasets] == [None, "archives"]
+
+    # Undefined database
+    router = DatabaseRouter(
+        [Database(name=DEFAULT_DATABASE, url=settings.DATABASE_URL)]
+    )
+    with pytest.raises(ValueError, match="Database 'archives' is not defined"):
+        populate_datasets(db_engine, router)
+
+
+def test_get_statement():
+    """Test the get_statement function."""
+    dataset = Dataset(basename="employees", query="SELECT * FROM Employee")
+    assert get_statement(dataset) == "SELECT * FROM Employee"
+
+    dataset = Dataset(
+        basename="employees",
+        query="SELECT * FROM Employee WHERE city = :city",
+        parameters=[{"name": "city"}],
+    )
+    statement = get_statement(dataset)
+    assert isinstance(statement, TextClause)
+    assert isinstance(statement._bindparams["city"].type, String)
+    # Statements are cached
+    assert get_statement(dataset.bind({"city": "Calgary"})) is statement
+
+    # Parameters should be used in the query
+    dataset.query = "SELECT * FROM Employee"
+    with pytest.raises(ArgumentError):
+        get_statement(dataset)
+
+
+def test_populate_datasets_with_parameters(db_engine, monkeypatch):
+    """Test the populate_datasets function with parameterized datasets."""
+    query = "SELECT city FROM Employee WHERE city = :city LIMIT :size"
+    monkeypatch.setattr(
+        settings,
+        "datasets",
+        [
+            {
+                "basename": "employees",
+                "query": query,
+                "parameters": [
+                    # Validated using NULL: the query has no result
+                    {"name": "city"},
+                    {"name": "size", "type": "int", "default": 10},
+                ],
+            },
+        ],
+    )
+    datasets = populate_datasets(db_engine)
+    assert [d.basename for d in datasets] == ["employees"]
+    assert datasets[0].required_parameters == ["city"]
+
+    # Declared parameters should be used in the query
+    monkeypatch.setattr(
+        settings,
+        "datasets",
+        [
+            {
+                "basename": "employees",
+                "query": "SELECT city FROM Employee",
+                "parameters": [{"name": "city"}],
+            },
+        ],
+    )
+    with pytest.raises(
+        ValueError, match="Dataset 'employees' parameters are not used in its query"
+    ):
+        populate_datasets(db_engine)
+
+    # Query parameters should be declared
+    monkeypatch.setattr(
+        settings, "datasets", [{"basename": "employees", "query": query}]
+    )
+    with pytest.raises(
+        ValueError, match="Dataset 'employees' query failed, maybe SQL is invalid"
+    ):
+        populate_datasets(db_engine)
+
+
+def test_populate_datasets_captures_samples(db_engine, monkeypatch, configure):
+    """Test the populate_datasets function captures datasets head samples."""
+    monkeypatch.setattr(
+        settings,
+        "datasets",
+        [{"basename": "customers", "query": "SELECT CustomerId FROM Customer"}],
+    )
+    datasets = populate_datasets(db_engine)
+    assert get_sample(datasets[0].bind({"head": "1"}), "pyarrow") is None
+
+    configure(PREVIEW_ROWS=5)
+    try:
+        datasets = populate_datasets(db_engine)
+        table = get_sample(datasets[0].bind({"head": "5"}), "pyarrow")
+        assert table is not None
+        assert table["CustomerId"].to_pylist() == [1, 2, 3, 4, 5]
+    finally:
+        clear_samples()
+
+
+def test_populate_datasets_with_derived_datasets(db_engine, monkeypatch, caplog):
+    """Test the populate_datasets function with derived datasets."""
+    customers = {
+        "basename": "customers",
+        "query": "SELECT CustomerId as id, Country as country FROM Customer",
+    }
+    countries = {
+        "basename": "countries",
+        "derive": {
+            "source": "customers",
+            "group_by": ["country"],
+            "aggregates": [{"column": "id", "function": "count"}],
+        },
+    }
+    monkeypatch.setattr(settings, "datasets", [customers, countries])
+    datasets = populate_datasets(db_engine)
+    assert [d.basename for d in datasets] == ["customers", "countries"]
+    assert datasets[1].sources == {"customers": datasets[0]}
+    assert datasets[1].database is None
+
+    # Sources should be defined first (and active)
+    monkeypatch.setattr(settings, "datasets", [countries, customers])
+    datasets = populate_datasets(db_engine)
+    assert [d.basename for d in datasets] == ["customers"]
+    assert "'countries' source 'customers' is not active" in caplog.text
+
+    # Sources should not have required parameters
+    monkeypatch.setattr(
+        settings,
+        "datasets",
+        [
+            {
+                **customers,
+                "query": f"{customers['query']} WHERE Country = :country",
+                "parameters": [{"name": "country"}],
+            },
+            countries,
+        ],
+    )
+    with pytest.raises(
+        ValueError, match="Dataset 'countries' source 'customers' has required"
+    ):
+        populate_datasets(db_engine)
+
+
+def test_populate_derived_datasets_databases(db_engine, monkeypatch):
+    """Test that derived datasets sources should query the same database."""
+    router = DatabaseRouter(
+        [
+            Database(name=DEFAULT_DATABASE, url=settings.DATABASE_URL),
+            Database(name="other", url=settings.DATABASE_URL),
+        ]
+    )
+    datasets = [
+        {"basename": "customers", "query": "SELECT * FROM Customer"},
+        {"basename": "employees", "query": "SELECT * FROM Employee"},
+        {
+            "basename": "staff",
+            "derive": {
+                "source": "customers",
+                "join": {"dataset": "employees", "keys": ["City"]},
+            },
+        },
+    ]
+    monkeypatch.setattr(settings, "datasets", datasets)
+    assert populate_datasets(db_engine, router)[-1].basename == "staff"
+
+    datasets[1]["database"] = "other"
+    monkeypatch.setattr(settings, "datasets", datasets)
+    with pytest.raises(
+        ValueError, match="Dataset 'staff' sources query different databases"
+    ):
+        populate_datasets(db_engine, router)
+
+    datasets[0]["database"] = "other"
+    monkeypatch.setattr(settings, "datasets", datasets)
+    assert populate_datasets(db_engine, router)[-1].database == "other"